@@ -11,7 +11,10 @@ import os
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 from channels.security.websocket import AllowedHostsOriginValidator
-from FriendNet_Backend.middleware import TokenAuthMiddleware
+from FriendNet_Backend.middleware import (
+    TokenAuthMiddleware,
+    WebsocketMetricsMiddleware,
+)
 from channels.auth import AuthMiddlewareStack
 from social import routing
 
@@ -21,11 +24,12 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "FriendNet_Backend.settings.dev"
 application = ProtocolTypeRouter(
     {
         "http": get_asgi_application(),
-        "websocket":
-        #   AllowedHostsOriginValidator(
-        TokenAuthMiddleware(
-            AuthMiddlewareStack(URLRouter(routing.websocket_urlpatterns))
-        )
-        # ),
+        "websocket": WebsocketMetricsMiddleware(
+            #   AllowedHostsOriginValidator(
+            TokenAuthMiddleware(
+                AuthMiddlewareStack(URLRouter(routing.websocket_urlpatterns))
+            )
+            # ),
+        ),
     }
 )
@@ -0,0 +1,150 @@
+import asyncio
+import contextvars
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import close_old_connections, connections
+from . import metrics
+
+# Websocket consumers run their database work on a bounded pool of threads.
+# Each thread keeps its own connections open between calls, so a reconnect
+# storm reuses at most DB_POOL_SIZE connections per worker process instead of
+# opening one per call. Connections older than CONN_MAX_AGE or failing the
+# CONN_HEALTH_CHECKS probe are replaced before a task runs, and threads that
+# sit idle for DB_POOL_IDLE_TIMEOUT close their connections and exit.
+
+POOL_THREADS = metrics.gauge("db_pool_threads", "Database pool worker threads.")
+POOL_BUSY = metrics.gauge("db_pool_busy_threads", "Pool threads running a task.")
+POOL_QUEUED = metrics.gauge("db_pool_queued_tasks", "Tasks waiting for a thread.")
+POOL_CONNECTIONS = metrics.gauge(
+    "db_pool_open_connections", "Database connections held by pool threads."
+)
+POOL_REAPED = metrics.counter(
+    "db_pool_connections_reaped_total", "Pool connections closed for being idle."
+)
+POOL_WAIT = metrics.histogram(
+    "db_pool_wait_seconds", "Time tasks waited for a pool thread."
+)
+
+
+def _open_connections():
+    return [
+        connection
+        for connection in connections.all(initialized_only=True)
+        if connection.connection is not None
+    ]
+
+
+class ConnectionPool:
+    def __init__(self, size, idle_timeout):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = 0
+        self.idle = 0
+        self.open = {}
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        task = (future, contextvars.copy_context(), func, args, kwargs)
+        with self.lock:
+            self.tasks.put((task, time.monotonic()))
+            if self.tasks.qsize() > self.idle and self.threads < self.size:
+                self.threads += 1
+                threading.Thread(target=self.work, name="db-pool", daemon=True).start()
+            self.report()
+        return future
+
+    def work(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            try:
+                task, queued_at = self.tasks.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self.lock:
+                    self.idle -= 1
+                    # A task queued while timing out still needs this thread.
+                    if not self.tasks.empty():
+                        continue
+                    self.threads -= 1
+                self.reap()
+                return
+            with self.lock:
+                self.idle -= 1
+            POOL_WAIT.observe(time.monotonic() - queued_at)
+            self.run(*task)
+
+    def run(self, future, context, func, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        POOL_BUSY.inc()
+        close_old_connections()
+        try:
+            future.set_result(context.run(func, *args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            close_old_connections()
+            POOL_BUSY.dec()
+            with self.lock:
+                self.open[threading.get_ident()] = len(_open_connections())
+                self.report()
+
+    def reap(self):
+        for connection in _open_connections():
+            connection.close()
+            POOL_REAPED.inc()
+        with self.lock:
+            self.open.pop(threading.get_ident(), None)
+            self.report()
+
+    def report(self):
+        POOL_THREADS.set(self.threads)
+        POOL_QUEUED.set(self.tasks.qsize())
+        POOL_CONNECTIONS.set(sum(self.open.values()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": self.size,
+                "threads": self.threads,
+                "idle": self.idle,
+                "queued": self.tasks.qsize(),
+                "open_connections": sum(self.open.values()),
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def get_pool():
+    return ConnectionPool(settings.DB_POOL_SIZE, settings.DB_POOL_IDLE_TIMEOUT)
+
+
+def database_sync_to_async(func):
+    # Drop-in replacement for channels.db.database_sync_to_async.
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.wrap_future(get_pool().submit(func, *args, **kwargs))
+
+    return wrapper
+
+
+def close_request_connections(sender, **kwargs):
+    # Django runs every ASGI request on a thread of its own, so connections
+    # kept open for CONN_MAX_AGE would only linger until that thread is
+    # garbage collected. Close them when the request ends instead.
+    from django.core.handlers.asgi import ASGIHandler
+
+    if not (isinstance(sender, type) and issubclass(sender, ASGIHandler)):
+        return
+    for connection in _open_connections():
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+request_finished.connect(close_request_connections)
@@ -0,0 +1,36 @@
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from django.utils.module_loading import import_string
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Hand records to a background thread that feeds the ``target`` handler, so
+    logging never blocks the event loop on file or console I/O. Extra keyword
+    arguments are passed to the target handler. Records are dropped when the
+    queue is full.
+    """
+
+    def __init__(self, target="logging.StreamHandler", maxsize=10_000, **kwargs):
+        super().__init__(queue.Queue(maxsize))
+        self.target = import_string(target)(**kwargs)
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
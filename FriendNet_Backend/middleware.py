@@ -1,7 +1,15 @@
 import jwt
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from channels.db import database_sync_to_async
+from django.core.cache import cache
+from .db_pool import database_sync_to_async
+from django.middleware.gzip import GZipMiddleware
+from . import db_router, metrics
+
+logger = logging.getLogger(__name__)
 
 
 class TokenAuthMiddleware:
@@ -25,3 +33,255 @@ class TokenAuthMiddleware:
     def get_user(self, user_id):
         User = get_user_model()
         return User.objects.get(id=user_id)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        if (
+            not response.streaming
+            and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_LENGTH
+        ):
+            return response
+        return super().process_response(request, response)
+
+
+class ReplicaRoutingMiddleware:
+    # Sends the reads of ``list``/``retrieve`` actions (settings
+    # REPLICA_READ_ACTIONS) and of views marked ``replica_reads`` to
+    # settings.DATABASE_REPLICAS. After a user writes, their reads stay on the
+    # primary for REPLICA_PIN_SECONDS so they see their own changes.
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state, token = db_router.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.end(token)
+        user_id = self.written_by(request, state)
+        if user_id is not None:
+            cache.set(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        state, token = db_router.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            db_router.end(token)
+        user_id = self.written_by(request, state)
+        if user_id is not None:
+            await cache.aset(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def written_by(self, request, state):
+        if not state.wrote or not settings.DATABASE_REPLICAS:
+            return None
+        user = getattr(request, "user", None)
+        return user.id if user is not None and user.is_authenticated else None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = db_router.current()
+        if (
+            state is None
+            or not settings.DATABASE_REPLICAS
+            or request.method not in ("GET", "HEAD")
+            or not self.reads_only(request, view_func)
+        ):
+            return None
+        user_id = request_user_id(request)
+        state.use_replica = user_id is None or not cache.get(pin_key(user_id))
+        return None
+
+    def reads_only(self, request, view_func):
+        actions = getattr(view_func, "actions", None)
+        if actions is None:
+            return getattr(view_func, "replica_reads", False)
+        return actions.get(request.method.lower()) in settings.REPLICA_READ_ACTIONS
+
+
+def pin_key(user_id):
+    return f"replica_pin:{user_id}"
+
+
+def request_user_id(request):
+    # DRF authenticates inside the view, so JWT users are identified from
+    # the token here without a database lookup. Imported lazily because
+    # asgi.py imports this module before Django is set up.
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.settings import api_settings
+
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.id
+    authentication = JWTAuthentication()
+    try:
+        header = authentication.get_header(request)
+        raw_token = header and authentication.get_raw_token(header)
+        if not raw_token:
+            return None
+        token = authentication.get_validated_token(raw_token)
+    except AuthenticationFailed:
+        return None
+    return token.get(api_settings.USER_ID_CLAIM)
+
+
+HTTP_REQUESTS = metrics.counter(
+    "http_requests_total", "HTTP requests by view and status.", ["view", "status"]
+)
+HTTP_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "Total time spent handling requests.", ["view"]
+)
+HTTP_DB_QUERIES = metrics.histogram(
+    "http_db_queries",
+    "Database queries per request.",
+    ["view"],
+    buckets=metrics.COUNT_BUCKETS,
+)
+HTTP_DB_DURATION = metrics.histogram(
+    "http_db_duration_seconds", "Time spent in database queries.", ["view"]
+)
+HTTP_SERIALIZATION_DURATION = metrics.histogram(
+    "http_serialization_duration_seconds",
+    "Time spent rendering response bodies.",
+    ["view"],
+)
+QUERY_BUDGET_EXCEEDED = metrics.counter(
+    "http_query_budget_exceeded_total",
+    "Requests that ran more queries than their view allows.",
+    ["view"],
+)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class MetricsMiddleware:
+    # Viewsets declare ``query_budget = {"<action>": <max queries>}``. Going
+    # over budget is logged, or raised when QUERY_BUDGETS_STRICT is set so
+    # the test suite fails.
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            # Lets async views under Daphne run without a thread hop here.
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with metrics.track_queries() as queries:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with metrics.track_queries() as queries:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def record(self, request, response, duration, queries):
+        view, budget = getattr(request, "_metrics_view", ("unresolved", None))
+        HTTP_REQUESTS.inc(view=view, status=response.status_code)
+        HTTP_DURATION.observe(duration, view=view)
+        HTTP_DB_QUERIES.observe(queries.count, view=view)
+        HTTP_DB_DURATION.observe(queries.duration, view=view)
+        render_time = getattr(request, "_metrics_render_time", None)
+        if render_time is not None:
+            HTTP_SERIALIZATION_DURATION.observe(render_time, view=view)
+
+        if budget is not None and queries.count > budget:
+            QUERY_BUDGET_EXCEEDED.inc(view=view)
+            message = f"{view} ran {queries.count} queries (budget {budget})."
+            if settings.QUERY_BUDGETS_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, "cls", None)
+        if view_class is None:
+            request._metrics_view = (
+                f"{view_func.__module__}.{view_func.__name__}",
+                getattr(view_func, "query_budget", None),
+            )
+            return None
+        actions = getattr(view_func, "actions", None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        budget = getattr(view_class, "query_budget", {}).get(action)
+        request._metrics_view = (f"{view_class.__name__}.{action}", budget)
+        return None
+
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def record(rendered):
+            request._metrics_render_time = time.perf_counter() - start
+
+        response.add_post_render_callback(record)
+        return response
+
+
+WS_CONNECTIONS = metrics.gauge(
+    "websocket_connections", "Open websocket connections.", ["path"]
+)
+WS_CONNECTION_DURATION = metrics.histogram(
+    "websocket_connection_duration_seconds",
+    "Lifetime of websocket connections.",
+    ["path"],
+    buckets=(1, 10, 60, 300, 900, 3600, 14400, 86400),
+)
+WS_FRAMES = metrics.counter(
+    "websocket_frames_total", "Websocket frames by direction.", ["path", "direction"]
+)
+
+
+class WebsocketMetricsMiddleware:
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        path = scope["path"]
+        accepted_at = None
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "websocket.receive":
+                WS_FRAMES.inc(path=path, direction="in")
+            return message
+
+        async def send_wrapper(message):
+            nonlocal accepted_at
+            if message["type"] == "websocket.send":
+                WS_FRAMES.inc(path=path, direction="out")
+            elif message["type"] == "websocket.accept" and accepted_at is None:
+                accepted_at = time.perf_counter()
+                WS_CONNECTIONS.inc(path=path)
+            return await send(message)
+
+        try:
+            return await self.inner(scope, receive_wrapper, send_wrapper)
+        finally:
+            if accepted_at is not None:
+                WS_CONNECTIONS.dec(path=path)
+                WS_CONNECTION_DURATION.observe(
+                    time.perf_counter() - accepted_at, path=path
+                )
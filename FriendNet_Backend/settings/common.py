@@ -1,10 +1,12 @@
 from datetime import timedelta
 import os
 from pathlib import Path
-import cloudinary_storage
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
+# Apps and middleware needed everywhere. dev.py adds the debug toolbar and
+# prod.py the Cloudinary storage apps and WhiteNoise, so neither is imported
+# where it isn't used.
 INSTALLED_APPS = [
     "daphne",
     "django.contrib.admin",
@@ -12,11 +14,8 @@ INSTALLED_APPS = [
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
-    "cloudinary_storage",
     "django.contrib.staticfiles",
-    "cloudinary",
     "rest_framework",
-    "debug_toolbar",
     "django_filters",
     "channels",
     "djoser",
@@ -27,10 +26,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "FriendNet_Backend.middleware.MetricsMiddleware",
+    "FriendNet_Backend.middleware.ReplicaRoutingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -39,6 +38,16 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Gzip API responses larger than RESPONSE_COMPRESSION_MIN_LENGTH bytes.
+RESPONSE_COMPRESSION = os.environ.get("RESPONSE_COMPRESSION", "1") == "1"
+RESPONSE_COMPRESSION_MIN_LENGTH = 4096
+
+if RESPONSE_COMPRESSION:
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index("corsheaders.middleware.CorsMiddleware") + 1,
+        "FriendNet_Backend.middleware.CompressionMiddleware",
+    )
+
 
 ASGI_APPLICATION = "FriendNet_Backend.asgi.application"
 
@@ -47,6 +56,14 @@ INTERNAL_IPS = [
     "127.0.0.1",
 ]
 
+# Addresses allowed to scrape /metrics without a staff session.
+METRICS_ALLOWED_IPS = INTERNAL_IPS
+
+# Raise instead of logging when a view runs more queries than its
+# ``query_budget`` allows. Always on under the test runner.
+QUERY_BUDGETS_STRICT = os.environ.get("QUERY_BUDGETS_STRICT") == "1"
+TEST_RUNNER = "FriendNet_Backend.test_runner.TestRunner"
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
     "http://127.0.0.1:5173",
@@ -107,12 +124,24 @@ AUTH_USER_MODEL = "core.User"
 
 REST_FRAMEWORK = {
     "COERCE_DECIMAL_TO_STRING": False,
+    "DEFAULT_RENDERER_CLASSES": [
+        "FriendNet_Backend.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "FriendNet_Backend.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "social.throttling.TokenBucketThrottle",
+    ],
 }
 
 
@@ -126,9 +155,13 @@ LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "handlers": {
-        "console": {"class": "logging.StreamHandler"},
+        "console": {
+            "class": "FriendNet_Backend.log_handlers.AsyncHandler",
+            "target": "logging.StreamHandler",
+        },
         "file": {
-            "class": "logging.FileHandler",
+            "class": "FriendNet_Backend.log_handlers.AsyncHandler",
+            "target": "logging.FileHandler",
             "filename": "general.log",
             "formatter": "verbose",
         },
@@ -146,3 +179,128 @@ LOGGING = {
         }
     },
 }
+
+
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_CANDIDATES = 500
+TYPEAHEAD_BUDGET_MS = 20
+# Username changes stay in the shared journal for USERNAME_JOURNAL_TIMEOUT
+# seconds; an index further behind than that, or USERNAME_JOURNAL_MAX
+# changes, is rebuilt instead.
+USERNAME_JOURNAL_TIMEOUT = 60 * 60
+USERNAME_JOURNAL_MAX = 1000
+
+
+# Database connections are reused for DB_CONN_MAX_AGE seconds and checked
+# before reuse. Websocket consumers run their queries on a pool of at most
+# DB_POOL_SIZE threads per process; threads idle for DB_POOL_IDLE_TIMEOUT
+# seconds close their connections.
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", 600))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_POOL_IDLE_TIMEOUT = 60
+
+DATABASE_ROUTERS = ["FriendNet_Backend.db_router.ReplicaRouter"]
+
+# Aliases in DATABASES that serve the reads of REPLICA_READ_ACTIONS. A user's
+# reads stay on the primary for REPLICA_PIN_SECONDS after they write.
+DATABASE_REPLICAS = []
+REPLICA_READ_ACTIONS = ["list", "retrieve"]
+REPLICA_PIN_SECONDS = 10
+
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+RESPONSE_CACHE_TIMEOUT = 60 * 5
+
+
+# Prefix for media URLs in API responses. When unset, URLs are built from the
+# host of the current request.
+MEDIA_PUBLIC_BASE_URL = os.environ.get("MEDIA_PUBLIC_BASE_URL")
+MEDIA_URL_CACHE_SIZE = 100_000
+MEDIA_URL_CACHE_TTL = 60 * 10
+
+# Serve post and message listings from social.fastpath instead of the DRF
+# serializers.
+FAST_READ_SERIALIZERS = os.environ.get("FAST_READ_SERIALIZERS") == "1"
+
+# Chat and group messages older than this move to the archive tables when
+# the archive_messages command runs, MESSAGE_ARCHIVE_BATCH_SIZE at a time.
+MESSAGE_ARCHIVE_AFTER_DAYS = 90
+MESSAGE_ARCHIVE_BATCH_SIZE = 1000
+
+# Rows fetched per database round trip by the streaming data export.
+EXPORT_CHUNK_SIZE = 2000
+
+# Change feed served by /api/sync/: entries are kept for
+# CHANGELOG_RETENTION_DAYS (see the compact_changes command), sync tokens only
+# move past entries older than SYNC_SETTLE_SECONDS, and each sync returns at
+# most SYNC_PAGE_SIZE entries. Entries are written after commit, on a
+# background thread unless CHANGELOG_IN_BACKGROUND is off.
+CHANGELOG_RETENTION_DAYS = 30
+SYNC_SETTLE_SECONDS = 5
+SYNC_PAGE_SIZE = 500
+CHANGELOG_IN_BACKGROUND = True
+
+# Trending feed ranking in social.trending: engagement loses half its weight
+# every TRENDING_HALF_LIFE seconds and the best TRENDING_SIZE posts are kept
+# ranked, in process or in Redis when TRENDING_BACKEND is "redis". Engagement
+# is applied in batches every TRENDING_FLUSH_SECONDS, or on commit when 0.
+TRENDING_BACKEND = os.environ.get("TRENDING_BACKEND", "local")
+TRENDING_REDIS_URL = os.environ.get("REDIS_URL", "redis://127.0.0.1:6379")
+TRENDING_HALF_LIFE = 60 * 60 * 12
+TRENDING_SIZE = 100
+TRENDING_WEIGHTS = {"post": 1, "like": 1, "comment": 3, "save": 2}
+TRENDING_FLUSH_SECONDS = 1
+
+# Default and largest page sizes of the feeds, async and DRF, and of the
+# message history endpoints.
+ASYNC_PAGE_SIZE = 20
+ASYNC_PAGE_SIZE_MAX = 100
+
+# Fraction of delivered chat messages whose end-to-end latency is recorded.
+CHAT_LATENCY_SAMPLE_RATE = 0.1
+
+# Largest user_ids list accepted by the bulk group membership endpoints, the
+# page size of group member listings and how many members group listings
+# embed.
+GROUP_BULK_MEMBERS_MAX = 500
+GROUP_MEMBERS_PAGE_SIZE = 50
+GROUP_MEMBERS_PREVIEW = 5
+
+# Largest number of posts one bulk like or save request may change.
+ENGAGEMENT_BULK_MAX = 500
+
+# Group discovery ranked by friends ranks at most this many groups by how
+# many friends are members; the rest follow newest first.
+GROUP_DISCOVERY_MAX_RANKED = 500
+
+# Token bucket limits for write paths: ``capacity`` is the allowed burst and
+# ``rate`` the tokens refilled per second. Buckets live in process memory
+# unless RATE_LIMIT_BACKEND is "redis".
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "local")
+RATE_LIMIT_REDIS_URL = os.environ.get("REDIS_URL", "redis://127.0.0.1:6379")
+RATE_LIMIT_LOCAL_MAX_KEYS = 100_000
+RATE_LIMITS = {
+    "chat_message": {"capacity": 20, "rate": 2},
+    "post": {"capacity": 10, "rate": 0.1},
+    "comment": {"capacity": 20, "rate": 0.5},
+    "like": {"capacity": 60, "rate": 2},
+    "friend_request": {"capacity": 20, "rate": 0.05},
+}
+
+# Unread notifications of the same kind about the same post are merged into
+# one for this long.
+NOTIFICATION_COALESCE_SECONDS = 60 * 60
+
+# Deleted posts are purged, and orphaned media files removed, on a background
+# thread. Storage deletes are retried with exponential backoff, and posts
+# whose purge failed are retried every PURGE_RETRY_SECONDS.
+DELETION_IN_BACKGROUND = True
+PURGE_BATCH_SIZE = 1000
+PURGE_RETRY_SECONDS = 60 * 5
+STORAGE_DELETE_RETRIES = 3
+STORAGE_DELETE_BACKOFF = 0.5
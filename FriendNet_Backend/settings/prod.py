@@ -10,6 +10,17 @@ SECRET_KEY = os.environ["SECRET_KEY"]
 ALLOWED_HOSTS = ["friendnet-fju8.onrender.com"]
 
 
+INSTALLED_APPS.insert(
+    INSTALLED_APPS.index("django.contrib.staticfiles"), "cloudinary_storage"
+)
+INSTALLED_APPS.insert(
+    INSTALLED_APPS.index("django.contrib.staticfiles") + 1, "cloudinary"
+)
+MIDDLEWARE.insert(
+    MIDDLEWARE.index("django.middleware.security.SecurityMiddleware") + 1,
+    "whitenoise.middleware.WhiteNoiseMiddleware",
+)
+
 STATIC_URL = "/static/"
 STATICFILES_STORAGE = "cloudinary_storage.storage.StaticHashedCloudinaryStorage"
 
@@ -27,11 +38,34 @@ CLOUDINARY_STORAGE = {
 
 DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.RawMediaCloudinaryStorage"
 
-DATABASES = {"default": dj_database_url.config()}
+DATABASES = {
+    "default": dj_database_url.config(
+        conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True
+    )
+}
+
+# Comma separated URLs of read replicas of the default database.
+DATABASE_REPLICA_URLS = [
+    url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url
+]
+for index, url in enumerate(DATABASE_REPLICA_URLS):
+    DATABASES[f"replica{index}"] = {
+        **dj_database_url.parse(
+            url, conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True
+        ),
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_REPLICAS = [f"replica{index}" for index in range(len(DATABASE_REPLICA_URLS))]
 
 
 REDIS_URL = os.environ["REDIS_URL"]
 
+RATE_LIMIT_BACKEND = "redis"
+RATE_LIMIT_REDIS_URL = REDIS_URL
+
+TRENDING_BACKEND = "redis"
+TRENDING_REDIS_URL = REDIS_URL
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -40,3 +74,11 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    }
+}
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    # Every view is held to its query budget while the suite runs, whatever
+    # QUERY_BUDGETS_STRICT is set to in the environment. Change feed entries
+    # are written inline: a worker thread would write them through its own
+    # connection, outside the test's transaction.
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_BUDGETS_STRICT = True
+        settings.CHANGELOG_IN_BACKGROUND = False
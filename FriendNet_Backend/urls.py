@@ -18,16 +18,19 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-import debug_toolbar
+from FriendNet_Backend.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
-    path('__debug__/', include(debug_toolbar.urls)),
-    path('api/', include('social.urls'))
+    path('api/', include('social.urls')),
+    path('metrics', metrics_view),
 ]
 
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
+
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL,
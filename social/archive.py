@@ -0,0 +1,66 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from .deletion import delete_rows
+from .models import ChatMessage, ChatMessageArchive, GroupMessages, GroupMessagesArchive
+
+# Hot/cold tiering for messages: rows older than MESSAGE_ARCHIVE_AFTER_DAYS
+# move to the archive tables so the hot tables and their indexes stay small.
+# Ids are preserved, and only rows below the oldest message that stays hot are
+# moved, so archived ids are always lower than hot ones. The history
+# endpoints rely on that to continue into the archive when a page runs past
+# the hot rows.
+
+ARCHIVES = {ChatMessage: ChatMessageArchive, GroupMessages: GroupMessagesArchive}
+FIELDS = ["id", "room_id", "sender_id", "text", "file", "created_at"]
+
+
+def archive_messages(model, before, batch_size):
+    archive = ARCHIVES[model]
+    # Everything below the oldest message that stays hot is moved, so rows
+    # written while this runs are never touched.
+    kept = model.objects.filter(created_at__gte=before)
+    cutoff = kept.aggregate(id=Min("id"))["id"]
+    if cutoff is None:
+        cutoff = (model.objects.aggregate(id=Max("id"))["id"] or 0) + 1
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                model.objects.filter(id__lt=cutoff)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return moved
+            rows = model.objects.filter(id__in=ids).values(*FIELDS)
+            archive.objects.bulk_create(
+                (archive(**row) for row in rows), ignore_conflicts=True
+            )
+            # delete_rows skips post_delete, which would delete the files the
+            # archived rows still point at.
+            delete_rows(model, ids)
+        moved += len(ids)
+
+
+def archive_old_messages(days=None, batch_size=None):
+    days = settings.MESSAGE_ARCHIVE_AFTER_DAYS if days is None else days
+    before = timezone.now() - timedelta(days=days)
+    batch_size = batch_size or settings.MESSAGE_ARCHIVE_BATCH_SIZE
+    return {
+        model._meta.model_name: archive_messages(model, before, batch_size)
+        for model in ARCHIVES
+    }
+
+
+def latest_messages(model, rooms):
+    # The newest message of each room in ``rooms`` from ``model``, which may
+    # be an archive table.
+    return model.objects.filter(
+        id__in=model.objects.filter(room__in=rooms)
+        .values("room_id")
+        .annotate(latest=Max("id"))
+        .values("latest")
+    ).select_related("sender__user")
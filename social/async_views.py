@@ -0,0 +1,208 @@
+import asyncio
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from core.models import User
+from FriendNet_Backend.db_pool import database_sync_to_async
+from FriendNet_Backend.renderers import FastJSONRenderer
+from . import fastpath, membership, pagination
+from .archive import ARCHIVES, latest_messages
+from .media import storage_url
+from .models import (
+    ChatMessage,
+    ChatMessageArchive,
+    ChatRoom,
+    GroupMessages,
+    Like,
+    Notification,
+    Post,
+    Save,
+    UserProfile,
+)
+
+# Native async versions of the read-heavy endpoints. They skip DRF, so under
+# Daphne a slow request waits on the event loop instead of holding a thread
+# for its whole lifetime. Responses use the social.fastpath formats.
+
+_authentication = JWTAuthentication()
+_renderer = FastJSONRenderer()
+_avatar_storage = UserProfile._meta.get_field("profile_image").storage
+
+
+def _json(data, status=200):
+    return HttpResponse(
+        _renderer.render(data), status=status, content_type="application/json"
+    )
+
+
+async def _authenticate(request):
+    try:
+        header = _authentication.get_header(request)
+        raw_token = header and _authentication.get_raw_token(header)
+        if not raw_token:
+            return None
+        token = _authentication.get_validated_token(raw_token)
+    except AuthenticationFailed:
+        return None
+    return await User.objects.filter(
+        id=token[api_settings.USER_ID_CLAIM], is_active=True
+    ).afirst()
+
+
+def async_read_view(query_budget):
+    # Authenticates like JWTAuthentication and IsAuthenticated, and tags the
+    # view with a query budget for MetricsMiddleware and as safe to serve
+    # from read replicas.
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return HttpResponseNotAllowed(["GET", "HEAD"])
+            user = await _authenticate(request)
+            if user is None:
+                return _json(
+                    {"detail": "Authentication credentials were not provided."},
+                    status=401,
+                )
+            request.user = user
+            return await view(request, *args, **kwargs)
+
+        wrapper.query_budget = query_budget
+        wrapper.replica_reads = True
+        return wrapper
+
+    return decorator
+
+
+async def _rows(queryset):
+    # Pages are bounded, so the rows are fetched in one go. Django 4.2's
+    # aiterator() cannot stream tuple values_list() querysets.
+    return [row async for row in queryset]
+
+
+async def _page(queryset, request, archive=None):
+    # Newest first, paged with an id cursor: ``?before=<next>``. Archived
+    # rows have lower ids than hot ones, so a page that runs out of hot rows
+    # continues in ``archive``.
+    before, limit = pagination.page_args(request.GET)
+    rows = await _rows(pagination.before(queryset, before)[: limit + 1])
+    if archive is not None and len(rows) <= limit:
+        cursor = rows[-1][0] if rows else before
+        rows += await _rows(pagination.before(archive, cursor)[: limit + 1 - len(rows)])
+    next_id = rows[limit - 1][0] if len(rows) > limit else None
+    return rows[:limit], next_id
+
+
+async def _build(build, *args):
+    # Formatting may block: attachment sizes come from the storage backend
+    # and mentions from the username index, which syncs through the cache
+    # and loads from the database when cold. So it runs on the pool.
+    return await database_sync_to_async(build)(*args)
+
+
+def _build_posts(rows, likes, comments, saves, request):
+    return fastpath.build_posts(
+        rows,
+        fastpath.build_engagement(likes),
+        fastpath.build_comments(comments, request),
+        fastpath.build_engagement(saves),
+        request,
+    )
+
+
+@async_read_view(query_budget=5)
+async def feed(request):
+    rows, next_id = await _page(fastpath.post_rows(Post.objects.with_counts()), request)
+    post_ids = [row[0] for row in rows]
+    likes, comments, saves = await asyncio.gather(
+        _rows(fastpath.engagement_rows(Like, post_ids)),
+        _rows(fastpath.comment_rows(post_ids)),
+        _rows(fastpath.engagement_rows(Save, post_ids)),
+    )
+    results = await _build(_build_posts, rows, likes, comments, saves, request)
+    return _json({"next": next_id, "results": results})
+
+
+@async_read_view(query_budget=5)
+async def inbox(request):
+    user_id = request.user.id
+    rooms = ChatRoom.objects.filter(members=user_id)
+    friends, messages, archived, unread = await asyncio.gather(
+        _rows(
+            ChatRoom.members.through.objects.filter(chatroom__in=rooms)
+            .exclude(userprofile_id=user_id)
+            .values_list(
+                "chatroom_id",
+                "userprofile_id",
+                "userprofile__user__username",
+                "userprofile__profile_image",
+            )
+        ),
+        _rows(fastpath.chat_message_rows(latest_messages(ChatMessage, rooms))),
+        _rows(fastpath.chat_message_rows(latest_messages(ChatMessageArchive, rooms))),
+        Notification.objects.filter(recipient_id=user_id, is_read=False).acount(),
+    )
+    # A hot message is newer than any archived one in the same room.
+    latest = {
+        message["room_id"]: message
+        for message in await _build(
+            fastpath.build_chat_messages, archived + messages, request
+        )
+    }
+    results = [
+        {
+            "id": room_id,
+            "friend": {
+                "user_id": friend_id,
+                "username": username,
+                "profile_image": storage_url(_avatar_storage, profile_image, request),
+            },
+            "message": latest.get(room_id),
+        }
+        for room_id, friend_id, username, profile_image in friends
+    ]
+    # Most recent conversation first; rooms without messages go last.
+    results.sort(key=lambda room: -room["message"]["id"] if room["message"] else 0)
+    return _json({"unread_notifications": unread, "results": results})
+
+
+async def _history(request, is_member, room_id, model, rows, build):
+    if not await sync_to_async(is_member)(request.user.id, room_id):
+        return _json(
+            {"detail": "You do not have permission to perform this action."},
+            status=403,
+        )
+    page, next_id = await _page(
+        rows(model.objects.filter(room_id=room_id)),
+        request,
+        archive=rows(ARCHIVES[model].objects.filter(room_id=room_id)),
+    )
+    results = await _build(build, page, request)
+    return _json({"next": next_id, "results": results})
+
+
+@async_read_view(query_budget=4)
+async def chat_history(request, room_id):
+    return await _history(
+        request,
+        membership.is_room_member,
+        room_id,
+        ChatMessage,
+        fastpath.chat_message_rows,
+        fastpath.build_chat_messages,
+    )
+
+
+@async_read_view(query_budget=4)
+async def group_history(request, group_id):
+    return await _history(
+        request,
+        membership.is_group_member,
+        group_id,
+        GroupMessages,
+        fastpath.group_message_rows,
+        fastpath.build_group_messages,
+    )
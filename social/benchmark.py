@@ -0,0 +1,41 @@
+import contextlib
+import statistics
+import time
+from django.test.utils import setup_databases, teardown_databases
+
+
+@contextlib.contextmanager
+def isolated_database(verbosity=0):
+    # Benchmarks run against throwaway test databases so they never touch
+    # real data and need nothing beyond the configured database engine.
+    old_config = setup_databases(verbosity=verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity)
+
+
+def measure(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def percentile(durations, fraction):
+    ordered = sorted(durations)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(durations, items=1):
+    return {
+        "runs": len(durations),
+        "items": items,
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": percentile(durations, 0.5) * 1000,
+        "p99_ms": percentile(durations, 0.99) * 1000,
+        "per_item_us": statistics.mean(durations) / max(items, 1) * 1_000_000,
+    }
@@ -0,0 +1,152 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+# Cached responses are keyed by the versions of the scopes they depend on.
+# Signals bump a scope's version whenever the underlying rows change, so stale
+# entries are never read again and simply expire.
+GROUPS = "groups"
+
+
+def post_scope(post_id):
+    return f"post:{post_id}"
+
+
+def group_scope(group_id):
+    return f"group:{group_id}"
+
+
+def profile_scope(user_id):
+    return f"profile:{user_id}"
+
+
+def friends_scope(user_id):
+    return f"friends:{user_id}"
+
+
+def rooms_scope(user_id):
+    return f"rooms:{user_id}"
+
+
+def groups_scope(user_id):
+    return f"groups:{user_id}"
+
+
+def _version_key(scope):
+    return f"version:{scope}"
+
+
+def get_versions(scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, timeout=None)
+
+
+def cached_value(scopes, name, build):
+    key = f"value:{name}:" + ",".join(map(str, get_versions(scopes)))
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, settings.RESPONSE_CACHE_TIMEOUT)
+    return value
+
+
+def friend_group_counts(user_id):
+    # Friends who are members of each group, for the groups with the most.
+    from django.db.models import Count
+    from .models import Friend, Group
+
+    friends = Friend.friends.through.objects.filter(friend__user_id=user_id)
+    return cached_value(
+        [friends_scope(user_id), GROUPS],
+        f"friend_group_counts:{user_id}",
+        lambda: dict(
+            Group.members.through.objects.filter(
+                userprofile_id__in=friends.values("userprofile_id")
+            )
+            .values("group_id")
+            .annotate(count=Count("*"))
+            .order_by("-count", "-group_id")
+            .values_list("group_id", "count")[: settings.GROUP_DISCOVERY_MAX_RANKED]
+        ),
+    )
+
+
+def _etag(parts):
+    return quote_etag(hashlib.md5("|".join(parts).encode()).hexdigest())
+
+
+def _not_modified(request, etag):
+    return etag in parse_etags(request.headers.get("If-None-Match", ""))
+
+
+def _finish(response, etag):
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def cached_response(request, scopes, build):
+    versions = get_versions(scopes)
+    etag = _etag(
+        [str(request.user.id), request.get_host(), request.get_full_path()]
+        + [f"{scope}={version}" for scope, version in zip(scopes, versions)]
+    )
+
+    if _not_modified(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        key = f"response:{etag}"
+        data = cache.get(key)
+        if data is None:
+            response = build()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        else:
+            response = Response(data)
+    return _finish(response, etag)
+
+
+def cached_list_response(request, name, ids, scope, shared_scopes, build):
+    # Lists cached one object at a time and shared by every viewer, so a
+    # write only rebuilds the objects it touched. ``ids`` is the list as it
+    # stands, ``scope(id)`` names each object's version and ``build(ids)``
+    # returns the representations of the objects missing from the cache.
+    versions = get_versions([scope(id) for id in ids] + list(shared_scopes))
+    shared = ",".join(map(str, versions[len(ids) :]))
+    keys = {
+        id: f"object:{name}:{request.get_host()}:{shared}:{id}:{version}"
+        for id, version in zip(ids, versions)
+    }
+    etag = _etag([request.get_full_path(), *keys.values()])
+    if _not_modified(request, etag):
+        return _finish(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+    found = cache.get_many(list(keys.values()))
+    missing = [id for id in ids if keys[id] not in found]
+    if missing:
+        built = {keys[item["id"]]: item for item in build(missing)}
+        cache.set_many(built, settings.RESPONSE_CACHE_TIMEOUT)
+        found.update(built)
+    # Objects deleted since ``ids`` was read are left out.
+    data = [found[keys[id]] for id in ids if keys[id] in found]
+    return _finish(Response(data), etag)
@@ -0,0 +1,199 @@
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import ChangeLog, Friend, UserProfile
+
+logger = logging.getLogger(__name__)
+
+# Change feed behind /api/sync/. Every mutation of a synced object appends a
+# ChangeLog row for each user who can see the object; clients keep a token
+# and fetch only what changed since.
+#
+# A token is "<id>-<timestamp>": every entry with a higher id was created at
+# or after the timestamp. Entries older than CHANGELOG_RETENTION_DAYS are
+# compacted away, so older tokens get a 410 and the client refetches its
+# lists, as do tokens from the future. Ids are allocated before commit, so a transaction can commit an id
+# lower than one already served; tokens only move past entries older than
+# SYNC_SETTLE_SECONDS and newer entries are served again on the next sync.
+#
+# Entries are written on a background thread once the transaction commits,
+# so requests don't pay for the fan-out to every member or friend.
+
+_tasks = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class ResyncRequired(Exception):
+    pass
+
+
+def _run():
+    while True:
+        task = _tasks.get()
+        try:
+            task()
+        except Exception:
+            logger.exception("Writing change feed entries failed")
+        finally:
+            close_old_connections()
+
+
+def _enqueue(task):
+    global _worker
+    if not settings.CHANGELOG_IN_BACKGROUND:
+        task()
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_run, name="changelog-worker", daemon=True
+            )
+            _worker.start()
+    _tasks.put(task)
+
+
+def later(task):
+    transaction.on_commit(lambda: _enqueue(task))
+
+
+def record(kind, action, object_ids, user_ids, parent_id=None):
+    # ``user_ids`` may be a queryset, which is read after commit. Pass a list
+    # when the rows it reads go away with the change.
+    object_ids = list(object_ids)
+    later(
+        lambda: write_entries(
+            kind,
+            action,
+            [(object_id, parent_id, user_ids) for object_id in object_ids],
+        )
+    )
+
+
+def write_entries(kind, action, entries):
+    # ``entries`` are (object_id, parent_id, user_ids) triples.
+    ChangeLog.objects.bulk_create(
+        ChangeLog(
+            user_id=user_id,
+            kind=kind,
+            object_id=object_id,
+            parent_id=parent_id,
+            action=action,
+        )
+        for object_id, parent_id, user_ids in entries
+        for user_id in user_ids
+    )
+
+
+def audience(user_id):
+    # The user and their friends, as a queryset for record().
+    return (
+        UserProfile.objects.filter(Q(user_id=user_id) | Q(friends__user_id=user_id))
+        .distinct()
+        .values_list("user_id", flat=True)
+    )
+
+
+def audiences(user_ids):
+    # Posts, and the comments and likes on them, are synced to their author
+    # and the author's friends.
+    result = {user_id: {user_id} for user_id in user_ids}
+    rows = Friend.friends.through.objects.filter(
+        friend__user_id__in=result
+    ).values_list("friend__user_id", "userprofile_id")
+    for user_id, friend_id in rows:
+        result[user_id].add(friend_id)
+    return result
+
+
+def make_token(change_id, at):
+    return f"{change_id}-{int(at.timestamp())}"
+
+
+def parse_token(token):
+    try:
+        change_id, timestamp = token.split("-")
+        return int(change_id), datetime.fromtimestamp(int(timestamp), dt_timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def current_token():
+    settled = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    last_id = (
+        ChangeLog.objects.filter(created_at__lt=settled)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    return make_token(last_id or 0, settled)
+
+
+def changes_since(user_id, token):
+    now = timezone.now()
+    parsed = parse_token(token)
+    # A day of slack so tokens expire before the entries they need go.
+    max_age = timedelta(days=settings.CHANGELOG_RETENTION_DAYS - 1)
+    if parsed is None or not now - max_age <= parsed[1] <= now:
+        raise ResyncRequired
+    since, since_at = parsed
+    limit = settings.SYNC_PAGE_SIZE
+    rows = list(
+        ChangeLog.objects.filter(user_id=user_id, id__gt=since)
+        .order_by("id")
+        .values_list("id", "kind", "object_id", "parent_id", "action", "created_at")[
+            : limit + 1
+        ]
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    settle = timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    settled = now - settle
+    next_id, next_at = since, since_at
+    for change_id, *_, created_at in rows:
+        if created_at >= settled:
+            break
+        next_id, next_at = change_id, created_at - settle
+    if not more:
+        # Anything after next_id is unsettled or not written yet.
+        next_at = settled
+
+    # Only the latest change to each object matters to the client.
+    latest = {}
+    for _, kind, object_id, parent_id, action, _ in rows:
+        latest.pop((kind, object_id), None)
+        latest[kind, object_id] = {
+            "kind": kind,
+            "id": object_id,
+            "parent_id": parent_id,
+            "action": action,
+        }
+    return {
+        "token": make_token(next_id, next_at),
+        "more": more and next_id > since,
+        "changes": list(latest.values()),
+    }
+
+
+def compact(now=None):
+    # Drops expired entries and those superseded by a later change to the
+    # same object in the same feed. Either way no token still in use needs
+    # them: the later entry is served instead.
+    now = now or timezone.now()
+    expired, _ = ChangeLog.objects.filter(
+        created_at__lt=now - timedelta(days=settings.CHANGELOG_RETENTION_DAYS)
+    ).delete()
+    later = ChangeLog.objects.filter(
+        user_id=OuterRef("user_id"),
+        kind=OuterRef("kind"),
+        object_id=OuterRef("object_id"),
+        id__gt=OuterRef("id"),
+    )
+    superseded, _ = ChangeLog.objects.filter(Exists(later)).delete()
+    return {"expired": expired, "superseded": superseded}
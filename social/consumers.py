@@ -1,31 +1,110 @@
 import json
-from channels.db import database_sync_to_async
+import random
 from channels.generic.websocket import AsyncWebsocketConsumer
-import logging
+from django.conf import settings
 import time
+from FriendNet_Backend import metrics
+from FriendNet_Backend.db_pool import database_sync_to_async
 
-logger = logging.getLogger(__name__)
+CONNECTED = metrics.gauge(
+    "chat_connected_sockets", "Connected chat sockets.", ["consumer"]
+)
+FRAMES = metrics.counter(
+    "chat_frames_total", "Chat frames by direction.", ["consumer", "direction"]
+)
+BYTES = metrics.counter(
+    "chat_bytes_total", "Chat payload bytes by direction.", ["consumer", "direction"]
+)
+LATENCY = metrics.histogram(
+    "chat_message_latency_seconds",
+    "Sampled time from receiving a message to delivering it to a recipient.",
+    ["consumer"],
+)
+THROTTLED = metrics.counter(
+    "chat_frames_throttled_total",
+    "Incoming chat frames rejected by the rate limiter.",
+    ["consumer"],
+)
+
+
+def payload_size(text_data):
+    # Bytes on the wire: text frames are sent UTF-8 encoded.
+    return len(text_data) if text_data.isascii() else len(text_data.encode())
 
 
 class BaseChatConsumer(AsyncWebsocketConsumer):
+    connected = False
+    room_type = None
+
     async def connect(self):
+        from .media import socket_base_url
+        from .membership import socket_group
+
         self.user_id = self.scope.get("user").id
-        self.rooms = await self.get_rooms()
-        for room in self.rooms:
-            await self.channel_layer.group_add(str(room.id), self.channel_name)
+        self.base_url = socket_base_url(self.scope)
+        self.socket_group = socket_group(self.room_type, self.user_id)
+        await self.channel_layer.group_add(self.socket_group, self.channel_name)
+        self.room_ids = set(await database_sync_to_async(self.get_room_ids)())
+        for room_id in self.room_ids:
+            await self.channel_layer.group_add(str(room_id), self.channel_name)
         await self.accept()
+        self.connected = True
+        CONNECTED.inc(consumer=type(self).__name__)
 
-    async def get_rooms(self):
+    async def disconnect(self, code):
+        if self.connected:
+            self.connected = False
+            CONNECTED.dec(consumer=type(self).__name__)
+        if hasattr(self, "socket_group"):
+            await self.channel_layer.group_discard(self.socket_group, self.channel_name)
+        for room_id in getattr(self, "room_ids", ()):
+            await self.channel_layer.group_discard(str(room_id), self.channel_name)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if text_data is not None or bytes_data is not None:
+            consumer = type(self).__name__
+            FRAMES.inc(consumer=consumer, direction="out")
+            size = len(bytes_data) if text_data is None else payload_size(text_data)
+            BYTES.inc(size, consumer=consumer, direction="out")
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    def get_room_ids(self):
         raise NotImplementedError
 
     def get_serializer(self, *args, **kwargs):
         raise NotImplementedError
 
     async def receive(self, text_data):
+        from .membership import as_id
+        from .throttling import atake
+
         receive_time = time.time()
+        consumer = type(self).__name__
+        FRAMES.inc(consumer=consumer, direction="in")
+        BYTES.inc(payload_size(text_data), consumer=consumer, direction="in")
+        allowed, retry_after = await atake("chat_message", f"user:{self.user_id}")
+        if not allowed:
+            THROTTLED.inc(consumer=consumer)
+            await self.send(
+                text_data=json.dumps(
+                    {
+                        "type": "error",
+                        "detail": "Rate limit exceeded.",
+                        "retry_after": retry_after,
+                    }
+                )
+            )
+            return
         data = json.loads(text_data)
         text = data["text"]
-        room_id = data["room_id"]
+        room_id = as_id(data["room_id"])
+        if not await self.check_membership(room_id):
+            await self.send(
+                text_data=json.dumps(
+                    {"type": "error", "detail": "You are not a member of this room."}
+                )
+            )
+            return
         serializer = self.get_serializer(
             data={"text": text, "file": None},
             context={"user_id": self.user_id, "room_id": room_id},
@@ -37,11 +116,23 @@ class BaseChatConsumer(AsyncWebsocketConsumer):
             str(room_id), {"type": "chat.message", "message": message}
         )
 
+    async def check_membership(self, room_id):
+        # The cached id set is authoritative: it also catches removals that
+        # happened after connect. Rooms joined since then are subscribed to.
+        room_ids = await database_sync_to_async(self.get_room_ids)()
+        if room_id not in room_ids:
+            return False
+        if room_id not in self.room_ids:
+            self.room_ids.add(room_id)
+            await self.channel_layer.group_add(str(room_id), self.channel_name)
+        return True
+
     async def chat_message(self, event):
         message = event["message"]
-        send_time = time.time()
-        receive_time = message["receive_time"]
-        logger.info(f"Time between receive and send: {receive_time - send_time}")
+        if random.random() < settings.CHAT_LATENCY_SAMPLE_RATE:
+            LATENCY.observe(
+                time.time() - message["receive_time"], consumer=type(self).__name__
+            )
         await self.send(
             text_data=json.dumps(
                 {
@@ -51,6 +142,7 @@ class BaseChatConsumer(AsyncWebsocketConsumer):
                     "sender_id": message["sender_id"],
                     "username": message["username"],
                     "profile_image": message["profile_image"],
+                    "mentions": message["mentions"],
                     "created_at": message["created_at"],
                 }
             )
@@ -74,18 +166,38 @@ class BaseChatConsumer(AsyncWebsocketConsumer):
             )
         )
 
+    async def members_changed(self, event):
+        # Chat rooms and groups share channel group names, so ignore events
+        # meant for the other kind of room.
+        if event["room_type"] != self.room_type:
+            return
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "members_changed",
+                    "room_id": event["room_id"],
+                    "added": event["added"],
+                    "removed": event["removed"],
+                }
+            )
+        )
+        room_id = event["room_id"]
+        if self.user_id in event["added"] and room_id not in self.room_ids:
+            self.room_ids.add(room_id)
+            await self.channel_layer.group_add(str(room_id), self.channel_name)
+        if self.user_id in event["removed"]:
+            self.room_ids.discard(room_id)
+            await self.channel_layer.group_discard(str(room_id), self.channel_name)
+
     @database_sync_to_async
     def save_data(self, serializer):
+        from .media import absolute_url, media_url
         from .models import UserProfile
+        from .typeahead import extract_mentions
 
         serializer.save()
         user_data = UserProfile.objects.get(user_id=self.user_id)
-        BASE_URL = "http://127.0.0.1:8000"
-        image = (
-            f"{BASE_URL}{user_data.profile_image.url}"
-            if user_data.profile_image
-            else None
-        )
+        image = absolute_url(media_url(user_data.profile_image), self.base_url)
 
         return {
             "id": serializer.data["id"],
@@ -94,17 +206,18 @@ class BaseChatConsumer(AsyncWebsocketConsumer):
             "sender_id": self.user_id,
             "username": user_data.user.username,
             "profile_image": image,
+            "mentions": extract_mentions(serializer.data["text"]),
             "created_at": serializer.data["created_at"],
         }
 
 
 class ChatConsumer(BaseChatConsumer):
-    async def get_rooms(self):
-        from .models import ChatRoom
+    room_type = "chat"
 
-        return await database_sync_to_async(list)(
-            ChatRoom.objects.filter(members=self.user_id)
-        )
+    def get_room_ids(self):
+        from .membership import room_ids
+
+        return room_ids(self.user_id)
 
     def get_serializer(self, *args, **kwargs):
         from .serializers import ChatMessageSerializer
@@ -113,14 +226,42 @@ class ChatConsumer(BaseChatConsumer):
 
 
 class GroupChatConsumer(BaseChatConsumer):
-    async def get_rooms(self):
-        from .models import Group
+    room_type = "group"
 
-        return await database_sync_to_async(list)(
-            Group.objects.filter(members=self.user_id)
-        )
+    def get_room_ids(self):
+        from .membership import group_ids
+
+        return group_ids(self.user_id)
 
     def get_serializer(self, *args, **kwargs):
         from .serializers import GroupMessagesSerializer
 
         return GroupMessagesSerializer(*args, **kwargs)
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        from .media import socket_base_url
+        from .notifications import user_group
+
+        user = self.scope.get("user")
+        if not user or not user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = user_group(user.id)
+        self.base_url = socket_base_url(self.scope)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification(self, event):
+        from .media import absolute_url
+
+        notification = event["notification"]
+        actor = notification["actor"]
+        image = absolute_url(actor["profile_image"], self.base_url)
+        notification = {**notification, "actor": {**actor, "profile_image": image}}
+        await self.send(text_data=json.dumps(notification))
@@ -0,0 +1,114 @@
+import logging
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from .models import Comment, Like, Notification, Post, Save
+
+logger = logging.getLogger(__name__)
+
+# Deletes run on one background thread so requests only pay for the soft
+# delete. Posts stay soft-deleted until their media is gone; the worker
+# retries them every PURGE_RETRY_SECONDS while it is idle, and purge_deleted
+# picks up posts left behind by processes that went away.
+
+_tasks = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _run():
+    while True:
+        try:
+            task = _tasks.get(timeout=settings.PURGE_RETRY_SECONDS)
+        except queue.Empty:
+            task = purge_deleted_posts
+        try:
+            task()
+        except Exception:
+            logger.exception("Background deletion task failed")
+        finally:
+            close_old_connections()
+
+
+def _enqueue(task):
+    global _worker
+    if not settings.DELETION_IN_BACKGROUND:
+        task()
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="deletion-worker", daemon=True)
+            _worker.start()
+    _tasks.put(task)
+
+
+def delete_file(storage, name):
+    # Goes through the storage API, so it works for Cloudinary as well as the
+    # filesystem. Returns False if every attempt failed.
+    for attempt in range(settings.STORAGE_DELETE_RETRIES):
+        try:
+            storage.delete(name)
+            return True
+        except Exception:
+            logger.warning(
+                "Deleting %s failed (attempt %s)", name, attempt + 1, exc_info=True
+            )
+            time.sleep(settings.STORAGE_DELETE_BACKOFF * 2**attempt)
+    return False
+
+
+def delete_file_later(storage, name):
+    if name:
+        transaction.on_commit(lambda: _enqueue(lambda: delete_file(storage, name)))
+
+
+def delete_rows(model, ids):
+    # A plain DELETE by primary key. Unlike a queryset delete it sends no
+    # post_delete signals and runs no cascades, so callers apply whatever
+    # side effects the rows need themselves.
+    if not ids:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table, pk = quote(model._meta.db_table), quote(model._meta.pk.column)
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({placeholders})", list(ids))
+
+
+def _delete_in_batches(queryset):
+    # The per-row post_delete signals a queryset delete sends would only
+    # invalidate caches for a post already hidden.
+    while ids := list(
+        queryset.values_list("id", flat=True)[: settings.PURGE_BATCH_SIZE]
+    ):
+        delete_rows(queryset.model, ids)
+
+
+def purge_post(post):
+    _delete_in_batches(
+        Notification.actors.through.objects.filter(notification__post_id=post.id)
+    )
+    for model in (Like, Save, Comment, Notification):
+        _delete_in_batches(model.objects.filter(post_id=post.id))
+    if post.media_file and not delete_file(
+        post.media_file.storage, post.media_file.name
+    ):
+        return False
+    Post.all_objects.filter(id=post.id).delete()
+    return True
+
+
+def purge_deleted_posts(limit=None):
+    posts = Post.all_objects.filter(deleted_at__isnull=False).order_by("deleted_at")
+    purged = 0
+    for post in posts[:limit] if limit else posts:
+        if purge_post(post):
+            purged += 1
+    return purged
+
+
+def schedule_purge():
+    transaction.on_commit(lambda: _enqueue(purge_deleted_posts))
@@ -0,0 +1,68 @@
+from collections import defaultdict
+from . import caching, changes, notifications, trending
+from .models import ChangeLog, Comment, Like, Notification, Post, Save
+
+# Side effects of writing likes, comments and saves: cache versions, the
+# trending ranking, notifications and the change feed. The model signals
+# apply them to one row; BulkEngagementSerializer, whose bulk writes skip the
+# signals, applies them to a whole batch in the same number of queries.
+
+
+def saved(model, instances, created=True):
+    post_ids = sorted({instance.post_id for instance in instances})
+    caching.bump_versions(*[caching.post_scope(post_id) for post_id in post_ids])
+    if created:
+        _record_trending(model, instances)
+    if model is Save:
+        return
+    authors = _authors(post_ids)
+    if created:
+        verb = Notification.LIKE if model is Like else Notification.COMMENT
+        targets = defaultdict(list)
+        for instance in instances:
+            if instance.post_id in authors:
+                targets[instance.user_id].append(
+                    (authors[instance.post_id], instance.post_id)
+                )
+        for actor_id, actor_targets in targets.items():
+            notifications.notify_many(actor_id, verb, actor_targets)
+    _record_changes(model, ChangeLog.UPSERT, instances, authors)
+
+
+def deleted(model, instances):
+    post_ids = sorted({instance.post_id for instance in instances})
+    caching.bump_versions(*[caching.post_scope(post_id) for post_id in post_ids])
+    _record_trending(model, instances, removed=True)
+    if model is not Save:
+        _record_changes(model, ChangeLog.DELETE, instances, _authors(post_ids))
+
+
+def _record_trending(model, instances, removed=False):
+    trending.record_many(
+        model._meta.model_name,
+        [(instance.post_id, instance.created_at) for instance in instances],
+        removed,
+    )
+
+
+def _authors(post_ids):
+    return dict(Post.all_objects.filter(id__in=post_ids).values_list("id", "user_id"))
+
+
+def _record_changes(model, action, instances, authors):
+    # Synced with the post, and to the engaging user's other devices.
+    kind = ChangeLog.COMMENT if model is Comment else ChangeLog.LIKE
+    rows = [(instance.id, instance.post_id, instance.user_id) for instance in instances]
+
+    def write():
+        audiences = changes.audiences(set(authors.values()))
+        changes.write_entries(
+            kind,
+            action,
+            [
+                (id, post_id, {user_id, *audiences.get(authors.get(post_id), ())})
+                for id, post_id, user_id in rows
+            ],
+        )
+
+    changes.later(write)
@@ -0,0 +1,111 @@
+import itertools
+from django.conf import settings
+from FriendNet_Backend.renderers import FastJSONRenderer
+from .models import (
+    ChatMessage,
+    ChatMessageArchive,
+    ChatRoom,
+    Comment,
+    Friend,
+    GroupMessages,
+    GroupMessagesArchive,
+    Like,
+    Post,
+    Save,
+    UserProfile,
+)
+
+# A user's data as NDJSON, one {"type": ..., ...} object per line. Rows are
+# read with server-side cursors EXPORT_CHUNK_SIZE at a time and written out
+# chunk by chunk, so memory stays flat however many rows a user has.
+
+_renderer = FastJSONRenderer()
+
+
+def sections(user_id):
+    rooms = ChatRoom.objects.filter(members=user_id).values("id")
+    message_fields = ["id", "room_id", "sender_id", "text", "file", "created_at"]
+    querysets = [
+        (
+            "profile",
+            UserProfile.objects.filter(user_id=user_id).values(
+                "user_id",
+                "user__username",
+                "user__email",
+                "gender",
+                "birthdate",
+                "bio",
+                "profile_image",
+            ),
+        ),
+        (
+            "friend",
+            Friend.friends.through.objects.filter(friend__user_id=user_id).values(
+                "userprofile_id", "userprofile__user__username"
+            ),
+        ),
+        (
+            "post",
+            Post.objects.filter(user_id=user_id).values(
+                "id", "text", "media_file", "created_at"
+            ),
+        ),
+        (
+            "comment",
+            Comment.objects.filter(user_id=user_id).values(
+                "id", "post_id", "text", "created_at"
+            ),
+        ),
+        (
+            "like",
+            Like.objects.filter(user_id=user_id).values("id", "post_id", "created_at"),
+        ),
+        (
+            "save",
+            Save.objects.filter(user_id=user_id).values("id", "post_id", "created_at"),
+        ),
+    ]
+    # Whole one-to-one conversations, but only the user's own group messages.
+    for model in (ChatMessage, ChatMessageArchive):
+        querysets.append(
+            (
+                "chat_message",
+                model.objects.filter(room__in=rooms).values(*message_fields),
+            )
+        )
+    for model in (GroupMessages, GroupMessagesArchive):
+        querysets.append(
+            (
+                "group_message",
+                model.objects.filter(sender_id=user_id).values(*message_fields),
+            )
+        )
+    # Clearing the default ordering avoids sorting millions of rows.
+    return [(kind, queryset.order_by()) for kind, queryset in querysets]
+
+
+def _encode(kind, rows):
+    return b"".join(_renderer.render({"type": kind, **row}) + b"\n" for row in rows)
+
+
+def export_lines(user_id):
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    for kind, queryset in sections(user_id):
+        rows = queryset.iterator(chunk_size=chunk_size)
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            yield _encode(kind, chunk)
+
+
+async def aexport_lines(user_id):
+    # Under ASGI a synchronous iterator would be read into memory whole
+    # before streaming starts.
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    for kind, queryset in sections(user_id):
+        chunk = []
+        async for row in queryset.aiterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield _encode(kind, chunk)
+                chunk = []
+        if chunk:
+            yield _encode(kind, chunk)
@@ -0,0 +1,217 @@
+from collections import defaultdict
+from rest_framework import serializers
+from .media import storage_url
+from .models import ChatMessage, Comment, GroupMessages, Like, Post, Save, UserProfile
+from .typeahead import extract_mentions
+
+# Read-only equivalents of ListPostSerializer, ChatMessageSerializer and
+# GroupMessagesSerializer that build response dicts straight from .values()
+# rows. Their output must stay identical to the serializers they mirror; the
+# parity tests in social/tests.py guard that. Queries (``*_rows``) are kept
+# apart from formatting (``build_*``) so social.async_views can run the same
+# queries through the async ORM.
+
+_datetime = serializers.DateTimeField()
+_avatar_storage = UserProfile._meta.get_field("profile_image").storage
+_post_file_storage = Post._meta.get_field("media_file").storage
+_chat_file_storage = ChatMessage._meta.get_field("file").storage
+_group_file_storage = GroupMessages._meta.get_field("file").storage
+
+
+def _file_url(storage, name, request):
+    # Mirrors rest_framework.fields.FileField, which does not use media_url().
+    if not name:
+        return None
+    url = storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def engagement_rows(model, post_ids):
+    return model.objects.filter(post_id__in=post_ids).values_list(
+        "post_id", "id", "user_id", "user__user__username", "created_at"
+    )
+
+
+def build_engagement(rows):
+    by_post = defaultdict(list)
+    for post_id, id, user_id, username, created_at in rows:
+        by_post[post_id].append(
+            {
+                "id": id,
+                "user_id": user_id,
+                "username": username,
+                "created_at": _datetime.to_representation(created_at),
+            }
+        )
+    return by_post
+
+
+def comment_rows(post_ids):
+    return Comment.objects.filter(post_id__in=post_ids).values_list(
+        "post_id",
+        "id",
+        "user_id",
+        "user__user__username",
+        "user__profile_image",
+        "text",
+        "created_at",
+    )
+
+
+def build_comments(rows, request):
+    by_post = defaultdict(list)
+    for post_id, id, user_id, username, profile_image, text, created_at in rows:
+        by_post[post_id].append(
+            {
+                "id": id,
+                "user_id": user_id,
+                "username": username,
+                "profile_image": storage_url(_avatar_storage, profile_image, request),
+                "text": text,
+                "mentions": extract_mentions(text),
+                "created_at": _datetime.to_representation(created_at),
+            }
+        )
+    return by_post
+
+
+def post_rows(queryset):
+    return queryset.prefetch_related(None).values_list(
+        "id",
+        "user__user__username",
+        "user__profile_image",
+        "text",
+        "media_file",
+        "created_at",
+        "like_count",
+        "comment_count",
+        "save_count",
+    )
+
+
+def build_posts(rows, likes, comments, saves, request):
+    return [
+        {
+            "id": id,
+            "username": username,
+            "profile_image": storage_url(_avatar_storage, profile_image, request),
+            "text": text,
+            "media_file": storage_url(_post_file_storage, media_file, request),
+            "created_at": _datetime.to_representation(created_at),
+            "like_count": like_count,
+            "comment_count": comment_count,
+            "save_count": save_count,
+            "post_likes": likes.get(id, []),
+            "post_comments": comments.get(id, []),
+            "save_post": saves.get(id, []),
+        }
+        for (
+            id,
+            username,
+            profile_image,
+            text,
+            media_file,
+            created_at,
+            like_count,
+            comment_count,
+            save_count,
+        ) in rows
+    ]
+
+
+def post_list(queryset, request):
+    rows = list(post_rows(queryset))
+    post_ids = [row[0] for row in rows]
+    return build_posts(
+        rows,
+        build_engagement(engagement_rows(Like, post_ids)),
+        build_comments(comment_rows(post_ids), request),
+        build_engagement(engagement_rows(Save, post_ids)),
+        request,
+    )
+
+
+def chat_message_rows(queryset):
+    return queryset.values_list(
+        "id",
+        "room_id",
+        "text",
+        "file",
+        "sender_id",
+        "sender__user__username",
+        "sender__profile_image",
+        "created_at",
+    )
+
+
+def build_chat_messages(rows, request):
+    return [
+        {
+            "id": id,
+            "room_id": room_id,
+            "text": text,
+            "file": _file_url(_chat_file_storage, file, request),
+            "file_name": file.split("/")[-1] if file else None,
+            "file_size": _chat_file_storage.size(file) if file else None,
+            "sender_id": sender_id,
+            "username": username,
+            "profile_image": storage_url(_avatar_storage, profile_image, request),
+            "created_at": _datetime.to_representation(created_at),
+        }
+        for (
+            id,
+            room_id,
+            text,
+            file,
+            sender_id,
+            username,
+            profile_image,
+            created_at,
+        ) in rows
+    ]
+
+
+def chat_message_list(queryset, request):
+    return build_chat_messages(chat_message_rows(queryset), request)
+
+
+def group_message_rows(queryset):
+    return queryset.values_list(
+        "id",
+        "room_id",
+        "sender_id",
+        "sender__user__username",
+        "sender__profile_image",
+        "text",
+        "file",
+        "created_at",
+    )
+
+
+def build_group_messages(rows, request):
+    return [
+        {
+            "id": id,
+            "room_id": room_id,
+            "sender_id": sender_id,
+            "username": username,
+            "profile_image": storage_url(_avatar_storage, profile_image, request),
+            "text": text,
+            "file": _file_url(_group_file_storage, file, request),
+            "file_name": file.split("/")[-1] if file else None,
+            "file_size": _group_file_storage.size(file) if file else None,
+            "created_at": _datetime.to_representation(created_at),
+        }
+        for (
+            id,
+            room_id,
+            sender_id,
+            username,
+            profile_image,
+            text,
+            file,
+            created_at,
+        ) in rows
+    ]
@@ -0,0 +1,20 @@
+import json
+from django.core.management.base import BaseCommand
+from social.archive import archive_old_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Move chat and group messages older than MESSAGE_ARCHIVE_AFTER_DAYS "
+        "to the archive tables in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, help="Archive messages older than this."
+        )
+        parser.add_argument("--batch-size", type=int)
+
+    def handle(self, *args, **options):
+        moved = archive_old_messages(options["days"], options["batch_size"])
+        self.stdout.write(json.dumps(moved))
@@ -0,0 +1,77 @@
+import gzip
+import json
+import random
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from FriendNet_Backend.renderers import FastJSONRenderer, orjson
+from social.benchmark import measure, summarize
+
+
+class Command(BaseCommand):
+    help = "Compare JSON renderers on a synthetic feed payload."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        feed = self.build_feed(options["posts"], random.Random(options["seed"]))
+        results = {"orjson_installed": orjson is not None}
+        for name, renderer in (
+            ("drf_json", JSONRenderer()),
+            ("fast_json", FastJSONRenderer()),
+        ):
+            body = renderer.render(feed)
+            results[name] = {
+                "render": summarize(
+                    measure(lambda: renderer.render(feed), options["repeat"]),
+                    len(feed),
+                ),
+                "bytes": len(body),
+                "gzip_bytes": len(gzip.compress(body, compresslevel=6)),
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def build_feed(self, post_count, rng):
+        now = timezone.now()
+
+        def user(index):
+            return {
+                "user_id": index,
+                "username": f"user{index}",
+                "created_at": now - timedelta(minutes=rng.randint(0, 10_000)),
+            }
+
+        feed = []
+        for post_id in range(post_count):
+            likes = [user(rng.randint(1, 5000)) for _ in range(rng.randint(0, 40))]
+            comments = [
+                {
+                    **user(rng.randint(1, 5000)),
+                    "id": post_id * 100 + index,
+                    "profile_image": f"https://cdn.example.com/media/image/{index}.png",
+                    "text": "Lorem ipsum dolor sit amet, ünïcode ✓ " * rng.randint(1, 4),
+                    "mentions": [],
+                }
+                for index in range(rng.randint(0, 15))
+            ]
+            feed.append(
+                {
+                    "id": post_id,
+                    "username": f"user{post_id % 5000}",
+                    "profile_image": f"https://cdn.example.com/media/image/{post_id}.png",
+                    "text": "Post body " * rng.randint(1, 30),
+                    "media_file": None,
+                    "created_at": now - timedelta(minutes=post_id),
+                    "like_count": len(likes),
+                    "comment_count": len(comments),
+                    "save_count": 0,
+                    "post_likes": likes,
+                    "post_comments": comments,
+                    "save_post": [],
+                }
+            )
+        return feed
@@ -0,0 +1,116 @@
+import json
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from core.models import User
+from social import fastpath
+from social.benchmark import isolated_database, measure, summarize
+from social.models import (
+    ChatMessage,
+    ChatRoom,
+    Comment,
+    Like,
+    Post,
+    Save,
+    UserProfile,
+)
+from social.serializers import ChatMessageSerializer, ListPostSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare per-item cost of the DRF serializers and social.fastpath."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=200)
+        parser.add_argument("--engagement", type=int, default=5)
+        parser.add_argument("--messages", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        # Seeding sends membership events, which need no real channel layer,
+        # and media URLs are made absolute against the request factory's host.
+        layers = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+        overrides = override_settings(
+            ALLOWED_HOSTS=["testserver"], CHANNEL_LAYERS=layers
+        )
+        with overrides, isolated_database():
+            self.seed(options["posts"], options["engagement"], options["messages"])
+            results = self.run(options["repeat"])
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, post_count, engagement, message_count):
+        users = User.objects.bulk_create(
+            User(username=f"user{index}", email=f"user{index}@example.com")
+            for index in range(max(engagement, 2) + 1)
+        )
+        profiles = UserProfile.objects.bulk_create(
+            UserProfile(user=user, profile_image=f"image/user_profile/{user.id}.png")
+            for user in users
+        )
+        posts = Post.objects.bulk_create(
+            Post(user=profiles[0], text=f"post {index}", media_file="file/post_files/a.png")
+            for index in range(post_count)
+        )
+        for model in (Like, Save):
+            model.objects.bulk_create(
+                model(user=profile, post=post)
+                for post in posts
+                for profile in profiles[1 : engagement + 1]
+            )
+        Comment.objects.bulk_create(
+            Comment(user=profile, post=post, text="nice one @user0")
+            for post in posts
+            for profile in profiles[1 : engagement + 1]
+        )
+        self.room = ChatRoom.objects.create()
+        self.room.members.set(profiles[:2])
+        ChatMessage.objects.bulk_create(
+            ChatMessage(room=self.room, sender=profiles[index % 2], text=f"message {index}")
+            for index in range(message_count)
+        )
+
+    def run(self, repeat):
+        request = APIRequestFactory().get("/api/posts/")
+        posts = Post.objects.with_counts()
+        messages = ChatMessage.objects.filter(room=self.room).select_related(
+            "sender__user"
+        )
+        post_count = posts.count()
+        message_count = messages.count()
+        context = {"request": request}
+
+        return {
+            "posts": {
+                "serializer": summarize(
+                    measure(
+                        lambda: ListPostSerializer(
+                            posts.all(), many=True, context=context
+                        ).data,
+                        repeat,
+                    ),
+                    post_count,
+                ),
+                "fastpath": summarize(
+                    measure(lambda: fastpath.post_list(posts.all(), request), repeat),
+                    post_count,
+                ),
+            },
+            "chat_messages": {
+                "serializer": summarize(
+                    measure(
+                        lambda: ChatMessageSerializer(
+                            messages.all(), many=True, context=context
+                        ).data,
+                        repeat,
+                    ),
+                    message_count,
+                ),
+                "fastpath": summarize(
+                    measure(
+                        lambda: fastpath.chat_message_list(messages.all(), request),
+                        repeat,
+                    ),
+                    message_count,
+                ),
+            },
+        }
@@ -0,0 +1,319 @@
+import asyncio
+import json
+import platform
+import time
+import django
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from core.models import User
+from FriendNet_Backend.db_pool import get_pool
+from social.benchmark import isolated_database, percentile, summarize
+from social.consumers import ChatConsumer, GroupChatConsumer
+from social.models import ChatRoom, FriendRequest, Group
+from social.seeding import seed_social_graph
+
+SCENARIOS = [
+    "posts.list",
+    "chat.list",
+    "people.list",
+    "friend_request.accept",
+    "ws.chat_fanout",
+    "ws.group_fanout",
+    "ws.reconnect_storm",
+    "asgi.inbox",
+    "asgi.chat_history",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic social graph in a throwaway database and measure "
+        "REST and websocket throughput and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--friends-per-user", type=int, default=10)
+        parser.add_argument("--posts-per-user", type=int, default=3)
+        parser.add_argument("--likes-per-post", type=int, default=5)
+        parser.add_argument("--comments-per-post", type=int, default=2)
+        parser.add_argument("--groups", type=int, default=10)
+        parser.add_argument("--group-size", type=int, default=20)
+        parser.add_argument("--messages-per-room", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--sockets", type=int, default=20)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=20,
+            help="Requests in flight at once in the asgi.* scenarios.",
+        )
+        parser.add_argument(
+            "--warm-cache",
+            action="store_true",
+            help="Keep the response cache between requests.",
+        )
+        parser.add_argument(
+            "--scenario", action="append", choices=SCENARIOS, dest="scenarios"
+        )
+        parser.add_argument("--output", help="Write JSON results to this file.")
+
+    def handle(self, *args, **options):
+        layers = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+        with override_settings(
+            ALLOWED_HOSTS=["testserver"],
+            CHANNEL_LAYERS=layers,
+            DEBUG=False,
+            QUERY_BUDGETS_STRICT=False,
+            RATE_LIMITS={},
+        ):
+            with isolated_database():
+                results = self.run(options)
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def run(self, options):
+        start = time.perf_counter()
+        counts = seed_social_graph(
+            users=options["users"],
+            friends_per_user=options["friends_per_user"],
+            posts_per_user=options["posts_per_user"],
+            likes_per_post=options["likes_per_post"],
+            comments_per_post=options["comments_per_post"],
+            groups=options["groups"],
+            group_size=options["group_size"],
+            messages_per_room=options["messages_per_room"],
+            seed=options["seed"],
+        )
+        seed_seconds = time.perf_counter() - start
+
+        self.options = options
+        self.viewer = User.objects.order_by("id").first()
+        scenarios = options["scenarios"] or SCENARIOS
+        handlers = {
+            "posts.list": lambda: self.http_get("/api/posts/"),
+            "chat.list": lambda: self.http_get("/api/chat/"),
+            "people.list": lambda: self.http_get("/api/people/"),
+            "friend_request.accept": self.friend_request_accept,
+            "ws.chat_fanout": lambda: self.websocket_fanout(ChatConsumer),
+            "ws.group_fanout": lambda: self.websocket_fanout(GroupChatConsumer),
+            "ws.reconnect_storm": self.reconnect_storm,
+            "asgi.inbox": lambda: self.compare_asgi("/api/chat/", "/api/async/inbox/"),
+            "asgi.chat_history": self.chat_history,
+        }
+        return {
+            "meta": {
+                "timestamp": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "seed": options["seed"],
+                "seed_seconds": seed_seconds,
+                "dataset": counts,
+            },
+            "scenarios": {name: handlers[name]() for name in scenarios},
+        }
+
+    def client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def timed_requests(self, send):
+        durations = []
+        for index in range(self.options["requests"]):
+            if not self.options["warm_cache"]:
+                cache.clear()
+            start = time.perf_counter()
+            response = send(index)
+            durations.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError(f"Request failed with {response.status_code}")
+        return self.result(durations, len(durations))
+
+    def result(self, durations, operations):
+        total = sum(durations)
+        return {
+            **summarize(durations),
+            "operations": operations,
+            "throughput_per_second": operations / total if total else None,
+        }
+
+    def http_get(self, url):
+        client = self.client(self.viewer)
+        client.get(url)
+        return self.timed_requests(lambda index: client.get(url))
+
+    def friend_request_accept(self):
+        receiver = self.viewer
+        senders = [
+            User.objects.create_user(f"bench-sender-{index}", f"sender{index}@x.com")
+            for index in range(self.options["requests"])
+        ]
+        requests = FriendRequest.objects.bulk_create(
+            FriendRequest(sender_id=sender.id, receiver_id=receiver.id)
+            for sender in senders
+        )
+        client = self.client(receiver)
+        return self.timed_requests(
+            lambda index: client.put(f"/api/friend-receive/{requests[index].id}/")
+        )
+
+    def websocket_fanout(self, consumer_class):
+        if consumer_class is ChatConsumer:
+            room = ChatRoom.objects.order_by("id").first()
+        else:
+            room = max(Group.objects.all(), key=lambda group: group.members.count())
+        members = list(
+            User.objects.filter(profile__in=room.members.all())[
+                : self.options["sockets"]
+            ]
+        )
+        durations = asyncio.run(self.measure_fanout(consumer_class, room.id, members))
+        result = self.result(durations, len(durations) * len(members))
+        result["sockets"] = len(members)
+        result["delivery_p99_ms"] = percentile(durations, 0.99) * 1000
+        return result
+
+    def reconnect_storm(self):
+        # Every socket reconnects at once, five times over; each connect
+        # loads the user's room ids from the database.
+        users = list(User.objects.order_by("id")[: self.options["sockets"]])
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        connection_created.connect(count)
+        try:
+            durations = asyncio.run(self.measure_reconnects(users, rounds=5))
+        finally:
+            connection_created.disconnect(count)
+        result = self.result(durations, len(durations))
+        result["connections_opened"] = len(opened)
+        result["db_pool"] = get_pool().stats()
+        return result
+
+    async def measure_reconnects(self, users, rounds):
+        application = ChatConsumer.as_asgi()
+        durations = []
+
+        async def connect(user):
+            communicator = WebsocketCommunicator(application, "/ws/")
+            communicator.scope["user"] = user
+            start = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=10)
+            durations.append(time.perf_counter() - start)
+            if not connected:
+                raise RuntimeError("Websocket connection was rejected.")
+            return communicator
+
+        for _ in range(rounds):
+            cache.clear()
+            communicators = await asyncio.gather(*(connect(user) for user in users))
+            for communicator in communicators:
+                await communicator.disconnect()
+        return durations
+
+    async def measure_fanout(self, consumer_class, room_id, members):
+        application = consumer_class.as_asgi()
+        communicators = []
+        for user in members:
+            communicator = WebsocketCommunicator(application, "/ws/")
+            communicator.scope["user"] = user
+            connected, _ = await communicator.connect(timeout=10)
+            if not connected:
+                raise RuntimeError("Websocket connection was rejected.")
+            communicators.append(communicator)
+
+        sender = communicators[0]
+        durations = []
+        for index in range(self.options["requests"]):
+            start = time.perf_counter()
+            await sender.send_json_to({"text": f"bench {index}", "room_id": room_id})
+            await asyncio.gather(
+                *(
+                    communicator.receive_from(timeout=10)
+                    for communicator in communicators
+                )
+            )
+            durations.append(time.perf_counter() - start)
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        return durations
+
+    def chat_history(self):
+        room = ChatRoom.objects.filter(members=self.viewer.id).order_by("id").first()
+        if room is None:
+            raise RuntimeError("The benchmark user has no chat rooms.")
+        return self.compare_asgi(
+            f"/api/chat/{room.id}/messages/",
+            f"/api/async/chat/{room.id}/messages/?limit={settings.ASYNC_PAGE_SIZE_MAX}",
+        )
+
+    def compare_asgi(self, sync_path, async_path):
+        # Both paths go through Django's ASGI handler, as under Daphne.
+        # Sync-only middleware would hand every request to a thread, so it is
+        # left out and listed in the result.
+        skipped = [
+            path
+            for path in settings.MIDDLEWARE
+            if not getattr(import_string(path), "async_capable", False)
+        ]
+        middleware = [path for path in settings.MIDDLEWARE if path not in skipped]
+        with override_settings(MIDDLEWARE=middleware):
+            application = ASGIHandler()
+        headers = [
+            (b"host", b"testserver"),
+            (b"authorization", f"JWT {AccessToken.for_user(self.viewer)}".encode()),
+        ]
+        results = {
+            "concurrency": self.options["concurrency"],
+            "skipped_sync_middleware": skipped,
+        }
+        for name, path in (("sync", sync_path), ("async", async_path)):
+            cache.clear()
+            durations, wall = asyncio.run(
+                self.concurrent_requests(application, path, headers)
+            )
+            result = self.result(durations, len(durations))
+            result["throughput_per_second"] = len(durations) / wall
+            results[name] = result
+        return results
+
+    async def concurrent_requests(self, application, path, headers):
+        limit = asyncio.Semaphore(self.options["concurrency"])
+        durations = []
+
+        async def send():
+            async with limit:
+                start = time.perf_counter()
+                communicator = HttpCommunicator(
+                    application, "GET", path, headers=headers
+                )
+                response = await communicator.get_response(timeout=60)
+                durations.append(time.perf_counter() - start)
+                if response["status"] >= 400:
+                    raise RuntimeError(f"Request failed with {response['status']}")
+
+        await send()
+        durations.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(send() for _ in range(self.options["requests"])))
+        return durations, time.perf_counter() - start
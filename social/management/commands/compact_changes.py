@@ -0,0 +1,13 @@
+import json
+from django.core.management.base import BaseCommand
+from social.changes import compact
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete change feed entries older than CHANGELOG_RETENTION_DAYS and "
+        "those superseded by a later change to the same object."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(compact()))
@@ -0,0 +1,139 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter under ``python -X importtime``, which writes one
+# line per imported module to stderr. AppConfig.create is wrapped so every
+# app's ready() is timed as django.setup() calls it.
+PROBE = """
+import json
+import time
+
+start = time.perf_counter()
+from django.apps import AppConfig
+
+create = AppConfig.create.__func__
+ready_seconds = {}
+
+
+def timed_create(cls, entry):
+    config = create(cls, entry)
+    ready = config.ready
+
+    def timed_ready():
+        began = time.perf_counter()
+        ready()
+        ready_seconds[config.label] = time.perf_counter() - began
+
+    config.ready = timed_ready
+    return config
+
+
+AppConfig.create = classmethod(timed_create)
+
+import django
+
+django.setup()
+setup = time.perf_counter() - start
+
+from django.urls import get_resolver
+
+began = time.perf_counter()
+get_resolver().url_patterns
+urlconf = time.perf_counter() - began
+print(json.dumps({"setup": setup, "urlconf": urlconf, "ready": ready_seconds}))
+"""
+
+
+def parse_importtime(output):
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    return modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Start Django in fresh interpreters and report the time spent importing "
+        "each module and in each AppConfig.ready()."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=3,
+            help="Interpreters to start; the run with the median setup time "
+            "is reported.",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Modules and packages to list."
+        )
+        parser.add_argument("--output", help="Write JSON results to this file.")
+
+    def handle(self, *args, **options):
+        runs = sorted(
+            (self.probe() for _ in range(max(1, options["runs"]))),
+            key=lambda run: run["setup"],
+        )
+        run = runs[len(runs) // 2]
+        limit = options["limit"]
+
+        packages = defaultdict(float)
+        for name, own, _ in run["modules"]:
+            packages[name.split(".")[0]] += own
+        slowest = sorted(run["modules"], key=lambda module: -module[2])
+
+        results = {
+            "settings": settings.SETTINGS_MODULE,
+            "python": sys.version.split()[0],
+            "runs": len(runs),
+            "setup_seconds": {
+                "median": run["setup"],
+                "min": runs[0]["setup"],
+                "max": runs[-1]["setup"],
+            },
+            "urlconf_seconds": run["urlconf"],
+            "modules_imported": len(run["modules"]),
+            "import_seconds": sum(own for _, own, _ in run["modules"]),
+            "ready_seconds": dict(
+                sorted(run["ready"].items(), key=lambda item: -item[1])
+            ),
+            "packages": [
+                {"package": name, "seconds": seconds}
+                for name, seconds in sorted(
+                    packages.items(), key=lambda item: -item[1]
+                )[:limit]
+            ],
+            "modules": [
+                {"module": name, "self_seconds": own, "cumulative_seconds": cumulative}
+                for name, own, cumulative in slowest[:limit]
+            ],
+        }
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def probe(self):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", PROBE],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE},
+        )
+        if process.returncode != 0:
+            raise CommandError(process.stderr.strip().splitlines()[-1])
+        timings = json.loads(process.stdout.strip().splitlines()[-1])
+        timings["modules"] = parse_importtime(process.stderr)
+        return timings
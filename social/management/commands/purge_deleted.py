@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from social.deletion import purge_deleted_posts
+
+
+class Command(BaseCommand):
+    help = (
+        "Purge soft-deleted posts with their likes, comments, saves, "
+        "notifications and media. Posts whose media can't be deleted are kept "
+        "for the next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Purge at most this many posts.")
+
+    def handle(self, *args, **options):
+        purged = purge_deleted_posts(options["limit"])
+        self.stdout.write(f"Purged {purged} posts.")
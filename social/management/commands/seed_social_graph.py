@@ -0,0 +1,52 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from social.seeding import seed_social_graph
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk load a synthetic social graph with power-law friendships, skewed "
+        "post engagement and chat/group histories. Signals are bypassed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--friends-per-user", type=int, default=20)
+        parser.add_argument("--posts-per-user", type=int, default=5)
+        parser.add_argument("--likes-per-post", type=int, default=10)
+        parser.add_argument("--saves-per-post", type=int, default=1)
+        parser.add_argument("--comments-per-post", type=int, default=3)
+        parser.add_argument("--groups", type=int, default=100)
+        parser.add_argument("--group-size", type=int, default=50)
+        parser.add_argument("--messages-per-room", type=int, default=10)
+        parser.add_argument("--history-days", type=int, default=90)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--username-prefix",
+            default="user",
+            help="Use a different prefix to seed more users into a loaded database.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            counts = seed_social_graph(
+                users=options["users"],
+                friends_per_user=options["friends_per_user"],
+                posts_per_user=options["posts_per_user"],
+                likes_per_post=options["likes_per_post"],
+                saves_per_post=options["saves_per_post"],
+                comments_per_post=options["comments_per_post"],
+                groups=options["groups"],
+                group_size=options["group_size"],
+                messages_per_room=options["messages_per_room"],
+                history_days=options["history_days"],
+                seed=options["seed"],
+                batch_size=options["batch_size"],
+                username_prefix=options["username_prefix"],
+            )
+        counts["seconds"] = round(time.perf_counter() - start, 2)
+        self.stdout.write(json.dumps(counts, indent=2))
@@ -0,0 +1,87 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+from django.utils.encoding import iri_to_uri
+
+
+# Resolved URLs per storage instance, keyed by (file name, base URL). Entries
+# expire after MEDIA_URL_CACHE_TTL seconds so signed URLs are re-signed well
+# before they lapse; MEDIA_URL_CACHE_SIZE bounds each storage's cache.
+_caches = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _resolve(storage, name, base_url):
+    return iri_to_uri(absolute_url(storage.url(name), base_url))
+
+
+def absolute_url(url, base_url):
+    if url and base_url and url.startswith("/") and not url.startswith("//"):
+        return base_url + url
+    return url
+
+
+def _base_url(request):
+    if settings.MEDIA_PUBLIC_BASE_URL:
+        return settings.MEDIA_PUBLIC_BASE_URL
+    if request is None:
+        return ""
+    base_url = getattr(request, "_media_base_url", None)
+    if base_url is None:
+        base_url = request.build_absolute_uri("/")[:-1]
+        request._media_base_url = base_url
+    return base_url
+
+
+def socket_base_url(scope):
+    # _base_url() for payloads built outside a request and sent to a socket.
+    if settings.MEDIA_PUBLIC_BASE_URL:
+        return settings.MEDIA_PUBLIC_BASE_URL
+    host = dict(scope.get("headers", ())).get(b"host", b"").decode("latin-1")
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = [".localhost", "127.0.0.1", "[::1]"]
+    domain, _ = split_domain_port(host)
+    if not domain or not validate_host(domain, allowed_hosts):
+        return ""
+    scheme = "https" if scope.get("scheme") == "wss" else "http"
+    return f"{scheme}://{host}"
+
+
+def storage_url(storage, name, request=None):
+    if not name:
+        return None
+    base_url = _base_url(request)
+    size, ttl = settings.MEDIA_URL_CACHE_SIZE, settings.MEDIA_URL_CACHE_TTL
+    if not size or not ttl:
+        return _resolve(storage, name, base_url)
+
+    key = (name, base_url)
+    now = time.monotonic()
+    with _lock:
+        entries = _caches.setdefault(storage, OrderedDict())
+        cached = entries.get(key)
+        if cached is not None and cached[1] > now:
+            entries.move_to_end(key)
+            return cached[0]
+    url = _resolve(storage, name, base_url)
+    with _lock:
+        entries[key] = (url, now + ttl)
+        entries.move_to_end(key)
+        while len(entries) > size:
+            entries.popitem(last=False)
+    return url
+
+
+def media_url(file, request=None):
+    if not file:
+        return None
+    return storage_url(file.storage, file.name, request)
+
+
+def clear_cache():
+    with _lock:
+        _caches.clear()
@@ -0,0 +1,50 @@
+from . import caching
+from .models import ChatRoom, Group
+
+# Per-user sets of chat room and group ids, cached under versioned scopes that
+# the m2m_changed receivers in social/signals.py bump on membership changes.
+
+
+def room_ids(user_id):
+    return caching.cached_value(
+        [caching.rooms_scope(user_id)],
+        f"room_ids:{user_id}",
+        lambda: frozenset(
+            ChatRoom.members.through.objects.filter(userprofile_id=user_id).values_list(
+                "chatroom_id", flat=True
+            )
+        ),
+    )
+
+
+def group_ids(user_id):
+    return caching.cached_value(
+        [caching.groups_scope(user_id)],
+        f"group_ids:{user_id}",
+        lambda: frozenset(
+            Group.members.through.objects.filter(userprofile_id=user_id).values_list(
+                "group_id", flat=True
+            )
+        ),
+    )
+
+
+def socket_group(room_type, user_id):
+    # Joined by each of a user's chat or group sockets, so membership changes
+    # reach sockets that are not subscribed to the room's channel group yet.
+    return f"{room_type}_member_{user_id}"
+
+
+def as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_room_member(user_id, room_id):
+    return user_id is not None and as_id(room_id) in room_ids(user_id)
+
+
+def is_group_member(user_id, group_id):
+    return user_id is not None and as_id(group_id) in group_ids(user_id)
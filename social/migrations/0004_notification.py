@@ -0,0 +1,81 @@
+# Generated by Django 4.2.5 on 2026-10-18 23:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0003_alter_group_description"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Notification",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "verb",
+                    models.CharField(
+                        choices=[
+                            ("like", "Like"),
+                            ("comment", "Comment"),
+                            ("friend_request", "Friend request"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("actor_count", models.PositiveIntegerField(default=1)),
+                ("is_read", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "actor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="social.userprofile",
+                    ),
+                ),
+                (
+                    "post",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="social.post",
+                    ),
+                ),
+                (
+                    "recipient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="notifications",
+                        to="social.userprofile",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-updated_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["recipient", "-updated_at"],
+                        name="social_noti_recipie_b20701_idx",
+                    ),
+                    models.Index(
+                        fields=["recipient", "is_read"],
+                        name="social_noti_recipie_dbb77a_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
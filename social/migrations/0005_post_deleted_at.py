@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0004_notification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="deleted_at",
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 4.2.5 on 2026-10-18 23:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0005_post_deleted_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GroupMessagesArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("text", models.TextField(blank=True, null=True)),
+                (
+                    "file",
+                    models.FileField(
+                        blank=True, null=True, upload_to="file/group_file"
+                    ),
+                ),
+                ("created_at", models.DateTimeField()),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_message",
+                        to="social.group",
+                    ),
+                ),
+                (
+                    "sender",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="social.userprofile",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["room", "-id"], name="social_grou_room_id_acd7a5_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="ChatMessageArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("text", models.TextField(blank=True, null=True)),
+                (
+                    "file",
+                    models.FileField(
+                        blank=True, null=True, upload_to="file/chat_files"
+                    ),
+                ),
+                ("created_at", models.DateTimeField()),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_message",
+                        to="social.chatroom",
+                    ),
+                ),
+                (
+                    "sender",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="social.userprofile",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["room", "-id"], name="social_chat_room_id_57ebcd_idx"
+                    )
+                ],
+            },
+        ),
+    ]
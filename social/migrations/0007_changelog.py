@@ -0,0 +1,67 @@
+# Generated by Django 4.2.5 on 2026-10-18 23:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0006_message_archive"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeLog",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("post", "Post"),
+                            ("comment", "Comment"),
+                            ("like", "Like"),
+                            ("friend", "Friend"),
+                            ("friend_request", "Friend request"),
+                            ("room", "Chat room"),
+                            ("group", "Group"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("parent_id", models.BigIntegerField(null=True)),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[("upsert", "Upsert"), ("delete", "Delete")],
+                        max_length=10,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="social.userprofile",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "id"], name="social_chan_user_id_baea88_idx"
+                    ),
+                    models.Index(
+                        fields=["kind", "object_id"], name="social_chan_kind_aa4a90_idx"
+                    ),
+                    models.Index(
+                        fields=["created_at"], name="social_chan_created_e1c0be_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.5 on 2026-10-18 23:57
+
+import math
+from django.conf import settings
+from django.db import migrations, models
+
+
+def score_existing_posts(apps, schema_editor):
+    # Existing engagement is counted as if it happened when the post was
+    # created; new engagement is scored as it happens.
+    Post = apps.get_model("social", "Post")
+    weights = settings.TRENDING_WEIGHTS
+    posts = Post.objects.annotate(
+        likes=models.Count("post_likes", distinct=True),
+        comments=models.Count("post_comments", distinct=True),
+        saves=models.Count("save_post", distinct=True),
+    ).order_by()
+    batch = []
+    for post in posts.iterator(chunk_size=1000):
+        weight = (
+            weights["post"]
+            + weights["like"] * post.likes
+            + weights["comment"] * post.comments
+            + weights["save"] * post.saves
+        )
+        post.hot_score = (
+            math.log2(weight)
+            + (post.created_at.timestamp() - 1_600_000_000)
+            / settings.TRENDING_HALF_LIFE
+        )
+        batch.append(post)
+        if len(batch) == 1000:
+            Post.objects.bulk_update(batch, ["hot_score"])
+            batch = []
+    Post.objects.bulk_update(batch, ["hot_score"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0007_changelog"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="hot_score",
+            field=models.FloatField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(score_existing_posts, migrations.RunPython.noop),
+    ]
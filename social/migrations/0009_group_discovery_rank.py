@@ -0,0 +1,34 @@
+# Generated by Django 4.2.5 on 2026-10-19 00:18
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def rank_existing_groups(apps, schema_editor):
+    Group = apps.get_model("social", "Group")
+    member_count = (
+        Group.members.through.objects.filter(group_id=models.OuterRef("pk"))
+        .values("group_id")
+        .annotate(count=models.Count("*"))
+        .values("count")
+    )
+    Group.objects.update(
+        discovery_rank=Coalesce(models.Subquery(member_count), 0) * 2**32
+        + models.F("id")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0008_post_hot_score"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="group",
+            name="discovery_rank",
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(rank_existing_groups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-19 00:24
+
+from django.db import migrations, models
+
+
+def record_latest_actors(apps, schema_editor):
+    # Earlier actors of coalesced notifications were not kept.
+    Notification = apps.get_model("social", "Notification")
+    through = Notification.actors.through
+    rows = Notification.objects.values_list("id", "actor_id").iterator(chunk_size=1000)
+    batch = []
+    for notification_id, actor_id in rows:
+        batch.append(through(notification_id=notification_id, userprofile_id=actor_id))
+        if len(batch) == 1000:
+            through.objects.bulk_create(batch)
+            batch = []
+    through.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0009_group_discovery_rank"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="actors",
+            field=models.ManyToManyField(related_name="+", to="social.userprofile"),
+        ),
+        migrations.RunPython(record_latest_actors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-19 00:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def delete_global_entries(apps, schema_editor):
+    # Entries used to be shared by every feed and can't be scoped now.
+    ChangeLog = apps.get_model("social", "ChangeLog")
+    ChangeLog.objects.filter(user__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("social", "0010_notification_actors"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_global_entries, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="changelog",
+            name="user",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="social.userprofile",
+            ),
+        ),
+    ]
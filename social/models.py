@@ -1,5 +1,6 @@
 from django.db import models
 from django.db.models import Prefetch
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.core.validators import FileExtensionValidator
 from .validators import validate_file_size, validate_image_size
@@ -76,7 +77,7 @@ class PostQuerySet(models.QuerySet):
 
 class PostManager(models.Manager):
     def get_queryset(self):
-        return PostQuerySet(self.model, using=self._db)
+        return PostQuerySet(self.model, using=self._db).filter(deleted_at__isnull=True)
 
     def with_counts(self):
         return self.get_queryset().with_counts()
@@ -97,8 +98,12 @@ class Post(models.Model):
         ],
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, editable=False, db_index=True)
+    # Maintained by social.trending on every like, comment and save.
+    hot_score = models.FloatField(null=True, editable=False, db_index=True)
 
     objects = PostManager()
+    all_objects = models.Manager()
 
     class Meta:
         ordering = ["-created_at"]
@@ -162,6 +167,85 @@ class ChatMessage(models.Model):
         ordering = ["-created_at"]
 
 
+class ChatMessageArchive(models.Model):
+    # Messages moved out of ChatMessage by social.archive; ids are kept, so
+    # history cursors work across both tables.
+    id = models.BigIntegerField(primary_key=True)
+    room = models.ForeignKey(
+        ChatRoom, on_delete=models.CASCADE, related_name="archived_message"
+    )
+    sender = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name="+")
+    text = models.TextField(blank=True, null=True)
+    file = models.FileField(upload_to="file/chat_files", blank=True, null=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["room", "-id"])]
+
+
+class GroupQuerySet(models.QuerySet):
+    def with_member_summary(self, user_id):
+        members = Group.members.through.objects.filter(group_id=models.OuterRef("pk"))
+        return self.annotate(
+            member_count=Coalesce(
+                models.Subquery(
+                    members.values("group_id")
+                    .annotate(count=models.Count("*"))
+                    .values("count")
+                ),
+                0,
+            ),
+            is_member=models.Exists(members.filter(userprofile_id=user_id)),
+        ).prefetch_related(
+            Prefetch(
+                "members",
+                queryset=UserProfile.objects.select_related("user").order_by("user_id")[
+                    : settings.GROUP_MEMBERS_PREVIEW
+                ],
+                to_attr="members_preview",
+            )
+        )
+
+    def ranked_for_discovery(self, friend_counts=None):
+        # Groups rank by their stored discovery_rank, or with ``friend_counts``
+        # ({group_id: friends who are members}) by friends first. Either way
+        # the score and the id are packed into one unique key, so cursor
+        # pagination seeks on it instead of using offsets.
+        if friend_counts is None:
+            rank = models.F("discovery_rank")
+        else:
+            rank = models.Case(
+                *[
+                    models.When(id=group_id, then=count * 2**32 + group_id)
+                    for group_id, count in friend_counts.items()
+                ],
+                default=models.F("id"),
+                output_field=models.BigIntegerField(),
+            )
+        return self.annotate(rank=rank)
+
+    def update_discovery_rank(self):
+        member_count = (
+            Group.members.through.objects.filter(group_id=models.OuterRef("pk"))
+            .values("group_id")
+            .annotate(count=models.Count("*"))
+            .values("count")
+        )
+        return self.update(
+            discovery_rank=Coalesce(models.Subquery(member_count), 0) * 2**32
+            + models.F("id")
+        )
+
+
+class GroupManager(models.Manager):
+    def get_queryset(self):
+        return GroupQuerySet(self.model, using=self._db)
+
+    def with_member_summary(self, user_id):
+        return self.get_queryset().with_member_summary(user_id)
+
+
 class Group(models.Model):
     members = models.ManyToManyField(UserProfile)
     creator = models.ForeignKey(
@@ -173,6 +257,11 @@ class Group(models.Model):
     )
     description = models.TextField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # member count * 2**32 + id, kept up to date by social.signals so that
+    # group discovery reads pages off an index.
+    discovery_rank = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    objects = GroupManager()
 
 
 class GroupMessages(models.Model):
@@ -191,3 +280,98 @@ class GroupMessages(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+
+
+class GroupMessagesArchive(models.Model):
+    # Messages moved out of GroupMessages by social.archive.
+    id = models.BigIntegerField(primary_key=True)
+    room = models.ForeignKey(
+        Group, on_delete=models.CASCADE, related_name="archived_message"
+    )
+    sender = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name="+")
+    text = models.TextField(blank=True, null=True)
+    file = models.FileField(upload_to="file/group_file", blank=True, null=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["room", "-id"])]
+
+
+class Notification(models.Model):
+    LIKE = "like"
+    COMMENT = "comment"
+    FRIEND_REQUEST = "friend_request"
+
+    VERBS = [
+        (LIKE, "Like"),
+        (COMMENT, "Comment"),
+        (FRIEND_REQUEST, "Friend request"),
+    ]
+
+    recipient = models.ForeignKey(
+        UserProfile, on_delete=models.CASCADE, related_name="notifications"
+    )
+    actor = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name="+")
+    # Everyone coalesced into this notification; actor is the latest.
+    actors = models.ManyToManyField(UserProfile, related_name="+")
+    verb = models.CharField(max_length=20, choices=VERBS)
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, null=True, related_name="+"
+    )
+    actor_count = models.PositiveIntegerField(default=1)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-updated_at"]
+        indexes = [
+            models.Index(fields=["recipient", "-updated_at"]),
+            models.Index(fields=["recipient", "is_read"]),
+        ]
+
+
+class ChangeLog(models.Model):
+    POST = "post"
+    COMMENT = "comment"
+    LIKE = "like"
+    FRIEND = "friend"
+    FRIEND_REQUEST = "friend_request"
+    ROOM = "room"
+    GROUP = "group"
+
+    KINDS = [
+        (POST, "Post"),
+        (COMMENT, "Comment"),
+        (LIKE, "Like"),
+        (FRIEND, "Friend"),
+        (FRIEND_REQUEST, "Friend request"),
+        (ROOM, "Chat room"),
+        (GROUP, "Group"),
+    ]
+
+    UPSERT = "upsert"
+    DELETE = "delete"
+
+    ACTIONS = [(UPSERT, "Upsert"), (DELETE, "Delete")]
+
+    id = models.BigAutoField(primary_key=True)
+    # The user whose feed the entry is in. Deleting a user deletes their posts
+    # after their entries, which records new ones for them; without a
+    # constraint those are left for compact() instead of failing the delete.
+    user = models.ForeignKey(
+        UserProfile, on_delete=models.CASCADE, db_constraint=False, related_name="+"
+    )
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.BigIntegerField()
+    parent_id = models.BigIntegerField(null=True)
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"]),
+            models.Index(fields=["kind", "object_id"]),
+            models.Index(fields=["created_at"]),
+        ]
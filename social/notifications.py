@@ -0,0 +1,103 @@
+import logging
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    return f"user_{user_id}"
+
+
+def notify(recipient_id, actor_id, verb, post_id=None):
+    notify_many(actor_id, verb, [(recipient_id, post_id)])
+
+
+def notify_many(actor_id, verb, targets):
+    # Notifies each (recipient_id, post_id) pair in ``targets`` in a fixed
+    # number of queries. Unread notifications of the same kind about the same
+    # post are coalesced for NOTIFICATION_COALESCE_SECONDS, so a viral post
+    # produces one "X and 41 others liked your post" row instead of 42.
+    targets = {target for target in targets if target[0] != actor_id}
+    if not targets:
+        return
+    since = timezone.now() - timedelta(seconds=settings.NOTIFICATION_COALESCE_SECONDS)
+    pairs = Q()
+    for recipient_id, post_id in targets:
+        pairs |= Q(recipient_id=recipient_id, post_id=post_id)
+    through = Notification.actors.through
+    with transaction.atomic():
+        coalesced = {}
+        for notification in Notification.objects.select_for_update().filter(
+            pairs, verb=verb, is_read=False, updated_at__gte=since
+        ):
+            coalesced.setdefault(
+                (notification.recipient_id, notification.post_id), notification.id
+            )
+        created = Notification.objects.bulk_create(
+            Notification(
+                recipient_id=recipient_id, actor_id=actor_id, verb=verb, post_id=post_id
+            )
+            for recipient_id, post_id in targets - coalesced.keys()
+        )
+        # Only actors not seen before add to the count.
+        seen = set(
+            through.objects.filter(
+                notification_id__in=coalesced.values(), userprofile_id=actor_id
+            ).values_list("notification_id", flat=True)
+        )
+        new_actor = [id for id in coalesced.values() if id not in seen]
+        through.objects.bulk_create(
+            through(notification_id=id, userprofile_id=actor_id)
+            for id in [*new_actor, *(notification.id for notification in created)]
+        )
+        if coalesced:
+            Notification.objects.filter(id__in=coalesced.values()).update(
+                actor_id=actor_id,
+                actor_count=F("actor_count")
+                + Case(When(id__in=new_actor, then=1), default=0),
+                updated_at=timezone.now(),
+            )
+        ids = [*coalesced.values(), *(notification.id for notification in created)]
+        transaction.on_commit(lambda: push_many(ids))
+
+
+def push(notification_id):
+    push_many([notification_id])
+
+
+def push_many(notification_ids):
+    from .serializers import NotificationSerializer
+
+    try:
+        found = Notification.objects.select_related("actor__user").in_bulk(
+            notification_ids
+        )
+    except Exception:
+        logger.warning(
+            "Could not push notifications %s", notification_ids, exc_info=True
+        )
+        return
+    for notification_id in notification_ids:
+        try:
+            notification = found[notification_id]
+            async_to_sync(get_channel_layer().group_send)(
+                user_group(notification.recipient_id),
+                {
+                    "type": "notification",
+                    "notification": NotificationSerializer(notification).data,
+                },
+            )
+        except Exception:
+            # The notification is stored (or was deleted since) either way;
+            # clients catch up by listing. Media URLs are made absolute by
+            # NotificationConsumer, which knows the socket's host.
+            logger.warning(
+                "Could not push notification %s", notification_id, exc_info=True
+            )
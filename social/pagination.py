@@ -0,0 +1,51 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from .membership import as_id
+
+
+class MemberPagination(PageNumberPagination):
+    page_size = settings.GROUP_MEMBERS_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class GroupDiscoveryPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "-rank"
+
+
+class NotificationPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+def page_args(params):
+    # ``?before=<id>&limit=<n>`` for the id-cursor message and feed pages.
+    limit = as_id(params.get("limit")) or settings.ASYNC_PAGE_SIZE
+    return as_id(params.get("before")), max(1, min(limit, settings.ASYNC_PAGE_SIZE_MAX))
+
+
+def before(queryset, before_id):
+    if before_id is not None:
+        queryset = queryset.filter(id__lt=before_id)
+    return queryset.order_by("-id")
+
+
+def message_page(queryset, archive, params):
+    # Newest first, paged with an id cursor: ``?before=<next>``. Archived
+    # rows have lower ids than hot ones, so ``archive`` is only read when a
+    # page runs out of hot rows. Rows are instances or values_list() tuples
+    # starting with the id.
+    def row_id(row):
+        return row[0] if isinstance(row, tuple) else row.id
+
+    before_id, limit = page_args(params)
+    rows = list(before(queryset, before_id)[: limit + 1])
+    if len(rows) <= limit:
+        cursor = row_id(rows[-1]) if rows else before_id
+        rows += before(archive, cursor)[: limit + 1 - len(rows)]
+    next_id = row_id(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_id
@@ -1,9 +1,15 @@
 from rest_framework import permissions
-from .models import ChatRoom
+from . import membership
 
 class IsChatRoomMember(permissions.BasePermission):
     def has_permission(self, request, view):
         room_id = view.kwargs['chatroom_pk']
         user_id = request.user.id
-        return ChatRoom.objects.filter(id=room_id, members=user_id).exists()
+        return membership.is_room_member(user_id, room_id)
 
+
+class IsGroupMember(permissions.BasePermission):
+    def has_permission(self, request, view):
+        group_id = view.kwargs['group_pk']
+        user_id = request.user.id
+        return membership.is_group_member(user_id, group_id)
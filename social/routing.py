@@ -5,4 +5,5 @@ from social import consumers
 websocket_urlpatterns = [
     re_path(r"ws/$", consumers.ChatConsumer.as_asgi()),
     re_path(r"ws/group/$", consumers.GroupChatConsumer.as_asgi()),
+    re_path(r"ws/notifications/$", consumers.NotificationConsumer.as_asgi()),
 ]
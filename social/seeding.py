@@ -0,0 +1,273 @@
+import itertools
+import random
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
+from core.models import User
+from . import trending
+from .models import (
+    ChatMessage,
+    ChatRoom,
+    Comment,
+    Friend,
+    FriendRequest,
+    Group,
+    GroupMessages,
+    Like,
+    Post,
+    Save,
+    UserProfile,
+)
+
+# Pareto shape for per-row counts (posts per user, likes per post, ...) and
+# Zipf exponent for how often a user is picked as a friend, liker or member.
+PARETO_ALPHA = 2.0
+ZIPF_EXPONENT = 0.8
+
+
+def _insert(model, rows, batch_size):
+    # bulk_create materialises its input, so feed it one batch at a time to
+    # keep memory flat. Used for the tables whose primary keys are needed.
+    rows = iter(rows)
+    created = []
+    while batch := list(itertools.islice(rows, batch_size)):
+        created.extend(model.objects.bulk_create(batch))
+    return created
+
+
+def _copy(model, fields, rows, batch_size):
+    # Plain executemany for the big tables whose primary keys are never read
+    # back; building model instances dominates bulk_create at this volume.
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        quote(model._meta.db_table),
+        ", ".join(quote(model._meta.get_field(name).column) for name in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+    rows = iter(rows)
+    count = 0
+    with connection.cursor() as cursor:
+        while batch := list(itertools.islice(rows, batch_size)):
+            cursor.executemany(sql, batch)
+            count += len(batch)
+    return count
+
+
+def _skewed(rng, mean, cap):
+    # Pareto draw rescaled to the requested mean, stochastically rounded.
+    if mean <= 0:
+        return 0
+    value = mean * (PARETO_ALPHA - 1) / PARETO_ALPHA * rng.paretovariate(PARETO_ALPHA)
+    return min(cap, int(value + rng.random()))
+
+
+def _popularity(ids, rng):
+    # Cumulative Zipf weights over a shuffled copy of ``ids`` so popularity is
+    # independent of insertion order.
+    ranked = list(ids)
+    rng.shuffle(ranked)
+    weights = itertools.accumulate(
+        1 / rank**ZIPF_EXPONENT for rank in range(1, len(ranked) + 1)
+    )
+    return ranked, list(weights)
+
+
+def _pick(rng, population, k):
+    ranked, cum_weights = population
+    return sorted(set(rng.choices(ranked, cum_weights=cum_weights, k=k)))
+
+
+def seed_social_graph(
+    users=200,
+    friends_per_user=10,
+    posts_per_user=3,
+    likes_per_post=5,
+    saves_per_post=1,
+    comments_per_post=2,
+    groups=10,
+    group_size=20,
+    messages_per_room=5,
+    history_days=90,
+    seed=1,
+    batch_size=5000,
+    username_prefix="user",
+):
+    # Rows are written with bulk_create or executemany, which skip the
+    # per-row signals in social/signals.py, so profiles and friend lists are
+    # created here too. Every ``*_per_*`` and ``group_size`` argument is a
+    # mean; the actual counts are heavy tailed. Message, like and comment
+    # timestamps are spread over ``history_days``. The same seed always
+    # yields the same graph.
+    rng = random.Random(seed)
+    now = timezone.now()
+    span = history_days * 86400
+    adapt = connection.ops.adapt_datetimefield_value
+
+    def stamp():
+        return adapt(now - timedelta(seconds=rng.random() * span))
+
+    profile_ids = [
+        user.id
+        for user in _insert(
+            User,
+            (
+                User(
+                    username=f"{username_prefix}{index}",
+                    email=f"{username_prefix}{index}@example.com",
+                    password="!",
+                )
+                for index in range(users)
+            ),
+            batch_size,
+        )
+    ]
+    counts = {"users": len(profile_ids)}
+    _copy(UserProfile, ["user"], ((id,) for id in profile_ids), batch_size)
+    friend_list_ids = {
+        row.user_id: row.id
+        for row in _insert(
+            Friend, (Friend(user_id=id) for id in profile_ids), batch_size
+        )
+    }
+    popular = _popularity(profile_ids, rng)
+
+    # Each user befriends a heavy-tailed number of users chosen by
+    # popularity, so the resulting degree distribution follows a power law.
+    pairs = set()
+    for user_id in profile_ids:
+        wanted = _skewed(rng, friends_per_user / 2, users - 1)
+        for other_id in _pick(rng, popular, wanted):
+            if other_id != user_id:
+                pairs.add((min(user_id, other_id), max(user_id, other_id)))
+    pairs = sorted(pairs)
+    counts["friendships"] = len(pairs)
+
+    _copy(
+        Friend.friends.through,
+        ["friend", "userprofile"],
+        (
+            (friend_list_ids[owner], friend)
+            for a, b in pairs
+            for owner, friend in ((a, b), (b, a))
+        ),
+        batch_size,
+    )
+    del friend_list_ids
+    _copy(
+        FriendRequest,
+        ["sender", "receiver", "is_accepted", "created_at"],
+        ((a, b, True, stamp()) for a, b in pairs),
+        batch_size,
+    )
+
+    counts["rooms"] = 0
+    counts["chat_messages"] = 0
+    for offset in range(0, len(pairs), batch_size):
+        chunk = pairs[offset : offset + batch_size]
+        rooms = ChatRoom.objects.bulk_create(ChatRoom() for _ in chunk)
+        _copy(
+            ChatRoom.members.through,
+            ["chatroom", "userprofile"],
+            ((room.id, member) for room, pair in zip(rooms, chunk) for member in pair),
+            batch_size,
+        )
+        counts["rooms"] += len(rooms)
+        counts["chat_messages"] += _copy(
+            ChatMessage,
+            ["room", "sender", "text", "created_at"],
+            (
+                (room.id, rng.choice(pair), f"message {index}", stamp())
+                for room, pair in zip(rooms, chunk)
+                for index in range(_skewed(rng, messages_per_room, 10 * batch_size))
+            ),
+            batch_size,
+        )
+    del pairs
+
+    post_ids = [
+        post.id
+        for post in _insert(
+            Post,
+            (
+                Post(user_id=user_id, text=f"post {index} by user {user_id}")
+                for user_id in profile_ids
+                for index in range(_skewed(rng, posts_per_user, 10 * batch_size))
+            ),
+            batch_size,
+        )
+    ]
+    counts["posts"] = len(post_ids)
+
+    # A few posts go viral while most get little or no engagement.
+    for model, mean in ((Like, likes_per_post), (Save, saves_per_post)):
+        counts[model._meta.model_name + "s"] = _copy(
+            model,
+            ["post", "user", "created_at"],
+            (
+                (post_id, user_id, stamp())
+                for post_id in post_ids
+                for user_id in _pick(rng, popular, _skewed(rng, mean, users))
+            ),
+            batch_size,
+        )
+    counts["comments"] = _copy(
+        Comment,
+        ["post", "user", "text", "created_at"],
+        (
+            (post_id, user_id, f"comment {index}", stamp())
+            for post_id in post_ids
+            for index, user_id in enumerate(
+                rng.choices(
+                    popular[0],
+                    cum_weights=popular[1],
+                    k=_skewed(rng, comments_per_post, 10 * batch_size),
+                )
+            )
+        ),
+        batch_size,
+    )
+    del post_ids
+    # bulk_create skips the signal that scores new posts.
+    trending.score_posts(Post.all_objects.filter(hot_score__isnull=True), batch_size)
+
+    group_rows = _insert(
+        Group,
+        (
+            Group(creator_id=rng.choice(profile_ids), name=f"group {index}")
+            for index in range(groups)
+        ),
+        batch_size,
+    )
+    counts["groups"] = len(group_rows)
+    members = {
+        group.id: sorted(
+            {group.creator_id}
+            | set(_pick(rng, popular, _skewed(rng, group_size, users)))
+        )
+        for group in group_rows
+    }
+    counts["group_members"] = _copy(
+        Group.members.through,
+        ["group", "userprofile"],
+        (
+            (group_id, member)
+            for group_id, member_ids in members.items()
+            for member in member_ids
+        ),
+        batch_size,
+    )
+    # Raw inserts skip the m2m_changed signal that ranks groups.
+    Group.objects.all().update_discovery_rank()
+    counts["group_messages"] = _copy(
+        GroupMessages,
+        ["room", "sender", "text", "created_at"],
+        (
+            (group_id, rng.choice(member_ids), f"message {index}", stamp())
+            for group_id, member_ids in members.items()
+            for index in range(
+                _skewed(rng, messages_per_room * len(member_ids), 100 * batch_size)
+            )
+        ),
+        batch_size,
+    )
+    return counts
@@ -1,4 +1,9 @@
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, Exists, OuterRef
+from django.db.models.signals import m2m_changed
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from .models import (
     ChatMessage,
     ChatRoom,
@@ -11,7 +16,12 @@ from .models import (
     UserProfile,
     Group,
     GroupMessages,
+    Notification,
 )
+from . import engagement
+from .deletion import delete_rows
+from .media import media_url
+from .typeahead import extract_mentions
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -24,18 +34,15 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
 class UserSerializer(serializers.ModelSerializer):
     username = serializers.StringRelatedField(source="user")
+    profile_image = serializers.SerializerMethodField()
+
+    def get_profile_image(self, obj):
+        return media_url(obj.profile_image, self.context.get("request"))
 
     class Meta:
         model = UserProfile
         fields = ["user_id", "username", "profile_image"]
 
-    def to_representation(self, instance):
-        request = self.context.get("request")
-        data = super().to_representation(instance)
-        if request is not None and data["profile_image"]:
-            data["profile_image"] = request.build_absolute_uri(data["profile_image"])
-        return data
-
 
 class FriendRequestDecisionSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
@@ -91,29 +98,68 @@ class FriendRequestSerializer(serializers.ModelSerializer):
         )
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class LivePostMixin:
+    # Comments, likes and saves are only taken on posts that aren't deleted.
+    def validate(self, data):
+        post_id = str(self.context["post_id"])
+        if not post_id.isdigit() or not Post.objects.filter(id=post_id).exists():
+            raise NotFound("Post not found.")
+        # The URL kwarg is a string; rows are created with the parsed id.
+        self.post_id = int(post_id)
+        return data
+
+
+class CommentSerializer(LivePostMixin, serializers.ModelSerializer):
     username = serializers.CharField(source="user.user", read_only=True)
     profile_image = serializers.SerializerMethodField()
+    mentions = serializers.SerializerMethodField()
 
     def get_profile_image(self, obj):
-        request = self.context.get("request")
-        if obj.user.profile_image:
-            return request.build_absolute_uri(obj.user.profile_image.url)
-        return None
+        return media_url(obj.user.profile_image, self.context.get("request"))
+
+    def get_mentions(self, obj):
+        return extract_mentions(obj.text)
 
     class Meta:
         model = Comment
-        fields = ["id", "user_id", "username", "profile_image", "text", "created_at"]
+        fields = [
+            "id",
+            "user_id",
+            "username",
+            "profile_image",
+            "text",
+            "mentions",
+            "created_at",
+        ]
 
     def create(self, validated_data):
-        post_id = self.context["post_id"]
+        post_id = self.post_id
         user_id = self.context["user_id"]
         return Comment.objects.create(
             post_id=post_id, user_id=user_id, **validated_data
         )
 
 
-class LikePostSerializer(serializers.ModelSerializer):
+def lock_engagement(user_id):
+    # A user's likes and saves are written under a lock on their profile, so
+    # the bulk endpoint reads back exactly the rows it inserted and no row's
+    # side effects run twice.
+    list(
+        UserProfile.objects.select_for_update()
+        .filter(user_id=user_id)
+        .values_list("pk")
+    )
+
+
+def delete_engagement(instance):
+    model = type(instance)
+    with transaction.atomic(using=router.db_for_write(model)):
+        lock_engagement(instance.user_id)
+        # Deletes and signals nothing if a concurrent request got there first.
+        model.objects.filter(id=instance.id).delete()
+
+
+class LikePostSerializer(LivePostMixin, serializers.ModelSerializer):
     username = serializers.CharField(source="user.user", read_only=True)
 
     class Meta:
@@ -121,14 +167,18 @@ class LikePostSerializer(serializers.ModelSerializer):
         fields = ["id", "user_id", "username", "created_at"]
 
     def create(self, validated_data):
-        user_id = self.context["user_id"]
-        post_id = self.context["post_id"]
-        if Like.objects.filter(user_id=user_id, post_id=post_id).exists():
+        # The unique constraint catches double taps that race each other.
+        try:
+            with transaction.atomic():
+                lock_engagement(self.context["user_id"])
+                return Like.objects.create(
+                    user_id=self.context["user_id"], post_id=self.post_id
+                )
+        except IntegrityError:
             raise serializers.ValidationError("You can't like one post twice.")
-        return Like.objects.create(user_id=user_id, post_id=post_id)
 
 
-class SavePostSerializer(serializers.ModelSerializer):
+class SavePostSerializer(LivePostMixin, serializers.ModelSerializer):
     username = serializers.CharField(source="user.user", read_only=True)
 
     class Meta:
@@ -136,11 +186,86 @@ class SavePostSerializer(serializers.ModelSerializer):
         fields = ["id", "user_id", "username", "created_at"]
 
     def create(self, validated_data):
-        user_id = self.context["user_id"]
-        post_id = self.context["post_id"]
-        if Save.objects.filter(user_id=user_id, post_id=post_id).exists():
+        # The unique constraint catches double taps that race each other.
+        try:
+            with transaction.atomic():
+                lock_engagement(self.context["user_id"])
+                return Save.objects.create(
+                    user_id=self.context["user_id"], post_id=self.post_id
+                )
+        except IntegrityError:
             raise serializers.ValidationError("You can't save one post twice.")
-        return Save.objects.create(user_id=user_id, post_id=post_id)
+
+
+class BulkEngagementSerializer(serializers.Serializer):
+    # Sets the user's like or save on a batch of posts, so clients can flush
+    # toggles queued offline in one request. Retrying a request leaves every
+    # post in the same state.
+    add = serializers.ListField(
+        child=serializers.IntegerField(),
+        default=list,
+        max_length=settings.ENGAGEMENT_BULK_MAX,
+    )
+    remove = serializers.ListField(
+        child=serializers.IntegerField(),
+        default=list,
+        max_length=settings.ENGAGEMENT_BULK_MAX,
+    )
+
+    def validate(self, data):
+        if not data["add"] and not data["remove"]:
+            raise serializers.ValidationError("Nothing to add or remove.")
+        if set(data["add"]) & set(data["remove"]):
+            raise serializers.ValidationError(
+                "A post can't be both added and removed."
+            )
+        return data
+
+    def apply(self, model):
+        user_id = self.context["user_id"]
+        add = set(self.validated_data["add"])
+        remove = set(self.validated_data["remove"])
+        with transaction.atomic(using=router.db_for_write(model)):
+            lock_engagement(user_id)
+            state = dict(
+                Post.objects.filter(id__in=add | remove)
+                .annotate(
+                    engaged=Exists(
+                        model.objects.filter(user_id=user_id, post_id=OuterRef("pk"))
+                    )
+                )
+                .values_list("id", "engaged")
+            )
+            added = sorted(id for id in add if id in state and not state[id])
+            removed = sorted(id for id in remove if state.get(id))
+            # bulk_create and delete_rows skip the model signals, so the side
+            # effects are applied to the whole batch here.
+            if added:
+                model.objects.bulk_create(
+                    [model(user_id=user_id, post_id=id) for id in added],
+                    ignore_conflicts=True,
+                )
+                instances = model.objects.filter(user_id=user_id, post_id__in=added)
+                engagement.saved(model, list(instances))
+            if removed:
+                instances = list(
+                    model.objects.filter(user_id=user_id, post_id__in=removed)
+                )
+                delete_rows(model, [row.id for row in instances])
+                engagement.deleted(model, instances)
+        counts = dict.fromkeys(sorted(state), 0)
+        counts.update(
+            model.objects.filter(post_id__in=state)
+            .values("post_id")
+            .annotate(count=Count("id"))
+            .values_list("post_id", "count")
+        )
+        return {
+            "added": added,
+            "removed": removed,
+            "skipped": sorted((add | remove) - state.keys()),
+            "counts": counts,
+        }
 
 
 class ListPostSerializer(serializers.ModelSerializer):
@@ -155,16 +280,10 @@ class ListPostSerializer(serializers.ModelSerializer):
     save_post = SavePostSerializer(read_only=True, many=True)
 
     def get_media_file(self, obj):
-        request = self.context["request"]
-        if obj.media_file:
-            return request.build_absolute_uri(obj.media_file.url)
-        return None
+        return media_url(obj.media_file, self.context["request"])
 
     def get_profile_image(self, obj):
-        request = self.context.get("request")
-        if obj.user.profile_image:
-            return request.build_absolute_uri(obj.user.profile_image.url)
-        return None
+        return media_url(obj.user.profile_image, self.context.get("request"))
 
     class Meta:
         model = Post
@@ -205,12 +324,13 @@ class PostSerializer(serializers.ModelSerializer):
 class ChatMessageSerializer(serializers.ModelSerializer):
     sender_id = serializers.IntegerField(source="sender.user_id", read_only=True)
     username = serializers.StringRelatedField(source="sender.user", read_only=True)
-    profile_image = serializers.StringRelatedField(
-        source="sender.profile_image", read_only=True
-    )
+    profile_image = serializers.SerializerMethodField()
     file_name = serializers.SerializerMethodField()
     file_size = serializers.SerializerMethodField()
 
+    def get_profile_image(self, obj):
+        return media_url(obj.sender.profile_image, self.context.get("request"))
+
     def get_file_name(self, obj):
         if obj.file:
             return obj.file.name.split("/")[-1]
@@ -221,13 +341,6 @@ class ChatMessageSerializer(serializers.ModelSerializer):
             return obj.file.size
         return None
 
-    def to_representation(self, instance):
-        request = self.context.get("request")
-        data = super().to_representation(instance)
-        if request is not None and data["profile_image"]:
-            data["profile_image"] = request.build_absolute_uri(data["profile_image"])
-        return data
-
     class Meta:
         model = ChatMessage
         fields = [
@@ -263,24 +376,17 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         friend = next(
             (member for member in obj.members.all() if member.user_id != user_id), None
         )
-        return UserSerializer(friend).data
+        return UserSerializer(friend, context=self.context).data
 
     def get_message(self, obj):
-        first_message = obj.message.first()
+        # Set by ChatRoomViewSet; archived ids are lower than hot ones.
+        latest = obj.latest_messages or obj.latest_archived_messages
+        first_message = latest[0] if latest else None
         if first_message:
-            return ChatMessageSerializer(first_message).data
+            return ChatMessageSerializer(first_message, context=self.context).data
         else:
             return None
 
-    def to_representation(self, instance):
-        request = self.context.get("request")
-        data = super().to_representation(instance)
-        if request is not None and data["friend"]["profile_image"]:
-            data["friend"]["profile_image"] = request.build_absolute_uri(
-                data["friend"]["profile_image"]
-            )
-        return data
-
     class Meta:
         model = ChatRoom
         fields = ["id", "friend", "message"]
@@ -288,7 +394,9 @@ class ChatRoomSerializer(serializers.ModelSerializer):
 
 class GroupSerializer(serializers.ModelSerializer):
     creator = UserSerializer(read_only=True)
-    members = UserSerializer(many=True, read_only=True)
+    member_count = serializers.IntegerField(read_only=True)
+    members_preview = UserSerializer(many=True, read_only=True)
+    is_member = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Group
@@ -296,7 +404,9 @@ class GroupSerializer(serializers.ModelSerializer):
             "id",
             "name",
             "creator",
-            "members",
+            "member_count",
+            "members_preview",
+            "is_member",
             "description",
             "image",
             "created_at",
@@ -306,7 +416,7 @@ class GroupSerializer(serializers.ModelSerializer):
         creator_id = self.context["user_id"]
         group = Group.objects.create(creator_id=creator_id, **validated_data)
         group.members.set([creator_id])
-        return group
+        return Group.objects.with_member_summary(creator_id).get(id=group.id)
 
 
 class AddMembersSerializer(serializers.Serializer):
@@ -323,6 +433,78 @@ class AddMembersSerializer(serializers.Serializer):
         return value
 
 
+class BulkMembersSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.GROUP_BULK_MEMBERS_MAX,
+    )
+
+    def validate_user_ids(self, value):
+        # One query both checks that every id is a user and tells which of
+        # them already belong to the group.
+        user_ids = set(value)
+        through = Group.members.through
+        rows = (
+            UserProfile.objects.filter(user_id__in=user_ids)
+            .annotate(
+                is_member=Exists(
+                    through.objects.filter(
+                        group_id=self.context["group_id"],
+                        userprofile_id=OuterRef("pk"),
+                    )
+                )
+            )
+            .values_list("user_id", "is_member")
+        )
+        self.membership = dict(rows)
+        missing = user_ids - self.membership.keys()
+        if missing:
+            raise serializers.ValidationError(
+                f"Unknown user ids: {', '.join(map(str, sorted(missing)))}."
+            )
+        return sorted(user_ids)
+
+    def _send(self, action, pk_set):
+        group = Group(id=self.context["group_id"])
+        m2m_changed.send(
+            sender=Group.members.through,
+            instance=group,
+            action=action,
+            reverse=False,
+            model=UserProfile,
+            pk_set=pk_set,
+            using=router.db_for_write(Group.members.through, instance=group),
+        )
+
+    def add(self):
+        # bulk_create bypasses the m2m_changed signal that members.add()
+        # sends, so it is sent here for the cache and change feed receivers.
+        added = {id for id, is_member in self.membership.items() if not is_member}
+        if added:
+            through = Group.members.through
+            self._send("pre_add", added)
+            through.objects.bulk_create(
+                [
+                    through(group_id=self.context["group_id"], userprofile_id=id)
+                    for id in sorted(added)
+                ],
+                ignore_conflicts=True,
+            )
+            self._send("post_add", added)
+        return sorted(added)
+
+    def remove(self):
+        removed = {id for id, is_member in self.membership.items() if is_member}
+        if removed:
+            self._send("pre_remove", removed)
+            Group.members.through.objects.filter(
+                group_id=self.context["group_id"], userprofile_id__in=removed
+            ).delete()
+            self._send("post_remove", removed)
+        return sorted(removed)
+
+
 class GroupMessagesSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source="sender.user", read_only=True)
     profile_image = serializers.SerializerMethodField()
@@ -330,11 +512,7 @@ class GroupMessagesSerializer(serializers.ModelSerializer):
     file_size = serializers.SerializerMethodField()
 
     def get_profile_image(self, obj):
-        if obj.sender.profile_image:
-            request = self.context.get("request")
-            if request is not None:
-                return request.build_absolute_uri(obj.sender.profile_image.url)
-        return None
+        return media_url(obj.sender.profile_image, self.context.get("request"))
 
     def get_file_name(self, obj):
         if obj.file:
@@ -370,3 +548,47 @@ class GroupMessagesSerializer(serializers.ModelSerializer):
         return GroupMessages.objects.create(
             room_id=room_id, sender_id=user_id, **validated_data
         )
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    MESSAGES = {
+        Notification.LIKE: "liked your post",
+        Notification.COMMENT: "commented on your post",
+        Notification.FRIEND_REQUEST: "sent you a friend request",
+    }
+
+    actor = UserSerializer(read_only=True)
+    message = serializers.SerializerMethodField()
+
+    def get_message(self, obj):
+        others = obj.actor_count - 1
+        name = obj.actor.user.username
+        if others == 1:
+            name = f"{name} and 1 other"
+        elif others > 1:
+            name = f"{name} and {others} others"
+        return f"{name} {self.MESSAGES[obj.verb]}"
+
+    class Meta:
+        model = Notification
+        fields = [
+            "id",
+            "verb",
+            "actor",
+            "actor_count",
+            "post_id",
+            "message",
+            "is_read",
+            "created_at",
+            "updated_at",
+        ]
+
+
+class MarkReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+
+class TrendingQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.TRENDING_SIZE, default=settings.TRENDING_SIZE
+    )
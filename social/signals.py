@@ -1,10 +1,420 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
-from .models import UserProfile, Friend
+from . import caching, changes, deletion, engagement, notifications, trending
+from .models import (
+    ChangeLog,
+    ChatMessage,
+    ChatMessageArchive,
+    ChatRoom,
+    Comment,
+    Friend,
+    FriendRequest,
+    Group,
+    GroupMessages,
+    GroupMessagesArchive,
+    Like,
+    Notification,
+    Post,
+    Save,
+    UserProfile,
+)
+from .typeahead import publish_username, username_index
+from .utils import NotificationUtility
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_profile_for_new_user(sender, **kwargs):
     if kwargs['created']:
         user = UserProfile.objects.create(user=kwargs['instance'])
         Friend.objects.create(user=user)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_username(sender, instance, update_fields=None, **kwargs):
+    if update_fields and "username" not in update_fields:
+        return
+    user_id, username = instance.id, instance.username
+    username_index.add(user_id, username)
+    transaction.on_commit(lambda: publish_username(user_id, username))
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def unindex_username(sender, instance, **kwargs):
+    username_index.remove(instance.id)
+    user_id = instance.id
+    transaction.on_commit(lambda: publish_username(user_id, None))
+
+
+def invalidate_profile(user_id):
+    # Usernames and avatars are embedded in the posts the user wrote or
+    # engaged with and in the groups they created or joined.
+    friend_of = Friend.objects.filter(friends=user_id).values_list("user_id", flat=True)
+    post_ids = (
+        Post.objects.filter(user_id=user_id)
+        .values_list("id", flat=True)
+        .order_by()
+        .union(
+            *[
+                model.objects.filter(user_id=user_id)
+                .values_list("post_id", flat=True)
+                .order_by()
+                for model in (Comment, Like, Save)
+            ]
+        )
+    )
+    group_ids = (
+        Group.objects.filter(creator_id=user_id)
+        .values_list("id", flat=True)
+        .order_by()
+        .union(
+            Group.members.through.objects.filter(userprofile_id=user_id)
+            .values_list("group_id", flat=True)
+            .order_by()
+        )
+    )
+    caching.bump_versions(
+        caching.profile_scope(user_id),
+        *[caching.friends_scope(friend_id) for friend_id in friend_of],
+        *[caching.post_scope(post_id) for post_id in post_ids],
+        *[caching.group_scope(group_id) for group_id in group_ids],
+    )
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_cache(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only update last_login. Deleting a user deletes the profile.
+    if created or update_fields and "username" not in update_fields:
+        return
+    invalidate_profile(instance.id)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(pre_delete, sender=UserProfile)
+def invalidate_profile_cache(sender, instance, created=False, **kwargs):
+    # Before a delete, while the posts and memberships can still be found.
+    if not created:
+        invalidate_profile(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Friend.friends.through)
+def invalidate_friends_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        user_ids = Friend.objects.filter(pk__in=pk_set or []).values_list(
+            "user_id", flat=True
+        )
+        caching.bump_versions(*[caching.friends_scope(id) for id in user_ids])
+    else:
+        caching.bump_versions(caching.friends_scope(instance.user_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_cache(sender, **kwargs):
+    caching.bump_versions(caching.GROUPS)
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def invalidate_group_members_cache(sender, action, **kwargs):
+    if action.startswith("post_"):
+        caching.bump_versions(caching.GROUPS)
+
+
+@receiver(post_save, sender=Group)
+def rank_new_group(sender, instance, created, **kwargs):
+    if created:
+        Group.objects.filter(id=instance.id).update_discovery_rank()
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def rank_group_members_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            Group.objects.filter(id=instance.id).update_discovery_rank()
+    elif action == "pre_clear":
+        instance._cleared_group_ids = list(
+            Group.objects.filter(members=instance).values_list("id", flat=True)
+        )
+    elif action in ("post_add", "post_remove", "post_clear"):
+        group_ids = pk_set if action != "post_clear" else instance._cleared_group_ids
+        Group.objects.filter(id__in=group_ids).update_discovery_rank()
+
+
+def invalidate_memberships(scope, instance, action, reverse, pk_set):
+    # Forward changes pass the members' ids in pk_set; clear() passes none, so
+    # the members are read before the rows go away.
+    if reverse:
+        if action.startswith("post_"):
+            caching.bump_versions(scope(instance.user_id))
+    elif action == "pre_clear":
+        member_ids = instance.members.values_list("user_id", flat=True)
+        caching.bump_versions(*[scope(user_id) for user_id in member_ids])
+    elif action in ("post_add", "post_remove"):
+        caching.bump_versions(*[scope(user_id) for user_id in pk_set or []])
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def invalidate_room_membership_cache(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    invalidate_memberships(caching.rooms_scope, instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def invalidate_group_membership_cache(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    invalidate_memberships(caching.groups_scope, instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=ChatRoom)
+@receiver(pre_delete, sender=Group)
+def invalidate_deleted_room_memberships(sender, instance, **kwargs):
+    scope = caching.rooms_scope if sender is ChatRoom else caching.groups_scope
+    member_ids = instance.members.values_list("user_id", flat=True)
+    caching.bump_versions(*[scope(user_id) for user_id in member_ids])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_cache(sender, instance, **kwargs):
+    caching.bump_versions(caching.post_scope(instance.id))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Save)
+def engagement_saved(sender, instance, created, **kwargs):
+    engagement.saved(sender, [instance], created)
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Save)
+def engagement_deleted(sender, instance, **kwargs):
+    engagement.deleted(sender, [instance])
+
+
+@receiver(post_save, sender=FriendRequest)
+def notify_friend_request(sender, instance, created, **kwargs):
+    if created:
+        notifications.notify(
+            instance.receiver_id, instance.sender_id, Notification.FRIEND_REQUEST
+        )
+
+
+@receiver(pre_save, sender=Post)
+def score_new_post(sender, instance, **kwargs):
+    if instance._state.adding and instance.hot_score is None:
+        instance.hot_score = trending.initial_score(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def rank_post(sender, instance, signal, **kwargs):
+    if signal is post_delete or instance.deleted_at:
+        trending.discard_later(instance.id)
+    elif kwargs.get("created"):
+        trending.offer_later(instance.id, instance.hot_score)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def record_post_change(sender, instance, signal, **kwargs):
+    # Soft-deleted posts disappear for clients straight away.
+    deleted = signal is post_delete or instance.deleted_at
+    changes.record(
+        ChangeLog.POST,
+        ChangeLog.DELETE if deleted else ChangeLog.UPSERT,
+        [instance.id],
+        changes.audience(instance.user_id),
+    )
+
+
+@receiver(post_save, sender=Group)
+def record_group_change(sender, instance, **kwargs):
+    # The creator and the members, read after commit.
+    user_ids = (
+        UserProfile.objects.filter(
+            Q(user_id=instance.creator_id) | Q(group=instance.id)
+        )
+        .distinct()
+        .values_list("user_id", flat=True)
+    )
+    changes.record(ChangeLog.GROUP, ChangeLog.UPSERT, [instance.id], user_ids)
+
+
+@receiver(post_save, sender=FriendRequest)
+@receiver(post_delete, sender=FriendRequest)
+def record_friend_request_change(sender, instance, signal, **kwargs):
+    changes.record(
+        ChangeLog.FRIEND_REQUEST,
+        ChangeLog.DELETE if signal is post_delete else ChangeLog.UPSERT,
+        [instance.id],
+        user_ids=[instance.sender_id, instance.receiver_id],
+    )
+
+
+@receiver(m2m_changed, sender=Friend.friends.through)
+def record_friends_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # Entries are "friend <user_id>" in the feed of the user whose list changed.
+    if action == "pre_clear":
+        if reverse:
+            owner_ids = list(
+                Friend.objects.filter(friends=instance).values_list(
+                    "user_id", flat=True
+                )
+            )
+            changes.record(
+                ChangeLog.FRIEND, ChangeLog.DELETE, [instance.user_id], owner_ids
+            )
+        else:
+            friend_ids = list(instance.friends.values_list("user_id", flat=True))
+            changes.record(
+                ChangeLog.FRIEND, ChangeLog.DELETE, friend_ids, [instance.user_id]
+            )
+    elif action in ("post_add", "post_remove"):
+        change = ChangeLog.UPSERT if action == "post_add" else ChangeLog.DELETE
+        if reverse:
+            owner_ids = Friend.objects.filter(pk__in=pk_set).values_list(
+                "user_id", flat=True
+            )
+            changes.record(ChangeLog.FRIEND, change, [instance.user_id], owner_ids)
+        else:
+            changes.record(ChangeLog.FRIEND, change, pk_set, [instance.user_id])
+
+
+def record_membership_change(kind, removed, instance, action, reverse, pk_set):
+    # Members get an entry for the room or group they joined or left.
+    # ``removed`` is the action recorded for those who left. Rows about to be
+    # cleared are read now; the entries are written after commit.
+    if action == "pre_clear":
+        if reverse:
+            model = ChatRoom if kind == ChangeLog.ROOM else Group
+            room_ids = model.objects.filter(members=instance).values_list(
+                "id", flat=True
+            )
+            changes.record(kind, removed, room_ids, [instance.user_id])
+        else:
+            member_ids = list(instance.members.values_list("user_id", flat=True))
+            changes.record(kind, removed, [instance.id], member_ids)
+    elif action in ("post_add", "post_remove"):
+        change = ChangeLog.UPSERT if action == "post_add" else removed
+        if reverse:
+            changes.record(kind, change, pk_set, [instance.user_id])
+        else:
+            changes.record(kind, change, [instance.id], pk_set)
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def record_room_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    record_membership_change(
+        ChangeLog.ROOM, ChangeLog.DELETE, instance, action, reverse, pk_set
+    )
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def record_group_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # Groups stay listed for former members, so leaving is an update.
+    record_membership_change(
+        ChangeLog.GROUP, ChangeLog.UPSERT, instance, action, reverse, pk_set
+    )
+
+
+def notify_membership_change(room_type, instance, action, reverse, pk_set):
+    # Tells open sockets to join or leave the room's channel group. clear()
+    # passes no ids, so they are read before the rows go away.
+    if action == "pre_clear":
+        model = ChatRoom if room_type == "chat" else Group
+        if reverse:
+            rows = model.objects.filter(members=instance).values_list("id", flat=True)
+        else:
+            rows = instance.members.values_list("user_id", flat=True)
+        action, pk_set = "post_remove", set(rows)
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+    key = "added" if action == "post_add" else "removed"
+    if reverse:
+        changed = [(room_id, {key: [instance.user_id]}) for room_id in sorted(pk_set)]
+    else:
+        changed = [(instance.id, {key: sorted(pk_set)})]
+
+    def send():
+        for room_id, members in changed:
+            NotificationUtility.members_changed(room_type, room_id, **members)
+
+    transaction.on_commit(send)
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def notify_room_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    notify_membership_change("chat", instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def notify_group_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    notify_membership_change("group", instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=ChatRoom)
+def record_deleted_room(sender, instance, **kwargs):
+    member_ids = list(instance.members.values_list("user_id", flat=True))
+    changes.record(ChangeLog.ROOM, ChangeLog.DELETE, [instance.id], member_ids)
+
+
+@receiver(pre_delete, sender=Group)
+def record_deleted_group(sender, instance, **kwargs):
+    member_ids = list(instance.members.values_list("user_id", flat=True))
+    changes.record(
+        ChangeLog.GROUP,
+        ChangeLog.DELETE,
+        [instance.id],
+        {instance.creator_id, *member_ids},
+    )
+
+
+FILE_FIELDS = {
+    ChatMessage: "file",
+    ChatMessageArchive: "file",
+    GroupMessages: "file",
+    GroupMessagesArchive: "file",
+    Group: "image",
+    Post: "media_file",
+    UserProfile: "profile_image",
+}
+
+
+@receiver(post_delete, sender=ChatMessage)
+@receiver(post_delete, sender=ChatMessageArchive)
+@receiver(post_delete, sender=GroupMessages)
+@receiver(post_delete, sender=GroupMessagesArchive)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=UserProfile)
+def delete_orphaned_file(sender, instance, **kwargs):
+    # Purged posts have already had their media deleted with retries.
+    if getattr(instance, "deleted_at", None) is None:
+        file = getattr(instance, FILE_FIELDS[sender])
+        deletion.delete_file_later(file.storage, file.name)
+
+
+@receiver(pre_save, sender=Group)
+@receiver(pre_save, sender=UserProfile)
+def delete_replaced_file(sender, instance, update_fields=None, **kwargs):
+    field = FILE_FIELDS[sender]
+    if instance._state.adding or (update_fields and field not in update_fields):
+        return
+    old_name = (
+        sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+    )
+    if old_name and old_name != getattr(instance, field).name:
+        deletion.delete_file_later(getattr(instance, field).storage, old_name)
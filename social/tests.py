@@ -1,3 +1,1477 @@
-from django.test import TestCase
+import gzip
+import io
+import math
+import queue
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from core.models import User
+from FriendNet_Backend.db_router import ReplicaRouter
+from FriendNet_Backend.middleware import CompressionMiddleware, ReplicaRoutingMiddleware
+from FriendNet_Backend.renderers import FastJSONParser, FastJSONRenderer
+from . import (
+    archive,
+    caching,
+    changes,
+    deletion,
+    media,
+    notifications,
+    throttling,
+    trending,
+)
+from .consumers import (
+    ChatConsumer,
+    GroupChatConsumer,
+    NotificationConsumer,
+    payload_size,
+)
+from .models import (
+    ChangeLog,
+    ChatMessage,
+    ChatMessageArchive,
+    ChatRoom,
+    Comment,
+    Friend,
+    Group,
+    GroupMessages,
+    GroupMessagesArchive,
+    Like,
+    Notification,
+    Post,
+    Save,
+)
+from .serializers import NotificationSerializer
+from .typeahead import UsernameIndex, username_index
 
-# Create your tests here.
+
+class FastPathParityTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(
+            MEDIA_ROOT=cls.media_root, MEDIA_PUBLIC_BASE_URL=None
+        )
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        username_index.rebuild()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.alice.profile.profile_image = "image/user_profile/alice face.png"
+        self.alice.profile.save()
+
+        for index in range(3):
+            post = Post.objects.create(
+                user=self.alice.profile,
+                text=f"post {index} ünïcode",
+                media_file="file/post_files/clip.mp4" if index % 2 else None,
+            )
+            Like.objects.create(user=self.bob.profile, post=post)
+            Comment.objects.create(user=self.bob.profile, post=post, text="hey @alice")
+            Comment.objects.create(user=self.alice.profile, post=post, text="thanks")
+            if index:
+                Save.objects.create(user=self.bob.profile, post=post)
+
+        self.room = ChatRoom.objects.create()
+        self.room.members.set([self.alice.profile, self.bob.profile])
+        ChatMessage.objects.create(room=self.room, sender=self.bob.profile, text="hi")
+        attachment = ChatMessage(room=self.room, sender=self.alice.profile)
+        attachment.file.save("notes.txt", ContentFile(b"hello"), save=True)
+
+        self.group = Group.objects.create(name="g", creator=self.alice.profile)
+        self.group.members.set([self.alice.profile, self.bob.profile])
+        GroupMessages.objects.create(room=self.group, sender=self.bob.profile, text="yo")
+        upload = GroupMessages(room=self.group, sender=self.alice.profile)
+        upload.file.save("report.txt", ContentFile(b"12345678"), save=True)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def assertSameResponse(self, url):
+        with override_settings(FAST_READ_SERIALIZERS=False):
+            cache.clear()
+            slow = self.client.get(url)
+        with override_settings(FAST_READ_SERIALIZERS=True):
+            cache.clear()
+            fast = self.client.get(url)
+        self.assertEqual(slow.status_code, 200)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(slow.content, fast.content)
+
+    def test_post_list(self):
+        self.assertSameResponse("/api/posts/")
+
+    def test_filtered_post_list(self):
+        self.assertSameResponse(f"/api/posts/?save_post={self.bob.id}")
+
+    def test_chat_messages(self):
+        self.assertSameResponse(f"/api/chat/{self.room.id}/messages/")
+
+    def test_group_messages(self):
+        self.assertSameResponse(f"/api/group/{self.group.id}/messages/")
+
+
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        username_index.rebuild()
+        trending.get_backend().reset()
+        users = [
+            User.objects.create_user(f"user{index}", f"user{index}@example.com", "pw")
+            for index in range(5)
+        ]
+        self.user = users[0]
+        profiles = [user.profile for user in users]
+        self.user.profile.friend.friends.set(profiles[1:])
+        for profile in profiles:
+            post = Post.objects.create(user=profile, text="hello")
+            for other in profiles:
+                Like.objects.create(user=other, post=post)
+                Save.objects.create(user=other, post=post)
+                Comment.objects.create(user=other, post=post, text="@user0 hi")
+            room = ChatRoom.objects.create()
+            room.members.set([profiles[0], profile])
+            ChatMessage.objects.create(room=room, sender=profile, text="hi")
+            group = Group.objects.create(name="group", creator=profile)
+            group.members.set(profiles)
+            GroupMessages.objects.create(room=group, sender=profile, text="hi")
+        self.room = room
+        self.group = group
+        self.post = post
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_read_endpoints_stay_within_budget(self):
+        urls = [
+            "/api/posts/",
+            "/api/posts/trending/",
+            f"/api/posts/{self.post.id}/",
+            f"/api/posts/{self.post.id}/comments/",
+            "/api/people/",
+            "/api/people/me/",
+            "/api/people/typeahead/?q=user",
+            "/api/friends/",
+            "/api/chat/",
+            f"/api/chat/{self.room.id}/messages/",
+            "/api/group/",
+            f"/api/group/{self.group.id}/",
+            f"/api/group/{self.group.id}/members/",
+            f"/api/group/{self.group.id}/messages/",
+            "/api/sync/",
+            f"/api/sync/?since={changes.current_token()}",
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_metrics_endpoint(self):
+        self.client.get("/api/posts/")
+        response = self.client.get("/metrics", REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'http_requests_total{view="ListPostViewSet.list",status="200"}',
+            response.content.decode(),
+        )
+        self.assertEqual(
+            self.client.get("/metrics", REMOTE_ADDR="10.0.0.1").status_code, 404
+        )
+
+
+def _viewset_view(request):
+    return HttpResponse()
+
+
+_viewset_view.actions = {"get": "list", "post": "create"}
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+        self.alice = User(id=1)
+        self.bob = User(id=2)
+
+    def route(self, request, user=None, write=False):
+        # Where a read made inside the view is sent.
+        request.user = user or AnonymousUser()
+        reads = []
+
+        def view(request):
+            middleware.process_view(request, _viewset_view, (), {})
+            if write:
+                self.router.db_for_write(Post)
+            reads.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        middleware(request)
+        return reads[0]
+
+    def test_list_reads_use_replica(self):
+        self.assertEqual(self.route(self.factory.get("/")), "replica")
+        self.assertEqual(self.route(self.factory.post("/")), "default")
+        self.assertEqual(self.router.db_for_read(Post), "default")
+
+    def test_writes_pin_user_to_primary(self):
+        self.assertEqual(self.route(self.factory.get("/"), self.alice), "replica")
+        self.assertEqual(
+            self.route(self.factory.post("/"), self.alice, write=True), "default"
+        )
+        self.assertEqual(self.route(self.factory.get("/"), self.alice), "default")
+        self.assertEqual(self.route(self.factory.get("/"), self.bob), "replica")
+
+        # JWT users are recognised before DRF authenticates them.
+        token = AccessToken.for_user(self.alice)
+        request = self.factory.get("/", HTTP_AUTHORIZATION=f"JWT {token}")
+        self.assertEqual(self.route(request), "default")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.route(self.factory.get("/")), "default")
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        username_index.rebuild()
+        self.users = {
+            name: User.objects.create_user(name, f"{name}@example.com", "pw")
+            for name in ["me", "sam_a", "sam_b", "sam_c", "sam_y", "sam_z", "pal"]
+        }
+        profiles = {name: user.profile for name, user in self.users.items()}
+        profiles["me"].friend.friends.add(profiles["sam_z"], profiles["pal"])
+        profiles["pal"].friend.friends.add(profiles["sam_y"])
+        self.client = APIClient()
+        self.client.force_authenticate(self.users["me"])
+
+    def typeahead(self, query):
+        response = self.client.get("/api/people/typeahead/", {"q": query})
+        return [user["username"] for user in response.json()]
+
+    @override_settings(TYPEAHEAD_MAX_CANDIDATES=2)
+    def test_close_users_rank_first_beyond_the_candidate_window(self):
+        self.assertEqual(self.typeahead("sam"), ["sam_z", "sam_y", "sam_a", "sam_b"])
+
+    def test_friends_of_friends_are_cached_until_a_friendship_changes(self):
+        self.typeahead("sam")
+        # Pending requests and the matching profiles.
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                self.typeahead("sam_"), ["sam_z", "sam_y", "sam_a", "sam_b", "sam_c"]
+            )
+        self.users["pal"].profile.friend.friends.add(self.users["sam_c"].profile)
+        self.assertEqual(self.typeahead("sam")[:3], ["sam_z", "sam_c", "sam_y"])
+
+    def test_index_follows_changes_made_by_other_processes(self):
+        other = UsernameIndex()
+        other.rebuild()
+        user = self.users["sam_a"]
+        with self.captureOnCommitCallbacks(execute=True):
+            user.username = "renamed"
+            user.save()
+        self.assertEqual(other.prefix("renamed", 5), [(user.id, "renamed")])
+        self.assertEqual(other.prefix("sam_a", 5), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users["sam_b"].delete()
+        self.assertEqual(other.prefix("sam_b", 5), [])
+
+        # A lost journal means a full rebuild.
+        cache.clear()
+        User.objects.filter(id=user.id).update(username="quietly")
+        self.assertEqual(other.resolve("quietly"), user.id)
+
+
+class PostCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.first = Post.objects.create(user=self.alice.profile, text="first")
+        self.second = Post.objects.create(user=self.alice.profile, text="second")
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def posts(self):
+        return {post["id"]: post for post in self.client.get("/api/posts/").json()}
+
+    def test_unchanged_posts_are_served_from_cache(self):
+        self.posts()
+        # Only the list of ids is read.
+        with self.assertNumQueries(1):
+            self.posts()
+
+    def test_engagement_rebuilds_only_the_post_it_touched(self):
+        self.posts()
+        Like.objects.create(user=self.bob.profile, post=self.first)
+        with self.assertNumQueries(5):
+            posts = self.posts()
+        self.assertEqual(posts[self.first.id]["like_count"], 1)
+        self.assertEqual(posts[self.second.id]["like_count"], 0)
+
+    def test_new_and_deleted_posts_change_the_list(self):
+        self.posts()
+        third = Post.objects.create(user=self.alice.profile, text="third")
+        self.second.delete()
+        self.assertEqual(sorted(self.posts()), [self.first.id, third.id])
+
+    def test_profile_changes_rebuild_embedded_usernames(self):
+        self.posts()
+        self.alice.username = "alicia"
+        self.alice.save()
+        self.assertEqual(
+            {post["username"] for post in self.posts().values()}, {"alicia"}
+        )
+
+    def test_signups_and_profile_changes_only_touch_what_embeds_them(self):
+        other = Post.objects.create(user=self.bob.profile, text="bob's")
+        group = Group.objects.create(creator=self.bob.profile, name="g")
+        scopes = [
+            caching.GROUPS,
+            caching.post_scope(self.first.id),
+            caching.post_scope(other.id),
+            caching.group_scope(group.id),
+        ]
+        versions = caching.get_versions(scopes)
+        User.objects.create_user("carol", "carol@example.com", "pw")
+        self.assertEqual(caching.get_versions(scopes), versions)
+        self.alice.profile.bio = "hi"
+        self.alice.profile.save()
+        self.assertEqual(
+            [old != new for old, new in zip(versions, caching.get_versions(scopes))],
+            [False, True, False, False],
+        )
+
+    def test_list_is_paged_by_id(self):
+        third = Post.objects.create(user=self.alice.profile, text="third")
+        pages, before = [], ""
+        while True:
+            page = self.client.get("/api/posts/", {"limit": 2, "before": before})
+            if not page.json():
+                break
+            pages.append([post["id"] for post in page.json()])
+            before = pages[-1][-1]
+        self.assertEqual(pages, [[third.id, self.second.id], [self.first.id]])
+
+    def test_etag(self):
+        response = self.client.get("/api/posts/")
+        etag = response["ETag"]
+        again = self.client.get("/api/posts/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.status_code, 304)
+        Comment.objects.create(user=self.bob.profile, post=self.first, text="hi")
+        changed = self.client.get("/api/posts/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+
+class CountingStorage:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.calls = 0
+
+    def url(self, name):
+        self.calls += 1
+        return f"{self.prefix}{name}?signature={self.calls}"
+
+
+@override_settings(MEDIA_PUBLIC_BASE_URL=None)
+class MediaURLTests(SimpleTestCase):
+    def setUp(self):
+        media.clear_cache()
+        self.addCleanup(media.clear_cache)
+
+    def test_urls_are_cached_per_storage_instance(self):
+        first, second = CountingStorage("/a/"), CountingStorage("/b/")
+        self.assertEqual(media.storage_url(first, "x.png"), "/a/x.png?signature=1")
+        self.assertEqual(media.storage_url(first, "x.png"), "/a/x.png?signature=1")
+        self.assertEqual(media.storage_url(second, "x.png"), "/b/x.png?signature=1")
+        self.assertEqual((first.calls, second.calls), (1, 1))
+
+    def test_relative_urls_use_the_request_host(self):
+        request = RequestFactory().get("/")
+        storage = CountingStorage("/media/")
+        self.assertEqual(
+            media.storage_url(storage, "x.png", request),
+            "http://testserver/media/x.png?signature=1",
+        )
+        self.assertEqual(
+            media.storage_url(storage, "x.png"), "/media/x.png?signature=2"
+        )
+
+    @override_settings(MEDIA_URL_CACHE_TTL=60)
+    def test_entries_expire(self):
+        storage = CountingStorage("/")
+        with mock.patch.object(media.time, "monotonic", return_value=1000):
+            media.storage_url(storage, "x.png")
+        with mock.patch.object(media.time, "monotonic", return_value=1059):
+            self.assertEqual(media.storage_url(storage, "x.png"), "/x.png?signature=1")
+        with mock.patch.object(media.time, "monotonic", return_value=1061):
+            self.assertEqual(media.storage_url(storage, "x.png"), "/x.png?signature=2")
+
+    @override_settings(MEDIA_URL_CACHE_SIZE=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        storage = CountingStorage("/")
+        for name in ["a", "b", "a", "c", "a", "b"]:
+            media.storage_url(storage, name)
+        # b was evicted by c, a stayed in use.
+        self.assertEqual(storage.calls, 4)
+
+    @override_settings(MEDIA_URL_CACHE_TTL=0)
+    def test_caching_can_be_disabled(self):
+        storage = CountingStorage("/")
+        media.storage_url(storage, "x.png")
+        media.storage_url(storage, "x.png")
+        self.assertEqual(storage.calls, 2)
+
+
+class JSONParityTests(SimpleTestCase):
+    payloads = [
+        {"id": 1, "text": "caf\u00e9 \U0001f600", "media_file": None, "tags": []},
+        [{"score": 1.5, "liked": True}, {"score": -0.25, "liked": False}],
+        {"detail": ErrorDetail("Not found.", code="not_found")},
+        {"text": "line\u2028separator\u2029paragraph"},
+        {1: "int keys", "nested": {"list": [1, [2, [3]]]}},
+    ]
+
+    def test_renderer_matches_drf(self):
+        for payload in self.payloads:
+            with self.subTest(payload=payload):
+                self.assertEqual(
+                    FastJSONRenderer().render(payload),
+                    JSONRenderer().render(payload),
+                )
+
+    def test_non_finite_floats_raise_like_drf(self):
+        for value in [float("nan"), float("inf")]:
+            payload = {"posts": [{"id": 1, "score": value}]}
+            with self.assertRaises(ValueError):
+                JSONRenderer().render(payload)
+            with self.assertRaises(ValueError):
+                FastJSONRenderer().render(payload)
+
+    def test_parser_matches_drf(self):
+        for payload in self.payloads[:4]:
+            body = JSONRenderer().render(payload)
+            with self.subTest(payload=payload):
+                self.assertEqual(
+                    FastJSONParser().parse(io.BytesIO(body)),
+                    JSONParser().parse(io.BytesIO(body)),
+                )
+
+    def test_parser_rejects_what_drf_rejects(self):
+        for body in [b"", b"{", b'{"a": NaN}', b'{"a": Infinity}', b"[1,]"]:
+            with self.subTest(body=body):
+                with self.assertRaises(ParseError):
+                    JSONParser().parse(io.BytesIO(body))
+                with self.assertRaises(ParseError):
+                    FastJSONParser().parse(io.BytesIO(body))
+
+    def test_parser_honours_the_request_encoding(self):
+        body = '{"text": "caf\u00e9"}'.encode("latin-1")
+        self.assertEqual(
+            FastJSONParser().parse(
+                io.BytesIO(body), parser_context={"encoding": "latin-1"}
+            ),
+            {"text": "caf\u00e9"},
+        )
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_LENGTH=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    def respond(self, response, **headers):
+        request = RequestFactory().get("/", **headers)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_large_responses_are_compressed(self):
+        body = b"x" * 1000
+        response = self.respond(HttpResponse(body), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), body)
+
+    def test_small_responses_are_left_alone(self):
+        response = self.respond(HttpResponse(b"x" * 99), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertFalse(response.has_header("Vary"))
+        self.assertEqual(response.content, b"x" * 99)
+
+    def test_clients_without_gzip_get_plain_responses(self):
+        response = self.respond(HttpResponse(b"x" * 1000))
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, b"x" * 1000)
+
+    def test_streaming_responses_are_compressed(self):
+        response = self.respond(
+            StreamingHttpResponse(iter([b"x" * 10] * 5)), HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response)), b"x" * 50)
+
+
+class PayloadSizeTests(SimpleTestCase):
+    def test_counts_encoded_bytes(self):
+        self.assertEqual(payload_size("hello"), 5)
+        self.assertEqual(payload_size("caf\u00e9 \U0001f600"), 10)
+
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class GroupMembersTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.carol = User.objects.create_user("carol", "carol@example.com", "pw")
+        self.group = Group.objects.create(name="g", creator=self.alice.profile)
+        self.group.members.set([self.alice.profile])
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.url = f"/api/group/{self.group.id}/members/"
+
+    def connect(self, user):
+        communicator = WebsocketCommunicator(GroupChatConsumer.as_asgi(), "/ws/group/")
+        communicator.scope["user"] = user
+        return communicator
+
+    def post(self, action, user_ids):
+        return self.client.post(
+            f"{self.url}{action}/", {"user_ids": user_ids}, format="json"
+        )
+
+    def members(self):
+        return set(self.group.members.values_list("user_id", flat=True))
+
+    def test_bulk_add_and_remove(self):
+        response = self.post("bulk-add", [self.bob.id, self.carol.id, self.alice.id])
+        self.assertEqual(response.json(), {"added": [self.bob.id, self.carol.id]})
+        self.assertEqual(self.members(), {self.alice.id, self.bob.id, self.carol.id})
+
+        response = self.post("bulk-remove", [self.bob.id, self.carol.id])
+        self.assertEqual(response.json(), {"removed": [self.bob.id, self.carol.id]})
+        self.assertEqual(self.members(), {self.alice.id})
+
+    def test_bulk_add_rejects_unknown_users(self):
+        response = self.post("bulk-add", [self.bob.id, 9999])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.members(), {self.alice.id})
+
+    def test_only_the_creator_removes_others(self):
+        self.group.members.add(self.bob.profile, self.carol.profile)
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.post("bulk-remove", [self.carol.id]).status_code, 403)
+        self.assertEqual(self.post("bulk-remove", [self.bob.id]).status_code, 200)
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.post("bulk-remove", [self.alice.id]).status_code, 400)
+        self.assertEqual(self.members(), {self.alice.id, self.carol.id})
+
+    def test_only_the_creator_adds_others(self):
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.post("bulk-add", [self.carol.id]).status_code, 403)
+        self.assertEqual(
+            self.post("bulk-add", [self.bob.id, self.carol.id]).status_code, 403
+        )
+        self.assertEqual(self.members(), {self.alice.id})
+        self.assertEqual(self.post("bulk-add", [self.bob.id]).status_code, 200)
+        self.assertEqual(self.members(), {self.alice.id, self.bob.id})
+
+    def test_membership_changes_survive_a_failing_channel_layer(self):
+        failing = mock.patch("social.utils.get_channel_layer", side_effect=OSError)
+        with failing, self.assertLogs("social.utils", "WARNING"):
+            response = self.post("bulk-add", [self.bob.id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.members(), {self.alice.id, self.bob.id})
+
+    def test_sockets_follow_bulk_membership_changes(self):
+        async def run():
+            alice, bob = self.connect(self.alice), self.connect(self.bob)
+            self.assertTrue((await alice.connect())[0])
+            self.assertTrue((await bob.connect())[0])
+
+            await sync_to_async(self.post)("bulk-add", [self.bob.id])
+            for communicator in (alice, bob):
+                event = await communicator.receive_json_from()
+                self.assertEqual(event["added"], [self.bob.id])
+
+            await alice.send_json_to({"room_id": self.group.id, "text": "hi bob"})
+            self.assertEqual((await alice.receive_json_from())["text"], "hi bob")
+            self.assertEqual((await bob.receive_json_from())["text"], "hi bob")
+
+            await sync_to_async(self.post)("bulk-remove", [self.bob.id])
+            for communicator in (alice, bob):
+                event = await communicator.receive_json_from()
+                self.assertEqual(event["removed"], [self.bob.id])
+
+            await alice.send_json_to({"room_id": self.group.id, "text": "bye"})
+            self.assertEqual((await alice.receive_json_from())["text"], "bye")
+            self.assertTrue(await bob.receive_nothing())
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+
+class GroupDiscoveryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "pw")
+        self.users = [
+            User.objects.create_user(f"user{index}", f"user{index}@example.com", "pw")
+            for index in range(4)
+        ]
+        Friend.objects.get(user=self.viewer.profile).friends.add(self.users[3].profile)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def group(self, name, members):
+        group = Group.objects.create(name=name, creator=members[0].profile)
+        group.members.set([member.profile for member in members])
+        return group
+
+    def names(self, url):
+        response = self.client.get(url).json()
+        return [group["name"] for group in response["results"]], response["next"]
+
+    def test_ranked_by_member_count_then_newest(self):
+        self.group("two", self.users[:2])
+        self.group("three", self.users[:3])
+        self.group("also two", self.users[2:4])
+        joined = self.group("joined", [self.users[0], self.viewer])
+        self.assertEqual(
+            self.names("/api/group/discover/")[0], ["three", "also two", "two"]
+        )
+
+        joined.members.remove(self.viewer.profile)
+        self.users[3].profile.group_set.add(Group.objects.get(name="two"))
+        self.assertEqual(
+            self.names("/api/group/discover/")[0],
+            ["three", "two", "also two", "joined"],
+        )
+
+    def test_ranked_by_friends(self):
+        self.group("two friends", [self.users[0], self.users[3]])
+        self.group("three", self.users[:3])
+        self.assertEqual(
+            self.names("/api/group/discover/?rank=friends")[0],
+            ["two friends", "three"],
+        )
+
+    def test_rank_follows_reverse_clear(self):
+        self.group("two", self.users[:2])
+        self.group("one", self.users[2:3])
+        self.users[1].profile.group_set.clear()
+        self.assertEqual(self.names("/api/group/discover/")[0], ["one", "two"])
+
+    def test_cursor_pages_are_stable(self):
+        for index in range(5):
+            self.group(f"group{index}", self.users[: 1 + index % 3])
+        seen, next_url = self.names("/api/group/discover/?page_size=2")
+        # A new group ranking after the cursor shows up on a later page and
+        # nothing is repeated or skipped.
+        self.group("late", self.users[:1])
+        while next_url:
+            names, next_url = self.names(next_url)
+            seen += names
+        self.assertEqual(
+            seen, ["group2", "group4", "group1", "late", "group3", "group0"]
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.mallory = User.objects.create_user("mallory", "m@example.com", "pw")
+        self.room = ChatRoom.objects.create()
+        self.room.members.set([self.alice.profile, self.bob.profile])
+        self.group = Group.objects.create(name="g", creator=self.alice.profile)
+        self.group.members.set([self.alice.profile, self.bob.profile])
+
+    def connect(self, consumer_class, user):
+        communicator = WebsocketCommunicator(consumer_class.as_asgi(), "/ws/")
+        communicator.scope["user"] = user
+        return communicator
+
+    def assert_rejected(self, consumer_class, room, model):
+        async def run():
+            mallory = self.connect(consumer_class, self.mallory)
+            alice = self.connect(consumer_class, self.alice)
+            await mallory.connect()
+            await alice.connect()
+            await mallory.send_json_to({"room_id": room.id, "text": "let me in"})
+            response = await mallory.receive_json_from()
+            self.assertEqual(response["type"], "error")
+            self.assertTrue(await alice.receive_nothing())
+            # A bad room id is rejected the same way.
+            await mallory.send_json_to({"room_id": "nope", "text": "hi"})
+            self.assertEqual((await mallory.receive_json_from())["type"], "error")
+            await mallory.disconnect()
+            await alice.disconnect()
+
+        async_to_sync(run)()
+        self.assertFalse(model.objects.filter(sender=self.mallory.profile).exists())
+
+    def test_non_members_are_rejected_from_rooms(self):
+        self.assert_rejected(ChatConsumer, self.room, ChatMessage)
+
+    def test_non_members_are_rejected_from_groups(self):
+        self.assert_rejected(GroupChatConsumer, self.group, GroupMessages)
+
+    def test_membership_changes_take_effect_on_open_sockets(self):
+        async def run():
+            alice = self.connect(ChatConsumer, self.alice)
+            bob = self.connect(ChatConsumer, self.bob)
+            mallory = self.connect(ChatConsumer, self.mallory)
+            for communicator in (alice, bob, mallory):
+                await communicator.connect()
+
+            # Removed after connecting: bob leaves the room's channel group
+            # and can no longer post to it.
+            await sync_to_async(self.room.members.remove)(self.bob.profile)
+            for communicator in (alice, bob):
+                event = await communicator.receive_json_from()
+                self.assertEqual(event["type"], "members_changed")
+                self.assertEqual(event["removed"], [self.bob.id])
+            await bob.send_json_to({"room_id": self.room.id, "text": "still here?"})
+            self.assertEqual((await bob.receive_json_from())["type"], "error")
+
+            # Added after connecting: mallory joins without posting first.
+            await sync_to_async(self.room.members.add)(self.mallory.profile)
+            for communicator in (alice, mallory):
+                event = await communicator.receive_json_from()
+                self.assertEqual(event["added"], [self.mallory.id])
+            await alice.send_json_to({"room_id": self.room.id, "text": "welcome"})
+            self.assertEqual((await alice.receive_json_from())["text"], "welcome")
+            self.assertEqual((await mallory.receive_json_from())["text"], "welcome")
+            self.assertTrue(await bob.receive_nothing())
+            self.assertTrue(await mallory.receive_nothing())
+
+            for communicator in (alice, bob, mallory):
+                await communicator.disconnect()
+
+        async_to_sync(run)()
+
+
+class LocalBucketsTests(SimpleTestCase):
+    def take(self, buckets, key, at, capacity=2, rate=1):
+        with mock.patch.object(throttling.time, "monotonic", return_value=at):
+            return buckets.take(key, capacity, rate)
+
+    def test_refill_and_retry_after(self):
+        buckets = throttling.LocalBuckets()
+        self.assertEqual(self.take(buckets, "a", 100), (True, 0))
+        self.assertEqual(self.take(buckets, "a", 100), (True, 0))
+        self.assertEqual(self.take(buckets, "a", 100), (False, 1))
+        self.assertEqual(self.take(buckets, "a", 100.5), (False, 0.5))
+        self.assertEqual(self.take(buckets, "a", 101), (True, 0))
+
+    def test_refilled_buckets_are_pruned(self):
+        buckets = throttling.LocalBuckets()
+        self.take(buckets, "idle", 100)
+        self.take(buckets, "drained", 100, capacity=1, rate=0.001)
+        self.take(buckets, "other", 100 + buckets.prune_interval)
+        self.assertEqual(set(buckets.buckets), {"drained", "other"})
+
+    @override_settings(RATE_LIMIT_LOCAL_MAX_KEYS=2)
+    def test_least_recently_used_buckets_are_evicted(self):
+        buckets = throttling.LocalBuckets()
+        for key in ["a", "b", "a", "c"]:
+            self.take(buckets, key, 100)
+        self.assertEqual(list(buckets.buckets), ["a", "c"])
+
+
+@override_settings(
+    RATE_LIMITS={
+        "post": {"capacity": 2, "rate": 0.01},
+        "chat_message": {"capacity": 1, "rate": 0.01},
+    },
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+)
+class RateLimitTests(TransactionTestCase):
+    def setUp(self):
+        throttling.get_backend().reset()
+        self.addCleanup(throttling.get_backend().reset)
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_requests_over_the_limit_get_429_with_retry_after(self):
+        for _ in range(2):
+            response = self.client.post("/api/posts/", {"text": "hi"})
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post("/api/posts/", {"text": "hi"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "100")
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_only_creating_posts_is_limited(self):
+        post = Post.objects.create(user=self.alice.profile, text="draft")
+        for index in range(3):
+            response = self.client.put(
+                f"/api/posts/{post.id}/", {"text": f"edit {index}"}
+            )
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post("/api/posts/", {"text": "hi"})
+        self.assertEqual(response.status_code, 201)
+
+    def test_websocket_frames_over_the_limit_are_rejected(self):
+        room = ChatRoom.objects.create()
+        room.members.set([self.alice.profile])
+
+        async def run():
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/")
+            communicator.scope["user"] = self.alice
+            await communicator.connect()
+            await communicator.send_json_to({"room_id": room.id, "text": "one"})
+            self.assertEqual((await communicator.receive_json_from())["text"], "one")
+            await communicator.send_json_to({"room_id": room.id, "text": "two"})
+            error = await communicator.receive_json_from()
+            self.assertEqual(error["type"], "error")
+            self.assertAlmostEqual(error["retry_after"], 100, delta=1)
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(
+            list(ChatMessage.objects.values_list("text", flat=True)), ["one"]
+        )
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(name, f"{name}@example.com", "pw")
+            for name in ("alice", "bob", "carol")
+        ]
+        self.post = Post.objects.create(user=self.alice.profile, text="hi")
+
+    def like(self, user, post=None):
+        return Like.objects.create(user=user.profile, post=post or self.post)
+
+    def notifications(self):
+        return list(
+            Notification.objects.filter(recipient=self.alice.profile).order_by("id")
+        )
+
+    def test_likes_on_a_post_are_coalesced_by_distinct_actor(self):
+        like = self.like(self.bob)
+        self.like(self.carol)
+        like.delete()
+        self.like(self.bob)
+        [notification] = self.notifications()
+        self.assertEqual(notification.actor_id, self.bob.id)
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(
+            set(notification.actors.values_list("user_id", flat=True)),
+            {self.bob.id, self.carol.id},
+        )
+        self.assertEqual(
+            NotificationSerializer(notification).data["message"],
+            "bob and 1 other liked your post",
+        )
+
+    def test_separate_kinds_posts_and_own_actions_are_not_coalesced(self):
+        other = Post.objects.create(user=self.alice.profile, text="other")
+        self.like(self.bob)
+        self.like(self.bob, other)
+        Comment.objects.create(user=self.bob.profile, post=self.post, text="nice")
+        self.like(self.alice)
+        self.assertEqual(
+            [(n.verb, n.post_id) for n in self.notifications()],
+            [("like", self.post.id), ("like", other.id), ("comment", self.post.id)],
+        )
+
+    def test_read_and_old_notifications_are_not_coalesced(self):
+        self.like(self.bob)
+        Notification.objects.update(is_read=True)
+        self.like(self.carol)
+        with override_settings(NOTIFICATION_COALESCE_SECONDS=0):
+            Comment.objects.create(user=self.bob.profile, post=self.post, text="a")
+            Comment.objects.create(user=self.carol.profile, post=self.post, text="b")
+        self.assertEqual([n.actor_count for n in self.notifications()], [1, 1, 1, 1])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, MEDIA_PUBLIC_BASE_URL=None)
+class NotificationPushTests(TransactionTestCase):
+    def setUp(self):
+        media.clear_cache()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.bob.profile.profile_image = "image/bob.png"
+        self.bob.profile.save()
+        self.post = Post.objects.create(user=self.alice.profile, text="hi")
+
+    def test_pushed_notifications_have_absolute_media_urls(self):
+        async def run():
+            communicator = WebsocketCommunicator(
+                NotificationConsumer.as_asgi(),
+                "/ws/notifications/",
+                headers=[(b"host", b"testserver")],
+            )
+            communicator.scope["user"] = self.alice
+            await communicator.connect()
+            await sync_to_async(Like.objects.create)(
+                user=self.bob.profile, post=self.post
+            )
+            notification = await communicator.receive_json_from()
+            self.assertEqual(notification["message"], "bob liked your post")
+            self.assertEqual(
+                notification["actor"]["profile_image"],
+                "http://testserver/media/image/bob.png",
+            )
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_chat_frames_have_absolute_avatar_urls(self):
+        room = ChatRoom.objects.create()
+        room.members.set([self.alice.profile, self.bob.profile])
+
+        async def run():
+            communicator = WebsocketCommunicator(
+                ChatConsumer.as_asgi(), "/ws/", headers=[(b"host", b"testserver")]
+            )
+            communicator.scope["user"] = self.bob
+            await communicator.connect()
+            await communicator.send_json_to({"room_id": room.id, "text": "hi"})
+            message = await communicator.receive_json_from()
+            self.assertEqual(
+                message["profile_image"], "http://testserver/media/image/bob.png"
+            )
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_push_of_a_deleted_notification_is_skipped(self):
+        with self.assertLogs("social.notifications", "WARNING"):
+            notifications.push(12345)
+
+
+@override_settings(DELETION_IN_BACKGROUND=False)
+class PostDeletionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.post = Post.objects.create(
+            user=self.alice.profile, text="bye", media_file="file/post_files/x.mp4"
+        )
+        Like.objects.create(user=self.bob.profile, post=self.post)
+        Save.objects.create(user=self.bob.profile, post=self.post)
+        Comment.objects.create(user=self.bob.profile, post=self.post, text="hi")
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def delete(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.delete(f"/api/posts/{self.post.id}/")
+        self.assertEqual(response.status_code, 204)
+        return callbacks
+
+    def test_deleted_posts_are_hidden_until_purged(self):
+        self.delete()
+        self.assertTrue(Post.all_objects.filter(id=self.post.id).exists())
+        self.assertEqual(self.client.get("/api/posts/").json(), [])
+        response = self.client.get(f"/api/posts/{self.post.id}/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_no_engagement_on_deleted_posts(self):
+        self.delete()
+        self.client.force_authenticate(self.bob)
+        for path, data in [
+            ("likes", {}),
+            ("save", {}),
+            ("comments", {"text": "late"}),
+        ]:
+            with self.subTest(path=path):
+                response = self.client.post(f"/api/posts/{self.post.id}/{path}/", data)
+                self.assertEqual(response.status_code, 404)
+        self.assertEqual(Comment.objects.filter(text="late").count(), 0)
+
+    def test_purge_removes_the_post_and_its_rows(self):
+        self.assertEqual(Notification.objects.filter(post=self.post).count(), 2)
+        for callback in self.delete():
+            callback()
+        self.assertFalse(Post.all_objects.filter(id=self.post.id).exists())
+        for model in (Like, Save, Comment, Notification):
+            self.assertFalse(model.objects.filter(post_id=self.post.id).exists())
+        self.assertFalse(Notification.actors.through.objects.exists())
+
+    def test_posts_whose_media_could_not_be_deleted_are_retried(self):
+        self.delete()
+        with mock.patch.object(deletion, "delete_file", return_value=False):
+            self.assertEqual(deletion.purge_deleted_posts(), 0)
+        self.assertTrue(Post.all_objects.filter(id=self.post.id).exists())
+        self.assertFalse(Like.objects.filter(post_id=self.post.id).exists())
+        self.assertEqual(deletion.purge_deleted_posts(), 1)
+        self.assertFalse(Post.all_objects.filter(id=self.post.id).exists())
+
+    def test_idle_worker_retries_left_over_posts(self):
+        class Stop(BaseException):
+            pass
+
+        with mock.patch.object(
+            deletion._tasks, "get", side_effect=[queue.Empty, Stop]
+        ), mock.patch.object(deletion, "purge_deleted_posts") as purge:
+            with self.assertRaises(Stop):
+                deletion._run()
+        purge.assert_called_once_with()
+
+
+class AsyncFeedTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        post = Post.objects.create(user=self.alice.profile, text="hello")
+        Comment.objects.create(user=self.alice.profile, post=post, text="@bob look")
+        self.token = f"JWT {AccessToken.for_user(self.alice)}"
+
+    def test_feed_with_a_cold_username_index(self):
+        username_index._loaded = False
+        self.addCleanup(username_index.rebuild)
+
+        async def get():
+            return await self.async_client.get(
+                "/api/async/feed/", AUTHORIZATION=self.token
+            )
+
+        response = async_to_sync(get)()
+        self.assertEqual(response.status_code, 200)
+        [post] = response.json()["results"]
+        [comment] = post["post_comments"]
+        self.assertEqual(comment["mentions"], [self.bob.id])
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        profiles = [self.alice.profile, self.bob.profile]
+        self.room = ChatRoom.objects.create()
+        self.room.members.set(profiles)
+        self.group = Group.objects.create(name="g", creator=self.alice.profile)
+        self.group.members.set(profiles)
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def send(self, model, room, text, days_ago):
+        message = model.objects.create(room=room, sender=self.alice.profile, text=text)
+        created_at = timezone.now() - timedelta(days=days_ago)
+        model.objects.filter(id=message.id).update(created_at=created_at)
+        return message
+
+    def test_only_rows_below_the_oldest_kept_message_move(self):
+        self.send(ChatMessage, self.room, "old", 200)
+        self.send(ChatMessage, self.room, "recent", 1)
+        # Older than the cutoff but written after a message that stays hot.
+        self.send(ChatMessage, self.room, "imported", 150)
+        moved = archive.archive_old_messages(days=90)
+        self.assertEqual(moved, {"chatmessage": 1, "groupmessages": 0})
+        self.assertEqual(
+            list(ChatMessageArchive.objects.values_list("text", flat=True)), ["old"]
+        )
+        self.assertEqual(
+            set(ChatMessage.objects.values_list("text", flat=True)),
+            {"recent", "imported"},
+        )
+
+    def test_lists_include_archived_messages(self):
+        for model, room in [
+            (ChatMessage, self.room),
+            (GroupMessages, self.group),
+        ]:
+            self.send(model, room, "oldest", 300)
+            self.send(model, room, "old", 200)
+            self.send(model, room, "recent", 1)
+            self.send(model, room, "imported", 150)
+        archive.archive_old_messages(days=90)
+        self.assertEqual(ChatMessageArchive.objects.count(), 2)
+        self.assertEqual(GroupMessagesArchive.objects.count(), 2)
+
+        # Newest first by id. The archive is only read once a page reaches
+        # the last hot row.
+        for url in [
+            f"/api/chat/{self.room.id}/messages/",
+            f"/api/group/{self.group.id}/messages/",
+        ]:
+            for fast in (False, True):
+                with self.subTest(url=url, fast=fast), override_settings(
+                    FAST_READ_SERIALIZERS=fast
+                ):
+                    texts, archive_reads, before = [], [], ""
+                    while before is not None:
+                        with CaptureQueriesContext(connection) as queries:
+                            page = self.client.get(
+                                url, {"limit": 1, "before": before}
+                            ).json()
+                        [message] = page["results"]
+                        texts.append(message["text"])
+                        archive_reads.append(
+                            any("archive" in query["sql"] for query in queries)
+                        )
+                        before = page["next"]
+                    self.assertEqual(texts, ["imported", "recent", "old", "oldest"])
+                    self.assertEqual(archive_reads, [False, True, True, True])
+
+    def test_chat_list_falls_back_to_the_latest_archived_message(self):
+        self.send(ChatMessage, self.room, "old", 200)
+        self.send(ChatMessage, self.room, "older", 100)
+        quiet = ChatRoom.objects.create()
+        quiet.members.set([self.alice.profile, self.bob.profile])
+        self.send(ChatMessage, quiet, "current", 1)
+        archive.archive_old_messages(days=90)
+
+        response = self.client.get("/api/chat/")
+        self.assertEqual(response.status_code, 200)
+        messages = {room["id"]: room["message"]["text"] for room in response.json()}
+        self.assertEqual(messages, {self.room.id: "older", quiet.id: "current"})
+
+
+class SyncTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.carol = User.objects.create_user("carol", "carol@example.com", "pw")
+        self.alice.profile.friend.friends.add(self.bob.profile)
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+        self.settle()
+        response = self.client.get("/api/sync/")
+        self.assertTrue(response.json()["resync"])
+        self.token = response.json()["token"]
+
+    def sync(self, user=None, token=None):
+        self.client.force_authenticate(user or self.bob)
+        return self.client.get("/api/sync/", {"since": token or self.token})
+
+    def settle(self):
+        ChangeLog.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+
+    def test_entries_go_to_users_who_can_see_the_object(self):
+        post = Post.objects.create(user=self.alice.profile, text="hi")
+        Like.objects.create(user=self.carol.profile, post=post)
+        self.assertEqual(
+            set(ChangeLog.objects.filter(kind="post").values_list("user", flat=True)),
+            {self.alice.id, self.bob.id},
+        )
+        self.assertEqual(
+            set(ChangeLog.objects.filter(kind="like").values_list("user", flat=True)),
+            {self.alice.id, self.bob.id, self.carol.id},
+        )
+        for user, kinds in [(self.bob, {"post", "like"}), (self.carol, {"like"})]:
+            synced = self.sync(user).json()["changes"]
+            self.assertEqual({change["kind"] for change in synced}, kinds)
+
+    def test_entries_are_written_after_commit(self):
+        with transaction.atomic():
+            Group.objects.create(name="g", creator=self.alice.profile)
+            Post.objects.create(user=self.alice.profile, text="hi")
+            self.assertFalse(ChangeLog.objects.exclude(kind="friend").exists())
+        self.assertEqual(
+            sorted(
+                ChangeLog.objects.exclude(kind="friend").values_list("kind", "user")
+            ),
+            [("group", self.alice.id), ("post", self.alice.id), ("post", self.bob.id)],
+        )
+
+    def test_token_waits_for_entries_to_settle(self):
+        Post.objects.create(user=self.alice.profile, text="hi")
+        first = self.sync().json()
+        self.assertEqual(len(first["changes"]), 1)
+        # Unsettled entries are served again until they settle.
+        self.assertEqual(first["token"].split("-")[0], self.token.split("-")[0])
+        again = self.sync(token=first["token"]).json()
+        self.assertEqual(again["changes"], first["changes"])
+        self.settle()
+        second = self.sync(token=first["token"]).json()
+        self.assertEqual(len(second["changes"]), 1)
+        self.assertNotEqual(second["token"].split("-")[0], self.token.split("-")[0])
+        self.assertEqual(self.sync(token=second["token"]).json()["changes"], [])
+
+    def test_latest_change_per_object(self):
+        post = Post.objects.create(user=self.alice.profile, text="hi")
+        post.text = "edited"
+        post.save()
+        post_id = post.id
+        post.delete()
+        self.settle()
+        [change] = self.sync().json()["changes"]
+        self.assertEqual(
+            change,
+            {"kind": "post", "id": post_id, "parent_id": None, "action": "delete"},
+        )
+
+    def test_unusable_tokens_require_a_resync(self):
+        now = int(timezone.now().timestamp())
+        expired = now - 86400 * settings.CHANGELOG_RETENTION_DAYS
+        for token in ["nonsense", f"0-{expired}", f"0-{now + 3600}", "0-2000000000"]:
+            with self.subTest(token=token):
+                response = self.sync(token=token)
+                self.assertEqual(response.status_code, 410)
+                self.assertTrue(response.json()["resync"])
+                self.assertEqual(
+                    self.sync(token=response.json()["token"]).status_code, 200
+                )
+
+    def test_compact_drops_expired_and_superseded_entries(self):
+        post = Post.objects.create(user=self.alice.profile, text="hi")
+        post.text = "edited"
+        post.save()
+        old = Post.objects.create(user=self.alice.profile, text="old")
+        ChangeLog.objects.filter(object_id=old.id, kind="post").update(
+            created_at=timezone.now()
+            - timedelta(days=settings.CHANGELOG_RETENTION_DAYS + 1)
+        )
+        # One expired and one superseded entry in each of alice's and bob's feeds.
+        self.assertEqual(changes.compact(), {"expired": 2, "superseded": 2})
+        self.assertEqual(
+            sorted(
+                ChangeLog.objects.filter(kind="post").values_list("user", "object_id")
+            ),
+            [(self.alice.id, post.id), (self.bob.id, post.id)],
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, TRENDING_FLUSH_SECONDS=0)
+class TrendingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        trending.get_backend().reset()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.users = [
+            User.objects.create_user(f"user{index}", f"user{index}@example.com", "pw")
+            for index in range(3)
+        ]
+        self.posts = [
+            Post.objects.create(user=self.alice.profile, text=str(index))
+            for index in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def score(self, post):
+        return Post.objects.get(id=post.id).hot_score
+
+    def test_engagement_is_applied_in_one_batch_on_commit(self):
+        post = self.posts[0]
+        before = self.score(post)
+        # Queued boosts wait for the worker.
+        with mock.patch.object(trending, "flush"), self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            for user in self.users:
+                Like.objects.create(user=user.profile, post=post)
+            Like.objects.create(user=self.alice.profile, post=self.posts[1])
+        self.assertEqual(self.score(post), before)
+        # One locked read and one update, in a savepoint here.
+        with self.assertNumQueries(4):
+            trending.flush()
+        self.assertAlmostEqual(self.score(post), before + math.log2(4), places=3)
+        self.assertEqual(trending.get_backend().top(1), [post.id])
+
+    def test_toggling_engagement_leaves_the_score_alone(self):
+        post = self.posts[0]
+        before = self.score(post)
+        for _ in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                Like.objects.create(user=self.users[0].profile, post=post)
+            self.assertGreater(self.score(post), before)
+            with self.captureOnCommitCallbacks(execute=True):
+                Like.objects.get(user=self.users[0].profile, post=post).delete()
+            self.assertAlmostEqual(self.score(post), before, places=6)
+        for change in ({"add": [post.id]}, {"remove": [post.id]}):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post("/api/posts/likes/", change, format="json")
+            self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(self.score(post), before, places=6)
+
+    def test_older_engagement_counts_for_less(self):
+        half_life = timedelta(seconds=settings.TRENDING_HALF_LIFE)
+        now = timezone.now()
+        old, recent, quiet = self.posts
+        with self.captureOnCommitCallbacks(execute=True):
+            # Three likes two half-lives ago are worth 0.75 of one like now.
+            for _ in range(3):
+                trending.record(old.id, "like", at=now - 2 * half_life)
+            trending.record(recent.id, "like", at=now)
+        response = self.client.get("/api/posts/trending/")
+        self.assertEqual(
+            [post["id"] for post in response.json()], [recent.id, old.id, quiet.id]
+        )
+
+    def test_limit(self):
+        response = self.client.get("/api/posts/trending/", {"limit": 1})
+        self.assertEqual(len(response.json()), 1)
+        for limit in [0, -1, settings.TRENDING_SIZE + 1, "ten"]:
+            with self.subTest(limit=limit):
+                response = self.client.get("/api/posts/trending/", {"limit": limit})
+                self.assertEqual(response.status_code, 400)
+
+    def test_top_k_keeps_the_best_posts(self):
+        Post.objects.update(hot_score=None)
+        top = trending.LocalTopK(2)
+        top.ensure_loaded()
+        first, second, third = self.posts
+        top.offer(first.id, 3.0)
+        top.offer(second.id, 1.0)
+        top.offer(third.id, 2.0)
+        self.assertEqual(top.top(5), [first.id, third.id])
+        # A new score replaces the old one.
+        top.offer(second.id, 4.0)
+        self.assertEqual(top.top(5), [second.id, first.id])
+        top.discard(second.id)
+        self.assertEqual(top.top(5), [first.id])
+        # A cold store is rebuilt from hot_score.
+        for post, score in zip(self.posts, [1.0, 3.0, 2.0]):
+            Post.objects.filter(id=post.id).update(hot_score=score)
+        top.reset()
+        self.assertEqual(top.top(5), [second.id, third.id])
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    QUERY_BUDGETS_STRICT=True,
+    TRENDING_FLUSH_SECONDS=0,
+)
+class BulkEngagementTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        trending.get_backend().reset()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw")
+        self.carol = User.objects.create_user("carol", "carol@example.com", "pw")
+        self.posts = [
+            Post.objects.create(user=user.profile, text="hi")
+            for user in (self.alice, self.alice, self.carol)
+        ]
+        self.deleted = Post.objects.create(
+            user=self.alice.profile, text="gone", deleted_at=timezone.now()
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def post(self, path, add=(), remove=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/api/posts/{path}/",
+                {"add": list(add), "remove": list(remove)},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def side_effects(self):
+        return (
+            sorted(
+                Notification.objects.values_list("recipient", "post", "actor_count")
+            ),
+            sorted(ChangeLog.objects.filter(kind="like").values_list("user", "action")),
+            sorted(Post.objects.values_list("hot_score", flat=True)),
+        )
+
+    def test_side_effects_apply_once_per_row(self):
+        ids = [post.id for post in self.posts]
+        result = self.post("likes", add=[*ids, self.deleted.id, 9999])
+        self.assertEqual(result["added"], ids)
+        self.assertEqual(result["skipped"], [self.deleted.id, 9999])
+        self.assertEqual(result["counts"], {str(id): 1 for id in ids})
+        notified, _, _ = self.side_effects()
+        self.assertEqual(
+            notified,
+            [
+                (self.alice.id, ids[0], 1),
+                (self.alice.id, ids[1], 1),
+                (self.carol.id, ids[2], 1),
+            ],
+        )
+        # Each like is synced to its post's author and to bob.
+        self.assertEqual(ChangeLog.objects.filter(kind="like").count(), 6)
+
+        effects = self.side_effects()
+        retry = self.post("likes", add=[*ids, self.deleted.id, 9999])
+        self.assertEqual(retry["added"], [])
+        self.assertEqual(retry["counts"], result["counts"])
+        self.assertEqual(self.side_effects(), effects)
+
+    def test_remove_and_single_likes_share_the_state(self):
+        first, second, third = self.posts
+        response = self.client.post(f"/api/posts/{first.id}/likes/")
+        self.assertEqual(response.status_code, 201, response.content)
+        result = self.post("likes", add=[first.id, second.id], remove=[third.id])
+        self.assertEqual(result["added"], [second.id])
+        self.assertEqual(result["removed"], [])
+        self.assertEqual(Notification.objects.filter(post=first).count(), 1)
+
+        result = self.post("likes", remove=[first.id, second.id])
+        self.assertEqual(result["removed"], [first.id, second.id])
+        self.assertEqual(result["counts"], {str(first.id): 0, str(second.id): 0})
+        self.assertEqual(
+            ChangeLog.objects.filter(kind="like", action="delete").count(), 4
+        )
+        response = self.client.delete(f"/api/posts/{first.id}/likes/{self.bob.id}/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_saves(self):
+        ids = [post.id for post in self.posts]
+        self.assertEqual(self.post("saves", add=ids)["added"], ids)
+        self.assertEqual(self.post("saves", remove=ids[:1])["counts"][str(ids[0])], 0)
+        self.assertEqual(Save.objects.filter(user=self.bob.profile).count(), 2)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        more = [
+            Post.objects.create(user=self.alice.profile, text="more").id
+            for _ in range(10)
+        ]
+        ids = [post.id for post in self.posts]
+        for path in ["likes", "saves"]:
+            with self.subTest(path=path):
+                with self.captureOnCommitCallbacks(execute=True):
+                    with CaptureQueriesContext(connection) as few:
+                        self.post(path, add=ids[:1])
+                with CaptureQueriesContext(connection) as many:
+                    self.post(path, add=[*ids[1:], *more])
+                self.assertEqual(len(many), len(few))
+                # Within the action's query budget either way.
+                self.post(path, add=ids[:1], remove=ids[1:])
+                self.post(path, add=ids[1:], remove=ids[:1])
@@ -0,0 +1,139 @@
+import math
+import threading
+import time
+from functools import lru_cache
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+# Token buckets: every scope in settings.RATE_LIMITS has a ``capacity`` (the
+# burst a client may send at once) and a ``rate`` (tokens refilled per
+# second). Each request or websocket frame takes one token.
+
+
+class LocalBuckets:
+    # Per-process buckets for tests and single-node deployments. A bucket
+    # that has refilled is the same as a missing one, so full buckets are
+    # pruned every ``prune_interval`` seconds. Past RATE_LIMIT_LOCAL_MAX_KEYS
+    # the least recently used buckets are dropped as well.
+    blocking = False
+    prune_interval = 60
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.next_prune = 0
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated, _ = self.buckets.pop(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Kept in least recently used order for eviction.
+            self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if now >= self.next_prune:
+                self.prune(now)
+            if len(self.buckets) > settings.RATE_LIMIT_LOCAL_MAX_KEYS:
+                del self.buckets[next(iter(self.buckets))]
+        if allowed:
+            return True, 0
+        return False, (1 - tokens) / rate
+
+    def prune(self, now):
+        self.buckets = {
+            key: state for key, state in self.buckets.items() if state[2] > now
+        }
+        self.next_prune = now + self.prune_interval
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+            self.next_prune = 0
+
+
+class RedisBuckets:
+    # Shared buckets for multiple nodes. The refill and take run atomically in
+    # one script using the Redis clock, so nodes never disagree on time.
+    blocking = True
+    script = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.take_script = self.client.register_script(self.script)
+
+    def take(self, key, capacity, rate):
+        allowed, wait = self.take_script(
+            keys=[f"ratelimit:{key}"], args=[capacity, rate]
+        )
+        return bool(allowed), float(wait)
+
+    def reset(self):
+        for key in self.client.scan_iter("ratelimit:*"):
+            self.client.delete(key)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    if settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisBuckets(settings.RATE_LIMIT_REDIS_URL)
+    return LocalBuckets()
+
+
+def take(scope, ident):
+    limit = settings.RATE_LIMITS.get(scope)
+    if limit is None:
+        return True, 0
+    return get_backend().take(f"{scope}:{ident}", limit["capacity"], limit["rate"])
+
+
+async def atake(scope, ident):
+    if get_backend().blocking:
+        return await sync_to_async(take, thread_sensitive=False)(scope, ident)
+    return take(scope, ident)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Limits writes to views that set ``throttle_scope`` (a key of
+    settings.RATE_LIMITS). Reads are never throttled.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if scope is None or request.method in SAFE_METHODS:
+            return True
+        if request.user.is_authenticated:
+            ident = f"user:{request.user.id}"
+        else:
+            ident = f"ip:{self.get_ident(request)}"
+        allowed, self.retry_after = take(scope, ident)
+        return allowed
+
+    def wait(self):
+        return math.ceil(self.retry_after)
@@ -0,0 +1,280 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+from django.utils import timezone
+from .models import Post
+
+# Hotness ranking for the trending feed. An engagement of weight w at time t
+# is worth w * 2 ** ((t - EPOCH) / TRENDING_HALF_LIFE), so older engagement
+# counts for half as much every half-life relative to newer engagement and
+# stored scores never have to be decayed. Scores are kept as base 2 logs to
+# stay within float range, which makes adding an engagement a log-add.
+#
+# Post.hot_score is the durable copy. Engagement boosts are queued when
+# their transaction commits and a background thread applies them every
+# TRENDING_FLUSH_SECONDS, one locked read and one bulk update per batch, so
+# engagement writes never wait on the post row. Boosts still queued when the
+# process exits are lost. The TRENDING_SIZE best posts are also kept in a
+# top-K store so the feed is read without touching the index; a cold store is
+# rebuilt from hot_score. Removing a like, comment or save takes back the
+# boost it added, so toggling one leaves the score where it was.
+
+EPOCH = 1_600_000_000
+
+logger = logging.getLogger(__name__)
+
+_pending = {}
+_pending_lock = threading.Lock()
+_worker = None
+
+
+def boost(weight, at):
+    return math.log2(weight) + (at.timestamp() - EPOCH) / settings.TRENDING_HALF_LIFE
+
+
+def combine(score, other):
+    if score is None:
+        return other
+    high, low = max(score, other), min(score, other)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def subtract(score, other):
+    # Inverse of combine(). Engagement scored before it was tracked (by
+    # migration 0008) can be worth more than the score; removing it then
+    # leaves the score alone.
+    if score is None or other is None or other >= score:
+        return score
+    return score + math.log2(1 - 2 ** (other - score))
+
+
+def top_posts(size):
+    return list(
+        Post.objects.filter(hot_score__isnull=False)
+        .order_by("-hot_score")
+        .values_list("id", "hot_score")[:size]
+    )
+
+
+class LocalTopK:
+    # Per-process ranking for tests and single-node deployments: a list of
+    # (-score, post_id) kept sorted with bisect, trimmed to TRENDING_SIZE.
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.ranking = []
+        self.scores = {}
+        self.loaded = False
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.rebuild()
+
+    def rebuild(self):
+        rows = top_posts(self.size)
+        with self.lock:
+            self.scores = dict(rows)
+            self.ranking = sorted((-score, post_id) for post_id, score in rows)
+            self.loaded = True
+
+    def offer(self, post_id, score):
+        if not self.loaded:
+            return
+        with self.lock:
+            self._discard(post_id)
+            if len(self.ranking) >= self.size and -score >= self.ranking[-1][0]:
+                return
+            bisect.insort(self.ranking, (-score, post_id))
+            self.scores[post_id] = score
+            if len(self.ranking) > self.size:
+                _, evicted = self.ranking.pop()
+                del self.scores[evicted]
+
+    def discard(self, post_id):
+        if not self.loaded:
+            return
+        with self.lock:
+            self._discard(post_id)
+
+    def _discard(self, post_id):
+        score = self.scores.pop(post_id, None)
+        if score is None:
+            return
+        position = bisect.bisect_left(self.ranking, (-score, post_id))
+        if position < len(self.ranking) and self.ranking[position][1] == post_id:
+            del self.ranking[position]
+
+    def top(self, limit):
+        self.ensure_loaded()
+        return [post_id for _, post_id in self.ranking[:limit]]
+
+    def reset(self):
+        with self.lock:
+            self.ranking = []
+            self.scores = {}
+            self.loaded = False
+
+
+class RedisTopK:
+    # A sorted set shared by every node, trimmed to TRENDING_SIZE members.
+    key = "trending:posts"
+
+    def __init__(self, url, size):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.size = size
+
+    def ensure_loaded(self):
+        if not self.client.exists(self.key):
+            self.rebuild()
+
+    def rebuild(self):
+        rows = top_posts(self.size)
+        with self.client.pipeline() as pipe:
+            pipe.delete(self.key)
+            if rows:
+                pipe.zadd(self.key, dict(rows))
+            pipe.execute()
+
+    def offer(self, post_id, score):
+        # A missing set is rebuilt whole on the next read instead.
+        if not self.client.exists(self.key):
+            return
+        with self.client.pipeline() as pipe:
+            pipe.zadd(self.key, {post_id: score})
+            pipe.zremrangebyrank(self.key, 0, -self.size - 1)
+            pipe.execute()
+
+    def discard(self, post_id):
+        self.client.zrem(self.key, post_id)
+
+    def top(self, limit):
+        self.ensure_loaded()
+        return [
+            int(post_id) for post_id in self.client.zrevrange(self.key, 0, limit - 1)
+        ]
+
+    def reset(self):
+        self.client.delete(self.key)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    if settings.TRENDING_BACKEND == "redis":
+        return RedisTopK(settings.TRENDING_REDIS_URL, settings.TRENDING_SIZE)
+    return LocalTopK(settings.TRENDING_SIZE)
+
+
+def initial_score(post):
+    return boost(settings.TRENDING_WEIGHTS["post"], post.created_at or timezone.now())
+
+
+def score_posts(posts, batch_size=1000):
+    # For posts written without the pre_save signal, e.g. bulk inserted. As in
+    # migration 0008, their engagement counts as if it happened when the post
+    # was created.
+    weights = settings.TRENDING_WEIGHTS
+    posts = posts.annotate(
+        likes=models.Count("post_likes", distinct=True),
+        comments=models.Count("post_comments", distinct=True),
+        saves=models.Count("save_post", distinct=True),
+    ).order_by()
+    batch = []
+    for post in posts.only("id", "created_at").iterator(chunk_size=batch_size):
+        weight = (
+            weights["post"]
+            + weights["like"] * post.likes
+            + weights["comment"] * post.comments
+            + weights["save"] * post.saves
+        )
+        post.hot_score = boost(weight, post.created_at)
+        batch.append(post)
+        if len(batch) == batch_size:
+            Post.all_objects.bulk_update(batch, ["hot_score"])
+            batch = []
+    Post.all_objects.bulk_update(batch, ["hot_score"])
+    get_backend().reset()
+
+
+def record(post_id, kind, at=None):
+    record_many(kind, [(post_id, at or timezone.now())])
+
+
+def record_many(kind, engagements, removed=False):
+    # ``engagements`` are (post_id, engaged at) pairs. A removal is scored at
+    # the time of the engagement it undoes.
+    weight = settings.TRENDING_WEIGHTS[kind]
+    boosts = {}
+    for post_id, at in engagements:
+        boosts[post_id] = combine(boosts.get(post_id), boost(weight, at))
+    if boosts:
+        transaction.on_commit(lambda: _enqueue(boosts, removed))
+
+
+def _enqueue(boosts, removed=False):
+    global _worker
+    with _pending_lock:
+        for post_id, score in boosts.items():
+            pending = _pending.setdefault(post_id, [None, None])
+            pending[removed] = combine(pending[removed], score)
+    if not settings.TRENDING_FLUSH_SECONDS:
+        flush()
+        return
+    with _pending_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="trending-worker", daemon=True)
+            _worker.start()
+
+
+def _run():
+    while True:
+        time.sleep(settings.TRENDING_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Applying trending boosts failed")
+        finally:
+            close_old_connections()
+
+
+def flush():
+    with _pending_lock:
+        boosts = dict(_pending)
+        _pending.clear()
+    if not boosts:
+        return
+    with transaction.atomic():
+        posts = list(
+            Post.objects.select_for_update()
+            .filter(id__in=boosts)
+            .order_by("id")
+            .only("id", "hot_score")
+        )
+        for post in posts:
+            added, removed = boosts[post.id]
+            post.hot_score = subtract(
+                combine(post.hot_score, added) if added else post.hot_score, removed
+            )
+        Post.objects.bulk_update(posts, ["hot_score"])
+    backend = get_backend()
+    for post in posts:
+        backend.offer(post.id, post.hot_score)
+
+
+def offer_later(post_id, score):
+    transaction.on_commit(lambda: get_backend().offer(post_id, score))
+
+
+def discard_later(post_id):
+    transaction.on_commit(lambda: get_backend().discard(post_id))
+
+
+def trending_ids(limit):
+    return get_backend().top(max(1, min(limit, settings.TRENDING_SIZE)))
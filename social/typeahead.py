@@ -0,0 +1,198 @@
+import bisect
+import re
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from FriendNet_Backend import metrics
+
+
+MENTION_PATTERN = re.compile(r"(?<![\w@])@(\w[\w.@+-]*)")
+
+# Username changes are published to a journal in the shared cache, so every
+# process's index catches up with the others: JOURNAL_VERSION counts the
+# changes and each one is stored under its number for
+# USERNAME_JOURNAL_TIMEOUT seconds.
+JOURNAL_VERSION = "usernames:version"
+
+
+def _journal_key(version):
+    return f"usernames:change:{version}"
+
+
+def publish_username(user_id, username):
+    # ``username`` is None for deleted users.
+    cache.add(JOURNAL_VERSION, 0, timeout=None)
+    version = cache.incr(JOURNAL_VERSION)
+    cache.set(
+        _journal_key(version), (user_id, username), settings.USERNAME_JOURNAL_TIMEOUT
+    )
+
+
+class UsernameIndex:
+    # Sorted array of lowercased usernames, searched with bisect. Each process
+    # keeps its own copy; it is built lazily on first use and kept current by
+    # the user signals in social/signals.py and the journal of changes made
+    # by other processes.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = {}
+        self._keys_by_id = {}
+        self._loaded = False
+        self._version = 0
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.rebuild()
+        else:
+            self.sync()
+
+    def sync(self):
+        current = cache.get(JOURNAL_VERSION, 0)
+        applied = self._version
+        if current == applied:
+            return
+        if not 0 < current - applied <= settings.USERNAME_JOURNAL_MAX:
+            self.rebuild()
+            return
+        keys = [_journal_key(version) for version in range(applied + 1, current + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            # Expired, or the cache was cleared.
+            self.rebuild()
+            return
+        for key in keys:
+            user_id, username = changes[key]
+            if username is None:
+                self.remove(user_id)
+            else:
+                self.add(user_id, username)
+        with self._lock:
+            self._version = max(self._version, current)
+
+    def rebuild(self):
+        # Changes published while the rows are read are applied again by
+        # the next sync, which is harmless. Loading happens once per process,
+        # so it is left out of the query budget of the request that needed it.
+        version = cache.get(JOURNAL_VERSION, 0)
+        User = get_user_model()
+        rows = User.objects.values_list("id", "username").iterator(chunk_size=5000)
+        entries = {}
+        keys_by_id = {}
+        with metrics.untracked():
+            for user_id, username in rows:
+                key = self._key(username)
+                entries[key] = (user_id, username)
+                keys_by_id[user_id] = key
+        with self._lock:
+            self._entries = entries
+            self._keys_by_id = keys_by_id
+            self._keys = sorted(entries)
+            self._loaded = True
+            self._version = version
+
+    def add(self, user_id, username):
+        if not self._loaded:
+            return
+        key = self._key(username)
+        with self._lock:
+            self._discard(user_id)
+            self._entries[key] = (user_id, username)
+            self._keys_by_id[user_id] = key
+            bisect.insort(self._keys, key)
+
+    def remove(self, user_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._discard(user_id)
+
+    @staticmethod
+    def _key(username):
+        # Usernames are unique case-sensitively, so the original spelling is
+        # kept after a separator that sorts before every other character.
+        return f"{username.lower()}\x00{username}"
+
+    def _discard(self, user_id):
+        key = self._keys_by_id.pop(user_id, None)
+        if key is None:
+            return
+        self._entries.pop(key, None)
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def prefix(self, prefix, limit):
+        self.ensure_loaded()
+        prefix = prefix.lower()
+        keys = self._keys
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\uffff", start)
+        entries = self._entries
+        return [entries[key] for key in keys[start : min(end, start + limit)]]
+
+    def matching(self, user_ids, prefix):
+        # The given users whose username starts with ``prefix``.
+        self.ensure_loaded()
+        prefix = prefix.lower()
+        keys_by_id = self._keys_by_id
+        entries = self._entries
+        return [
+            entries[keys_by_id[user_id]]
+            for user_id in user_ids
+            if user_id in keys_by_id and keys_by_id[user_id].startswith(prefix)
+        ]
+
+    def resolve(self, username):
+        self.ensure_loaded()
+        entry = self._entries.get(self._key(username))
+        if entry is None:
+            matches = self.prefix(f"{username}\x00", 1)
+            entry = matches[0] if matches else None
+        return entry[0] if entry else None
+
+
+username_index = UsernameIndex()
+
+
+def rank_candidates(candidates, user_id, friend_ids, pending_ids, fof_ids, limit):
+    # Friends first, then people with a pending request, then friends of
+    # friends, then everyone else. Ranking stops scanning once the latency
+    # budget is spent.
+    deadline = time.perf_counter() + settings.TYPEAHEAD_BUDGET_MS / 1000
+    ranked = []
+    seen = {user_id}
+    for candidate_id, username in candidates:
+        if candidate_id in seen:
+            continue
+        seen.add(candidate_id)
+        if candidate_id in friend_ids:
+            proximity = 0
+        elif candidate_id in pending_ids:
+            proximity = 1
+        elif candidate_id in fof_ids:
+            proximity = 2
+        else:
+            proximity = 3
+        ranked.append((proximity, len(username), username.lower(), candidate_id))
+        if time.perf_counter() > deadline:
+            break
+    ranked.sort()
+    return [candidate_id for *_, candidate_id in ranked[:limit]]
+
+
+def extract_mentions(text):
+    if not text or "@" not in text:
+        return []
+    mentions = []
+    for match in MENTION_PATTERN.finditer(text):
+        name = match.group(1)
+        user_id = username_index.resolve(name)
+        if user_id is None:
+            user_id = username_index.resolve(name.rstrip("."))
+        if user_id is not None and user_id not in mentions:
+            mentions.append(user_id)
+    return mentions
@@ -1,5 +1,6 @@
+from django.urls import path
 from rest_framework_nested import routers
-from . import views
+from . import async_views, views
 
 
 router = routers.DefaultRouter()
@@ -13,6 +14,8 @@ router.register('save', views.ListSavedPostViewSet, basename='saved-posts')
 
 router.register('chat', views.ChatRoomViewSet, basename='chat')
 router.register('group', views.GroupViewSet)
+router.register('notifications', views.NotificationViewSet, basename='notifications')
+router.register('sync', views.SyncViewSet, basename='sync')
 
 post_routes = routers.NestedDefaultRouter(router, 'posts', lookup='post')
 post_routes.register('likes', views.LikePostViewSet, basename='post-likes')
@@ -26,4 +29,11 @@ group_routes = routers.NestedDefaultRouter(router, 'group', lookup='group')
 group_routes.register('messages', views.GroupMessageViewSet, basename='group-message')
 group_routes.register('members', views.GroupMemberViewSet, basename='group-members')
 
-urlpatterns = router.urls + post_routes.urls + chat_routes.urls + group_routes.urls
\ No newline at end of file
+async_urls = [
+    path('async/feed/', async_views.feed, name='async-feed'),
+    path('async/inbox/', async_views.inbox, name='async-inbox'),
+    path('async/chat/<int:room_id>/messages/', async_views.chat_history, name='async-chat-history'),
+    path('async/group/<int:group_id>/messages/', async_views.group_history, name='async-group-history'),
+]
+
+urlpatterns = router.urls + post_routes.urls + chat_routes.urls + group_routes.urls + async_urls
\ No newline at end of file
@@ -1,5 +1,10 @@
+import logging
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from .membership import socket_group
+
+logger = logging.getLogger(__name__)
+
 
 class NotificationUtility:
     @staticmethod
@@ -9,3 +14,31 @@ class NotificationUtility:
             "type": "file_uploaded",
             "file": file_info
         })
+
+    @staticmethod
+    def members_changed(room_type, room_id, added=(), removed=()):
+        event = {
+            "type": "members_changed",
+            "room_type": room_type,
+            "room_id": room_id,
+            "added": list(added),
+            "removed": list(removed),
+        }
+        # New members' sockets are not in the room's channel group yet.
+        async def send():
+            channel_layer = get_channel_layer()
+            await channel_layer.group_send(str(room_id), event)
+            for user_id in added:
+                await channel_layer.group_send(socket_group(room_type, user_id), event)
+
+        try:
+            async_to_sync(send)()
+        except Exception:
+            # Runs after the membership change commits; sockets pick it up on
+            # their next connect.
+            logger.warning(
+                "Could not send members_changed for %s %s",
+                room_type,
+                room_id,
+                exc_info=True,
+            )
@@ -1,8 +1,12 @@
-import os
 from itertools import chain
+from django.conf import settings
 from django.db.models import Q
 from django.db.models import Prefetch
 from django.db.models.aggregates import Count
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
@@ -12,16 +16,37 @@ from rest_framework import status
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
+from . import (
+    archive,
+    caching,
+    changes,
+    deletion,
+    export,
+    fastpath,
+    trending,
+)
 from .utils import NotificationUtility
+from .typeahead import rank_candidates, username_index
 from .filters import GroupFilter, PostFilter
-from .permissions import IsChatRoomMember
+from .pagination import (
+    GroupDiscoveryPagination,
+    MemberPagination,
+    NotificationPagination,
+    before,
+    message_page,
+    page_args,
+)
+from .permissions import IsChatRoomMember, IsGroupMember
 from .models import (
     ChatMessage,
+    ChatMessageArchive,
     ChatRoom,
     Comment,
     Friend,
     Group,
     GroupMessages,
+    GroupMessagesArchive,
+    Notification,
     Post,
     Like,
     Save,
@@ -30,6 +55,8 @@ from .models import (
 )
 from .serializers import (
     AddMembersSerializer,
+    BulkEngagementSerializer,
+    BulkMembersSerializer,
     ChatMessageSerializer,
     ChatRoomSerializer,
     CommentSerializer,
@@ -38,17 +65,22 @@ from .serializers import (
     FriendRequestSerializer,
     LikePostSerializer,
     ListPostSerializer,
+    MarkReadSerializer,
+    NotificationSerializer,
     PostSerializer,
     FriendRequestDecisionSerializer,
     SavePostSerializer,
+    TrendingQuerySerializer,
     UpdatePostSerializer,
     UserProfileSerializer,
     UserSerializer,
+    delete_engagement,
 )
 
 
 class PeopleViewSet(ModelViewSet):
     http_method_names = ["get", "put", "delete", "head", "options"]
+    query_budget = {"list": 4, "retrieve": 3, "me": 3, "typeahead": 5, "export": 12}
     serializer_class = UserProfileSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter]
     search_fields = ["user__username"]
@@ -63,15 +95,93 @@ class PeopleViewSet(ModelViewSet):
         return queryset.exclude(Q(user_id__in=friend_id) | Q(user_id=user_id))
 
     def get_permissions(self):
-        if self.action != "me":
+        if self.action not in ("me", "typeahead", "export"):
             return [DjangoModelPermissionsOrAnonReadOnly()]
         return super().get_permissions()
 
     def get_serializer_context(self):
         return {"request": self.request}
 
+    @action(detail=False, methods=["GET"])
+    def typeahead(self, request):
+        query = request.query_params.get("q", "").strip().lstrip("@")
+        if not query:
+            return Response([])
+        user_id = request.user.id
+        through = Friend.friends.through
+
+        def friends_of(user_ids):
+            return set(
+                through.objects.filter(friend__user_id__in=user_ids).values_list(
+                    "userprofile_id", flat=True
+                )
+            )
+
+        # Both sets are read on every keystroke, so they are cached until the
+        # user's or one of their friends' friendships change.
+        friend_ids = caching.cached_value(
+            [caching.friends_scope(user_id)],
+            f"friend_ids:{user_id}",
+            lambda: friends_of([user_id]),
+        )
+        pending_ids = set(
+            chain(
+                *FriendRequest.objects.filter(
+                    Q(sender_id=user_id) | Q(receiver_id=user_id), is_accepted=False
+                ).values_list("receiver_id", "sender_id")
+            )
+        )
+        fof_ids = caching.cached_value(
+            [caching.friends_scope(id) for id in [user_id, *sorted(friend_ids)]],
+            f"friends_of_friends:{user_id}",
+            lambda: friends_of(friend_ids),
+        )
+        # People close to the user are always candidates, however far down
+        # the alphabet they are; the rest is filled in alphabetically.
+        candidates = chain(
+            username_index.matching(friend_ids | pending_ids | fof_ids, query),
+            username_index.prefix(query, settings.TYPEAHEAD_MAX_CANDIDATES),
+        )
+        ranked_ids = rank_candidates(
+            candidates,
+            user_id,
+            friend_ids,
+            pending_ids,
+            fof_ids,
+            settings.TYPEAHEAD_LIMIT,
+        )
+        profiles = UserProfile.objects.select_related("user").in_bulk(ranked_ids)
+        serializer = UserSerializer(
+            [profiles[id] for id in ranked_ids if id in profiles],
+            many=True,
+            context={"request": request},
+        )
+        return Response(serializer.data)
+
     @action(detail=False, methods=["GET", "PUT", "DELETE"])
     def me(self, request):
+        if request.method == "GET":
+            return caching.cached_response(
+                request,
+                [caching.profile_scope(request.user.id)],
+                lambda: self._me(request),
+            )
+        return self._me(request)
+
+    @action(detail=False, methods=["GET"], url_path="me/export")
+    def export(self, request):
+        user_id = request.user.id
+        if isinstance(request._request, ASGIRequest):
+            lines = export.aexport_lines(user_id)
+        else:
+            lines = export.export_lines(user_id)
+        response = StreamingHttpResponse(lines, content_type="application/x-ndjson")
+        response["Content-Disposition"] = (
+            f'attachment; filename="friendnet-{request.user.username}.ndjson"'
+        )
+        return response
+
+    def _me(self, request):
         user = UserProfile.objects.select_related("user").get(user_id=request.user.id)
         if request.method == "GET":
             serializer = UserProfileSerializer(user, context={"request": request})
@@ -87,6 +197,7 @@ class PeopleViewSet(ModelViewSet):
 
 class UserFriendViewSet(ModelViewSet):
     http_method_names = ["get", "delete"]
+    query_budget = {"list": 5, "retrieve": 5}
     serializer_class = UserProfileSerializer
 
     def get_queryset(self):
@@ -105,6 +216,14 @@ class UserFriendViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {"user_id": self.request.user.id, "request": self.request}
 
+    def list(self, request, *args, **kwargs):
+        user_id = request.query_params.get("user_id") or request.user.id
+        return caching.cached_response(
+            request,
+            [caching.friends_scope(user_id)],
+            lambda: super(UserFriendViewSet, self).list(request, *args, **kwargs),
+        )
+
     def destroy(self, request, *args, **kwargs):
         my_friend = self.get_object()
         user_profile = request.user.profile
@@ -115,6 +234,7 @@ class UserFriendViewSet(ModelViewSet):
 
 class FriendRequestViewSet(ModelViewSet):
     http_method_names = ["get", "post", "delete"]
+    throttle_scope = "friend_request"
 
     serializer_class = FriendRequestSerializer
 
@@ -161,11 +281,21 @@ class FriendRequestDecisionViewSet(ModelViewSet):
 
 class ListPostViewSet(ModelViewSet):
     queryset = Post.objects.with_counts()
+    query_budget = {
+        "list": 6,
+        "retrieve": 6,
+        "trending": 6,
+        "bulk_like": 21,
+        "bulk_save": 9,
+    }
+    throttle_scope = "post"
     serializer_class = ListPostSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_class = PostFilter
 
     def get_serializer_class(self):
+        if self.action in ("bulk_like", "bulk_save"):
+            return BulkEngagementSerializer
         if self.request.method == "POST":
             return PostSerializer
         elif self.request.method == "PUT":
@@ -175,6 +305,57 @@ class ListPostViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {"user_id": self.request.user.id, "request": self.request}
 
+    def initial(self, request, *args, **kwargs):
+        # Only creating posts counts against the "post" limit.
+        if self.action in ("bulk_like", "bulk_save"):
+            self.throttle_scope = "like"
+        elif self.action != "create":
+            self.throttle_scope = None
+        super().initial(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        # Newest first, paged with ``?before=<id of the last post>&limit=<n>``.
+        before_id, limit = page_args(request.query_params)
+        posts = before(self.filter_queryset(Post.objects.all()), before_id)
+        post_ids = list(posts.values_list("id", flat=True)[:limit])
+        return self._cached_posts(request, post_ids)
+
+    @action(detail=False, methods=["GET"])
+    def trending(self, request):
+        query = TrendingQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        post_ids = trending.trending_ids(query.validated_data["limit"])
+        return self._cached_posts(request, post_ids)
+
+    def _cached_posts(self, request, post_ids):
+        return caching.cached_list_response(
+            request,
+            "post",
+            post_ids,
+            caching.post_scope,
+            [],
+            lambda ids: self._posts(request, ids),
+        )
+
+    def _posts(self, request, post_ids):
+        queryset = self.get_queryset().filter(id__in=post_ids)
+        if settings.FAST_READ_SERIALIZERS:
+            return fastpath.post_list(queryset, request)
+        return self.get_serializer(queryset, many=True).data
+
+    @action(detail=False, methods=["POST"], url_path="likes")
+    def bulk_like(self, request):
+        return self._bulk_engagement(request, Like)
+
+    @action(detail=False, methods=["POST"], url_path="saves")
+    def bulk_save(self, request):
+        return self._bulk_engagement(request, Save)
+
+    def _bulk_engagement(self, request, model):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.apply(model), status=status.HTTP_200_OK)
+
     def update(self, request, *args, **kwargs):
         post = self.get_object()
         if request.user.id != post.user_id:
@@ -191,10 +372,10 @@ class ListPostViewSet(ModelViewSet):
                 {"detail": "you don't have permission to delete this post."},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        file_path = post.media_file.path
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        Post.objects.filter(id=post.id).delete()
+        # Hide the post now; its rows and media are purged in the background.
+        post.deleted_at = timezone.now()
+        post.save(update_fields=["deleted_at"])
+        deletion.schedule_purge()
         return Response(
             {"detail": "Post deleted successfully."}, status=status.HTTP_204_NO_CONTENT
         )
@@ -202,6 +383,8 @@ class ListPostViewSet(ModelViewSet):
 
 class CommentViewSet(ModelViewSet):
     serializer_class = CommentSerializer
+    query_budget = {"list": 3, "retrieve": 3}
+    throttle_scope = "comment"
 
     def get_queryset(self):
         return Comment.objects.filter(post_id=self.kwargs["post_pk"]).select_related(
@@ -234,6 +417,7 @@ class LikePostViewSet(ModelViewSet):
     http_method_names = ["get", "post", "delete"]
     serializer_class = LikePostSerializer
     lookup_field = "user_id"
+    throttle_scope = "like"
 
     def get_queryset(self):
         return Like.objects.filter(post_id=self.kwargs["post_pk"]).select_related(
@@ -252,11 +436,15 @@ class LikePostViewSet(ModelViewSet):
             )
         return super().destroy(request, *args, **kwargs)
 
+    def perform_destroy(self, instance):
+        delete_engagement(instance)
+
 
 class SavePostViewSet(ModelViewSet):
     http_method_names = ["get", "post", "delete"]
     serializer_class = SavePostSerializer
     lookup_field = "user_id"
+    throttle_scope = "like"
 
     def get_queryset(self):
         return Save.objects.filter(post_id=self.kwargs["post_pk"]).select_related(
@@ -275,6 +463,9 @@ class SavePostViewSet(ModelViewSet):
             )
         return super().destroy(request, *args, **kwargs)
 
+    def perform_destroy(self, instance):
+        delete_engagement(instance)
+
 
 class ListSavedPostViewSet(ModelViewSet):
     http_method_names = ["get", "delete"]
@@ -286,13 +477,23 @@ class ListSavedPostViewSet(ModelViewSet):
 
 class ChatRoomViewSet(GenericViewSet, ListModelMixin, RetrieveModelMixin):
     serializer_class = ChatRoomSerializer
+    query_budget = {"list": 5, "retrieve": 5}
 
     def get_queryset(self):
         user_profile_qs = UserProfile.objects.select_related("user")
-        return ChatRoom.objects.filter(members=self.request.user.id).prefetch_related(
+        rooms = ChatRoom.objects.filter(members=self.request.user.id)
+        # Only each room's latest message, hot or, failing that, archived.
+        return rooms.prefetch_related(
             Prefetch("members", queryset=user_profile_qs),
             Prefetch(
-                "message", queryset=ChatMessage.objects.select_related("sender__user")
+                "message",
+                queryset=archive.latest_messages(ChatMessage, rooms),
+                to_attr="latest_messages",
+            ),
+            Prefetch(
+                "archived_message",
+                queryset=archive.latest_messages(ChatMessageArchive, rooms),
+                to_attr="latest_archived_messages",
             ),
         )
 
@@ -302,7 +503,9 @@ class ChatRoomViewSet(GenericViewSet, ListModelMixin, RetrieveModelMixin):
 
 class ChatMessagesViewSet(ModelViewSet):
     serializer_class = ChatMessageSerializer
+    query_budget = {"list": 4, "retrieve": 4}
     permission_classes = [IsChatRoomMember]
+    throttle_scope = "chat_message"
 
     def get_queryset(self):
         room_id = self.kwargs["chatroom_pk"]
@@ -313,6 +516,23 @@ class ChatMessagesViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {"user_id": self.request.user.id, "request": self.request}
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        archived = ChatMessageArchive.objects.filter(
+            room_id=self.kwargs["chatroom_pk"]
+        ).select_related("sender__user")
+        if settings.FAST_READ_SERIALIZERS:
+            rows, next_id = message_page(
+                fastpath.chat_message_rows(queryset),
+                fastpath.chat_message_rows(archived),
+                request.query_params,
+            )
+            results = fastpath.build_chat_messages(rows, request)
+        else:
+            messages, next_id = message_page(queryset, archived, request.query_params)
+            results = self.get_serializer(messages, many=True).data
+        return Response({"next": next_id, "results": results})
+
     def create(self, request, *args, **kwargs):
         room_id = self.kwargs["chatroom_pk"]
         user_id = request.user.id
@@ -341,25 +561,50 @@ class ChatMessagesViewSet(ModelViewSet):
 
 class GroupViewSet(ModelViewSet):
     serializer_class = GroupSerializer
-    queryset = (
-        Group.objects.all()
-        .prefetch_related("members__user")
-        .select_related("creator__user")
-    )
+    query_budget = {"list": 4, "retrieve": 4, "discover": 4}
+    queryset = Group.objects.select_related("creator__user")
     filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_class = GroupFilter
     search_fields = ["name", "description"]
 
     def get_queryset(self):
-        user_id = self.request.query_params.get("not_joined")
-        queryset = super().get_queryset()
-        if user_id:
-            queryset = queryset.exclude(members__user_id=user_id)
+        queryset = super().get_queryset().with_member_summary(self.request.user.id)
+        # ``not_joined`` used to take a user id; the groups are now always
+        # those the authenticated user hasn't joined. Filtering on the
+        # is_member annotation compiles to an index-backed NOT EXISTS.
+        if self.action == "discover" or "not_joined" in self.request.query_params:
+            queryset = queryset.filter(is_member=False)
         return queryset
 
     def get_serializer_context(self):
         return {"user_id": self.request.user.id, "request": self.request}
 
+    def list(self, request, *args, **kwargs):
+        groups = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        group_ids = groups.values_list("id", flat=True)
+        return caching.cached_response(
+            request,
+            [caching.GROUPS, *[caching.group_scope(id) for id in group_ids]],
+            lambda: super(GroupViewSet, self).list(request, *args, **kwargs),
+        )
+
+    @action(
+        detail=False,
+        methods=["GET"],
+        permission_classes=[IsAuthenticated],
+        pagination_class=GroupDiscoveryPagination,
+    )
+    def discover(self, request):
+        friend_counts = None
+        if request.query_params.get("rank") == "friends":
+            friend_counts = caching.friend_group_counts(request.user.id)
+        queryset = self.filter_queryset(self.get_queryset()).ranked_for_discovery(
+            friend_counts
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         if instance.creator_id != request.user.id:
@@ -381,23 +626,57 @@ class GroupViewSet(ModelViewSet):
 
 class GroupMemberViewSet(ModelViewSet):
     http_method_names = ["get", "post", "delete"]
+    query_budget = {"list": 4, "bulk_add": 7, "bulk_remove": 8}
+    pagination_class = MemberPagination
 
     def get_queryset(self):
-        group_id = self.kwargs["group_pk"]
-        user_profile_qs = UserProfile.objects.select_related("user")
         return (
-            Group.objects.prefetch_related(
-                Prefetch("members", queryset=user_profile_qs)
-            )
-            .get(id=group_id)
-            .members.all()
+            UserProfile.objects.filter(group=self.kwargs["group_pk"])
+            .select_related("user")
+            .order_by("user_id")
         )
 
     def get_serializer_class(self):
+        if self.action in ("bulk_add", "bulk_remove"):
+            return BulkMembersSerializer
         if self.request.method == "POST":
             return AddMembersSerializer
         return UserSerializer
 
+    @action(detail=False, methods=["POST"], url_path="bulk-add")
+    def bulk_add(self, request, group_pk=None):
+        group = get_object_or_404(Group, id=group_pk)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data["user_ids"]
+        # Only the creator adds others; anyone else may only join.
+        if group.creator_id != request.user.id and user_ids != [request.user.id]:
+            return Response(
+                {"detail": "You don't have permission to perform this action."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        added = serializer.add()
+        return Response({"added": added}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["POST"], url_path="bulk-remove")
+    def bulk_remove(self, request, group_pk=None):
+        group = get_object_or_404(Group, id=group_pk)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data["user_ids"]
+        if group.creator_id != request.user.id and user_ids != [request.user.id]:
+            return Response(
+                {"detail": "You don't have permission to perform this action."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        if group.creator_id in user_ids:
+            return Response(
+                {"detail": "The group creator can't be removed from the group."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        removed = serializer.remove()
+        return Response({"removed": removed}, status=status.HTTP_200_OK)
+
     def get_serializer_context(self):
         return {"group_id": self.kwargs["group_pk"], "request": self.request}
 
@@ -433,6 +712,9 @@ class GroupMemberViewSet(ModelViewSet):
 
 class GroupMessageViewSet(ModelViewSet):
     serializer_class = GroupMessagesSerializer
+    permission_classes = [IsGroupMember]
+    query_budget = {"list": 3, "retrieve": 3}
+    throttle_scope = "chat_message"
 
     def get_queryset(self):
         return GroupMessages.objects.filter(
@@ -442,6 +724,23 @@ class GroupMessageViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {"request": self.request}
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        archived = GroupMessagesArchive.objects.filter(
+            room_id=self.kwargs["group_pk"]
+        ).select_related("sender__user")
+        if settings.FAST_READ_SERIALIZERS:
+            rows, next_id = message_page(
+                fastpath.group_message_rows(queryset),
+                fastpath.group_message_rows(archived),
+                request.query_params,
+            )
+            results = fastpath.build_group_messages(rows, request)
+        else:
+            messages, next_id = message_page(queryset, archived, request.query_params)
+            results = self.get_serializer(messages, many=True).data
+        return Response({"next": next_id, "results": results})
+
     def create(self, request, *args, **kwargs):
         room_id = kwargs["group_pk"]
         user_id = request.user.id
@@ -473,3 +772,59 @@ class GroupMessageViewSet(ModelViewSet):
         NotificationUtility.file_uploaded(file_info)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class NotificationViewSet(GenericViewSet, ListModelMixin):
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+    query_budget = {"list": 4, "unread_count": 2, "mark_read": 2}
+
+    def get_queryset(self):
+        return Notification.objects.filter(
+            recipient_id=self.request.user.id
+        ).select_related("actor__user")
+
+    def get_serializer_context(self):
+        return {"request": self.request}
+
+    @action(detail=False, methods=["GET"], url_path="unread-count")
+    def unread_count(self, request):
+        count = Notification.objects.filter(
+            recipient_id=request.user.id, is_read=False
+        ).count()
+        return Response({"unread_count": count})
+
+    @action(detail=False, methods=["POST"], url_path="mark-read")
+    def mark_read(self, request):
+        serializer = MarkReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = Notification.objects.filter(
+            recipient_id=request.user.id, is_read=False
+        )
+        if "ids" in serializer.validated_data:
+            queryset = queryset.filter(id__in=serializer.validated_data["ids"])
+        # update() leaves updated_at alone, so read notifications keep their
+        # place in the list.
+        updated = queryset.update(is_read=True)
+        return Response({"updated": updated})
+
+
+class SyncViewSet(GenericViewSet):
+    query_budget = {"list": 3}
+
+    def list(self, request):
+        # Without a token the client starts from a full fetch of its lists.
+        since = request.query_params.get("since")
+        if since is None:
+            return Response({"token": changes.current_token(), "resync": True})
+        try:
+            return Response(changes.changes_since(request.user.id, since))
+        except changes.ResyncRequired:
+            return Response(
+                {
+                    "detail": "Sync token has expired. Refetch and sync again.",
+                    "token": changes.current_token(),
+                    "resync": True,
+                },
+                status=status.HTTP_410_GONE,
+            )